@@ -0,0 +1,849 @@
+"""
+分类和后处理热点函数的微基准：与逐个循环(逐项扫描)的参考实现比较结果是否一致以及耗时
+用法: python demo/benchmark.py magic_model --repeat 20
+"""
+import copy
+import json
+import os
+import random
+import tempfile
+import time
+
+import click
+import numpy as np
+
+from magic_pdf.libs.boxbase import (
+    _is_in,
+    _is_part_overlap,
+    bbox_distance,
+    bbox_relative_pos,
+    calculate_iou,
+    calculate_overlap_area_in_bbox1_area_ratio,
+    get_minbox_if_overlap_by_ratio,
+)
+from magic_pdf.filter.pdf_classify_by_type import classify
+from magic_pdf.filter.pdf_meta_scan import (
+    get_image_info,
+    get_imgs_per_page,
+    get_language,
+    get_pdf_page_size_pts,
+    get_pdf_text_layout_per_page,
+    get_pdf_textlen_per_page,
+    scan_pdf_features,
+    select_scan_page_ids,
+)
+from magic_pdf.libs.commons import fitz
+from magic_pdf.libs.coordinate_transform import get_scale_ratio
+from magic_pdf.libs.drop_tag import DropTag
+from magic_pdf.libs.local_math import float_gt
+from magic_pdf.libs.pdf_check import detect_invalid_chars
+from magic_pdf.libs.pdf_text_layer import PdfTextLayer
+from magic_pdf.model.magic_model import CAPATION_OVERLAP_AREA_RATIO, MagicModel
+from magic_pdf.pdf_parse_union_core import pdf_parse_union
+from magic_pdf.pre_proc.ocr_dict_merge import fill_spans_in_blocks
+from magic_pdf.pre_proc.ocr_span_list_modify import remove_overlaps_low_confidence_spans, remove_overlaps_min_spans
+from magic_pdf.rw.DiskReaderWriter import DiskReaderWriter
+
+current_script_dir = os.path.dirname(os.path.abspath(__file__))
+DEMO_NAMES = ["demo1", "demo2"]
+
+
+def load_demo(demo_name):
+    pdf_bytes = open(os.path.join(current_script_dir, f"{demo_name}.pdf"), "rb").read()
+    model_list = json.loads(open(os.path.join(current_script_dir, f"{demo_name}.json"), "r", encoding="utf-8").read())
+    return fitz.open("pdf", pdf_bytes), model_list
+
+
+def timeit(func, repeat, setup=None):
+    """
+    返回每次调用的平均耗时(ms)和最后一次的返回值，setup的返回值作为func的参数，不计入耗时
+    """
+    elapsed = 0.0
+    result = None
+    for _ in range(repeat):
+        args = setup() if setup is not None else ()
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed += time.perf_counter() - start
+    return elapsed / repeat * 1000, result
+
+
+def reference_fix_layout_dets(model_list, docs):
+    """
+    MagicModel中__fix_axis、__fix_by_remove_low_confidence、__fix_by_remove_high_iou_and_low_confidence的逐个循环实现
+    """
+    for model_page_info in model_list:
+        need_remove_list = []
+        page_no = model_page_info["page_info"]["page_no"]
+        horizontal_scale_ratio, vertical_scale_ratio = get_scale_ratio(model_page_info, docs[page_no])
+        layout_dets = model_page_info["layout_dets"]
+        for layout_det in layout_dets:
+            if layout_det.get("bbox") is not None:
+                x0, y0, x1, y1 = layout_det["bbox"]
+            else:
+                x0, y0, _, _, x1, y1, _, _ = layout_det["poly"]
+            bbox = [
+                int(x0 / horizontal_scale_ratio),
+                int(y0 / vertical_scale_ratio),
+                int(x1 / horizontal_scale_ratio),
+                int(y1 / vertical_scale_ratio),
+            ]
+            layout_det["bbox"] = bbox
+            if bbox[2] - bbox[0] <= 0 or bbox[3] - bbox[1] <= 0:
+                need_remove_list.append(layout_det)
+        for need_remove in need_remove_list:
+            layout_dets.remove(need_remove)
+
+    for model_page_info in model_list:
+        layout_dets = model_page_info["layout_dets"]
+        need_remove_list = [layout_det for layout_det in layout_dets if layout_det["score"] <= 0.05]
+        for need_remove in need_remove_list:
+            layout_dets.remove(need_remove)
+
+    for model_page_info in model_list:
+        need_remove_list = []
+        layout_dets = model_page_info["layout_dets"]
+        for layout_det1 in layout_dets:
+            for layout_det2 in layout_dets:
+                if layout_det1 == layout_det2:
+                    continue
+                if layout_det1["category_id"] in range(10) and layout_det2["category_id"] in range(10):
+                    if calculate_iou(layout_det1["bbox"], layout_det2["bbox"]) > 0.9:
+                        if layout_det1["score"] < layout_det2["score"]:
+                            layout_det_need_remove = layout_det1
+                        else:
+                            layout_det_need_remove = layout_det2
+                        if layout_det_need_remove not in need_remove_list:
+                            need_remove_list.append(layout_det_need_remove)
+        for need_remove in need_remove_list:
+            layout_dets.remove(need_remove)
+    return model_list
+
+
+def reference_reduct_overlap(bboxes):
+    N = len(bboxes)
+    keep = [True] * N
+    for i in range(N):
+        for j in range(N):
+            if i == j:
+                continue
+            if _is_in(bboxes[i]["bbox"], bboxes[j]["bbox"]):
+                keep[i] = False
+
+    return [bboxes[i] for i in range(N) if keep[i]]
+
+
+def reference_tie_up_category_by_distance(layout_dets, subject_category_id, object_category_id):
+    """
+    MagicModel中__tie_up_category_by_distance的逐个循环实现
+    """
+    ret = []
+    MAX_DIS_OF_POINT = 10**9 + 7
+
+    # subject 和 object 的 bbox 会合并成一个大的 bbox （named: merged bbox）。 筛选出所有和 merged bbox 有 overlap 且 overlap 面积大于 object 的面积的 subjects。
+    # 再求出筛选出的 subjects 和 object 的最短距离！
+    def may_find_other_nearest_bbox(subject_idx, object_idx):
+        ret = float("inf")
+
+        x0 = min(
+            all_bboxes[subject_idx]["bbox"][0], all_bboxes[object_idx]["bbox"][0]
+        )
+        y0 = min(
+            all_bboxes[subject_idx]["bbox"][1], all_bboxes[object_idx]["bbox"][1]
+        )
+        x1 = max(
+            all_bboxes[subject_idx]["bbox"][2], all_bboxes[object_idx]["bbox"][2]
+        )
+        y1 = max(
+            all_bboxes[subject_idx]["bbox"][3], all_bboxes[object_idx]["bbox"][3]
+        )
+
+        object_area = abs(
+            all_bboxes[object_idx]["bbox"][2] - all_bboxes[object_idx]["bbox"][0]
+        ) * abs(
+            all_bboxes[object_idx]["bbox"][3] - all_bboxes[object_idx]["bbox"][1]
+        )
+
+        for i in range(len(all_bboxes)):
+            if (
+                i == subject_idx
+                or all_bboxes[i]["category_id"] != subject_category_id
+            ):
+                continue
+            if _is_part_overlap([x0, y0, x1, y1], all_bboxes[i]["bbox"]) or _is_in(
+                all_bboxes[i]["bbox"], [x0, y0, x1, y1]
+            ):
+
+                i_area = abs(
+                    all_bboxes[i]["bbox"][2] - all_bboxes[i]["bbox"][0]
+                ) * abs(all_bboxes[i]["bbox"][3] - all_bboxes[i]["bbox"][1])
+                if i_area >= object_area:
+                    ret = min(float("inf"), dis[i][object_idx])
+
+        return ret
+
+    def expand_bbbox(idxes):
+        x0s = [all_bboxes[idx]["bbox"][0] for idx in idxes] 
+        y0s = [all_bboxes[idx]["bbox"][1] for idx in idxes] 
+        x1s = [all_bboxes[idx]["bbox"][2] for idx in idxes] 
+        y1s = [all_bboxes[idx]["bbox"][3] for idx in idxes] 
+        return min(x0s), min(y0s), max(x1s), max(y1s)
+
+    subjects = reference_reduct_overlap(
+        list(
+            map(
+                lambda x: {"bbox": x["bbox"], "score": x["score"]},
+                [x for x in layout_dets if x["category_id"] == subject_category_id],
+            )
+        )
+    )
+
+    objects = reference_reduct_overlap(
+        list(
+            map(
+                lambda x: {"bbox": x["bbox"], "score": x["score"]},
+                [x for x in layout_dets if x["category_id"] == object_category_id],
+            )
+        )
+    )
+    subject_object_relation_map = {}
+
+    subjects.sort(
+        key=lambda x: x["bbox"][0] ** 2 + x["bbox"][1] ** 2
+    )  # get the distance !
+
+    all_bboxes = []
+
+    for v in subjects:
+        all_bboxes.append(
+            {
+                "category_id": subject_category_id,
+                "bbox": v["bbox"],
+                "score": v["score"],
+            }
+        )
+
+    for v in objects:
+        all_bboxes.append(
+            {
+                "category_id": object_category_id,
+                "bbox": v["bbox"],
+                "score": v["score"],
+            }
+        )
+
+    N = len(all_bboxes)
+    dis = [[MAX_DIS_OF_POINT] * N for _ in range(N)]
+
+    for i in range(N):
+        for j in range(i):
+            if (
+                all_bboxes[i]["category_id"] == subject_category_id
+                and all_bboxes[j]["category_id"] == subject_category_id
+            ):
+                continue
+
+            dis[i][j] = bbox_distance(all_bboxes[i]["bbox"], all_bboxes[j]["bbox"])
+            dis[j][i] = dis[i][j]
+
+    used = set()
+    for i in range(N):
+        # 求第 i 个 subject 所关联的 object
+        if all_bboxes[i]["category_id"] != subject_category_id:
+            continue
+        seen = set()
+        candidates = []
+        arr = []
+        for j in range(N):
+
+            pos_flag_count = sum(
+                list(
+                    map(
+                        lambda x: 1 if x else 0,
+                        bbox_relative_pos(
+                            all_bboxes[i]["bbox"], all_bboxes[j]["bbox"]
+                        ),
+                    )
+                )
+            )
+            if pos_flag_count > 1:
+                continue
+            if (
+                all_bboxes[j]["category_id"] != object_category_id
+                or j in used
+                or dis[i][j] == MAX_DIS_OF_POINT
+            ):
+                continue
+            left, right, _, _ = bbox_relative_pos(
+                all_bboxes[i]["bbox"], all_bboxes[j]["bbox"]
+            )  # 由  pos_flag_count 相关逻辑保证本段逻辑准确性
+            if left or right:
+                one_way_dis = all_bboxes[i]["bbox"][2] - all_bboxes[i]["bbox"][0]
+            else:
+                one_way_dis = all_bboxes[i]["bbox"][3] - all_bboxes[i]["bbox"][1]
+            if dis[i][j] > one_way_dis:
+                continue
+            arr.append((dis[i][j], j))
+
+        arr.sort(key=lambda x: x[0])
+        if len(arr) > 0:
+            # bug: 离该subject 最近的 object 可能跨越了其它的 subject 。比如 [this subect] [some sbuject] [the nearest objec of subject]
+            if may_find_other_nearest_bbox(i, arr[0][1]) >= arr[0][0]:
+
+                candidates.append(arr[0][1])
+                seen.add(arr[0][1])
+
+        # 已经获取初始种子
+        for j in set(candidates):
+            tmp = []
+            for k in range(i + 1, N):
+                pos_flag_count = sum(
+                    list(
+                        map(
+                            lambda x: 1 if x else 0,
+                            bbox_relative_pos(
+                                all_bboxes[j]["bbox"], all_bboxes[k]["bbox"]
+                            ),
+                        )
+                    )
+                )
+
+                if pos_flag_count > 1:
+                    continue
+
+                if (
+                    all_bboxes[k]["category_id"] != object_category_id
+                    or k in used
+                    or k in seen
+                    or dis[j][k] == MAX_DIS_OF_POINT
+                    or dis[j][k] > dis[i][j]
+                ):
+                    continue
+
+                is_nearest = True
+                for l in range(i + 1, N):
+                    if l in (j, k) or l in used or l in seen:
+                        continue
+
+                    if not float_gt(dis[l][k], dis[j][k]):
+                        is_nearest = False
+                        break
+
+                if is_nearest:
+                    nx0, ny0, nx1, ny1 = expand_bbbox(list(seen) + [k])
+                    n_dis = bbox_distance(all_bboxes[i]["bbox"], [nx0, ny0, nx1, ny1])
+                    if float_gt(dis[i][j], n_dis):
+                        continue
+                    tmp.append(k)
+                    seen.add(k)
+
+            candidates = tmp
+            if len(candidates) == 0:
+                break
+
+        # 已经获取到某个 figure 下所有的最靠近的 captions，以及最靠近这些 captions 的 captions 。
+        # 先扩一下 bbox，
+        ox0, oy0, ox1, oy1 = expand_bbbox(list(seen) + [i])
+        ix0, iy0, ix1, iy1 = all_bboxes[i]["bbox"]
+
+        # 分成了 4 个截取空间，需要计算落在每个截取空间下 objects 合并后占据的矩形面积
+        caption_poses = [
+            [ox0, oy0, ix0, oy1],
+            [ox0, oy0, ox1, iy0],
+            [ox0, iy1, ox1, oy1],
+            [ix1, oy0, ox1, oy1],
+        ]
+
+        caption_areas = []
+        for bbox in caption_poses:
+            embed_arr = []
+            for idx in seen:
+                if (
+                    calculate_overlap_area_in_bbox1_area_ratio(
+                        all_bboxes[idx]["bbox"], bbox
+                    )
+                    > CAPATION_OVERLAP_AREA_RATIO
+                ):
+                    embed_arr.append(idx)
+
+            if len(embed_arr) > 0:
+                embed_x0 = min([all_bboxes[idx]["bbox"][0] for idx in embed_arr])
+                embed_y0 = min([all_bboxes[idx]["bbox"][1] for idx in embed_arr])
+                embed_x1 = max([all_bboxes[idx]["bbox"][2] for idx in embed_arr])
+                embed_y1 = max([all_bboxes[idx]["bbox"][3] for idx in embed_arr])
+                caption_areas.append(
+                    int(abs(embed_x1 - embed_x0) * abs(embed_y1 - embed_y0))
+                )
+            else:
+                caption_areas.append(0)
+
+        subject_object_relation_map[i] = []
+        if max(caption_areas) > 0:
+            max_area_idx = caption_areas.index(max(caption_areas))
+            caption_bbox = caption_poses[max_area_idx]
+
+            for j in seen:
+                if (
+                    calculate_overlap_area_in_bbox1_area_ratio(
+                        all_bboxes[j]["bbox"], caption_bbox
+                    )
+                    > CAPATION_OVERLAP_AREA_RATIO
+                ):
+                    used.add(j)
+                    subject_object_relation_map[i].append(j)
+
+    for i in sorted(subject_object_relation_map.keys()):
+        result = {
+            "subject_body": all_bboxes[i]["bbox"],
+            "all": all_bboxes[i]["bbox"],
+            "score": all_bboxes[i]["score"],
+        }
+
+        if len(subject_object_relation_map[i]) > 0:
+            x0 = min(
+                [all_bboxes[j]["bbox"][0] for j in subject_object_relation_map[i]]
+            )
+            y0 = min(
+                [all_bboxes[j]["bbox"][1] for j in subject_object_relation_map[i]]
+            )
+            x1 = max(
+                [all_bboxes[j]["bbox"][2] for j in subject_object_relation_map[i]]
+            )
+            y1 = max(
+                [all_bboxes[j]["bbox"][3] for j in subject_object_relation_map[i]]
+            )
+            result["object_body"] = [x0, y0, x1, y1]
+            result["all"] = [
+                min(x0, all_bboxes[i]["bbox"][0]),
+                min(y0, all_bboxes[i]["bbox"][1]),
+                max(x1, all_bboxes[i]["bbox"][2]),
+                max(y1, all_bboxes[i]["bbox"][3]),
+            ]
+        ret.append(result)
+
+    total_subject_object_dis = 0
+    # 计算已经配对的 distance 距离
+    for i in subject_object_relation_map.keys():
+        for j in subject_object_relation_map[i]:
+            total_subject_object_dis += bbox_distance(
+                all_bboxes[i]["bbox"], all_bboxes[j]["bbox"]
+            )
+
+    # 计算未匹配的 subject 和 object 的距离（非精确版）
+    with_caption_subject = set(
+        [
+            key
+            for key in subject_object_relation_map.keys()
+            if len(subject_object_relation_map[i]) > 0
+        ]
+    )
+    for i in range(N):
+        if all_bboxes[i]["category_id"] != object_category_id or i in used:
+            continue
+        candidates = []
+        for j in range(N):
+            if (
+                all_bboxes[j]["category_id"] != subject_category_id
+                or j in with_caption_subject
+            ):
+                continue
+            candidates.append((dis[i][j], j))
+        if len(candidates) > 0:
+            candidates.sort(key=lambda x: x[0])
+            total_subject_object_dis += candidates[0][1]
+            with_caption_subject.add(j)
+    return ret, total_subject_object_dis
+
+
+# (subject, object)类别对: 图片-图片标题、表格-表格标题、表格-表格脚注
+TIE_UP_CATEGORY_PAIRS = [(3, 4), (5, 6), (5, 7)]
+
+
+def synthetic_page(block_nums, seed, page_size=2000):
+    """
+    生成一页有block_nums个框的模型数据：网格中随机摆放图片或表格，在其上下左右随机放1~2个标题或脚注
+    """
+    rng = random.Random(seed)
+    groups = max(block_nums // 3, 1)
+    cols = int(groups ** 0.5) + 1
+    cell = page_size // cols
+    layout_dets = []
+
+    def add(category_id, x0, y0, x1, y1):
+        layout_dets.append({
+            "category_id": category_id,
+            "poly": [x0, y0, x1, y0, x1, y1, x0, y1],
+            "score": round(rng.uniform(0.3, 1.0), 3),
+        })
+
+    for idx in range(groups):
+        if len(layout_dets) >= block_nums:
+            break
+        cx, cy = (idx % cols) * cell, (idx // cols) * cell
+        x0, y0 = cx + rng.randint(0, cell // 5), cy + rng.randint(cell // 5, cell // 3)
+        x1, y1 = x0 + rng.randint(cell // 3, cell // 2), y0 + rng.randint(cell // 4, cell // 3)
+        subject_category_id = rng.choice([3, 5])
+        add(subject_category_id, x0, y0, x1, y1)
+        for _ in range(rng.randint(1, 2)):
+            if len(layout_dets) >= block_nums:
+                break
+            object_category_id = rng.choice([4] if subject_category_id == 3 else [6, 7])
+            gap = rng.randint(0, cell // 20)
+            height = rng.randint(cell // 20, cell // 10)
+            side = rng.choice(["top", "bottom", "bottom", "right"])
+            if side == "top":
+                add(object_category_id, x0, y0 - gap - height, x1, y0 - gap)
+            elif side == "bottom":
+                add(object_category_id, x0, y1 + gap, x1, y1 + gap + height)
+            else:
+                add(object_category_id, x1 + gap, y0, x1 + gap + height, y1)
+    return {
+        "layout_dets": layout_dets,
+        "page_info": {"page_no": 0, "width": page_size, "height": page_size},
+    }
+
+
+def reference_scan_pdf_features(doc):
+    """
+    逐项扫描：每个特征各自遍历一遍文档
+    """
+    page_width_pts, page_height_pts = get_pdf_page_size_pts(doc)
+    imgs_per_page = get_imgs_per_page(doc)
+    image_info_per_page, junk_img_bojids = get_image_info(doc, page_width_pts, page_height_pts)
+    return {
+        "page_width_pts": page_width_pts,
+        "page_height_pts": page_height_pts,
+        "image_info_per_page": image_info_per_page,
+        "text_len_per_page": get_pdf_textlen_per_page(doc),
+        "text_layout_per_page": get_pdf_text_layout_per_page(doc),
+        "text_language": get_language(doc),
+        "imgs_per_page": imgs_per_page,
+        "junk_img_bojids": junk_img_bojids,
+    }
+
+
+def reference_remove_overlaps_low_confidence_spans(spans):
+    """
+    两两比较的原始实现：用==判断span是否已被删除，删除时移除第一个值相等的span
+    """
+    dropped_spans = []
+    for span1 in spans:
+        for span2 in spans:
+            if span1 != span2:
+                if span1 in dropped_spans or span2 in dropped_spans:
+                    continue
+                else:
+                    if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
+                        if span1['score'] < span2['score']:
+                            span_need_remove = span1
+                        else:
+                            span_need_remove = span2
+                        if span_need_remove is not None and span_need_remove not in dropped_spans:
+                            dropped_spans.append(span_need_remove)
+
+    if len(dropped_spans) > 0:
+        for span_need_remove in dropped_spans:
+            spans.remove(span_need_remove)
+            span_need_remove['tag'] = DropTag.SPAN_OVERLAP
+
+    return spans, dropped_spans
+
+
+def reference_remove_overlaps_min_spans(spans):
+    """
+    两两比较的原始实现：删除的是bbox与较小的bbox相同的第一个span
+    """
+    dropped_spans = []
+    for span1 in spans:
+        for span2 in spans:
+            if span1 != span2:
+                overlap_box = get_minbox_if_overlap_by_ratio(span1['bbox'], span2['bbox'], 0.65)
+                if overlap_box is not None:
+                    span_need_remove = next((span for span in spans if span['bbox'] == overlap_box), None)
+                    if span_need_remove is not None and span_need_remove not in dropped_spans:
+                        dropped_spans.append(span_need_remove)
+
+    if len(dropped_spans) > 0:
+        for span_need_remove in dropped_spans:
+            spans.remove(span_need_remove)
+            span_need_remove['tag'] = DropTag.SPAN_OVERLAP
+
+    return spans, dropped_spans
+
+
+def reference_fill_spans_in_blocks(blocks, spans, radio):
+    """
+    每个block遍历全部span的原始实现，放入block的span随即从spans中移除(先到的block优先)
+    """
+    block_with_spans = []
+    for block in blocks:
+        block_bbox = block[0:4]
+        block_spans = []
+        for span in spans:
+            if calculate_overlap_area_in_bbox1_area_ratio(span['bbox'], block_bbox) > radio:
+                block_spans.append(span)
+        block_with_spans.append({'type': block[7], 'bbox': block_bbox, 'spans': block_spans})
+        if len(block_spans) > 0:
+            for span in block_spans:
+                spans.remove(span)
+
+    return block_with_spans, spans
+
+
+def random_spans(span_nums, seed, page_size=200):
+    """
+    随机生成一页span：坐标取10的倍数使bbox经常重合，分数只有几档使经常出现相等的分数，
+    另外混入值完全相同的span、bbox相同但分数不同的span以及略微平移的span
+    """
+    rng = random.Random(seed)
+    spans = []
+    for _ in range(span_nums):
+        kind = rng.random()
+        if spans and kind < 0.2:
+            span = copy.deepcopy(rng.choice(spans))
+        elif spans and kind < 0.35:
+            span = copy.deepcopy(rng.choice(spans))
+            span['score'] = rng.choice([0.5, 0.8, 0.9])
+        elif spans and kind < 0.5:
+            span = copy.deepcopy(rng.choice(spans))
+            span['bbox'] = [value + 1 for value in span['bbox']]
+        else:
+            x0, y0 = rng.randrange(0, page_size, 10), rng.randrange(0, page_size, 10)
+            width = rng.randrange(10, 60, 10)
+            height = rng.randrange(10, 30, 10)
+            span = {
+                'bbox': [x0, y0, x0 + width, y0 + height],
+                'score': rng.choice([0.5, 0.8, 0.9]),
+                'type': rng.choice(['text', 'inline_equation', 'image']),
+                'content': rng.choice(['a', 'b', 'c']),
+            }
+        spans.append(span)
+    return spans
+
+
+def random_blocks(block_nums, seed, page_size=200):
+    rng = random.Random(seed)
+    blocks = []
+    for _ in range(block_nums):
+        x0, y0 = rng.randrange(0, page_size, 10), rng.randrange(0, page_size, 10)
+        x1, y1 = x0 + rng.randrange(10, 100, 10), y0 + rng.randrange(10, 60, 10)
+        blocks.append([x0, y0, x1, y1, None, None, None, rng.choice(['text', 'title'])])
+    return blocks
+
+
+def span_positions(spans, result):
+    """
+    result中各span在spans中的下标，按对象而不是按值比较，能区分值相等的span中具体保留或删除了哪一个
+    """
+    positions = {id(span): idx for idx, span in enumerate(spans)}
+    return [positions[id(span)] for span in result]
+
+
+def build_large_pdf(demo_name, page_nums):
+    """
+    重复拼接demo的页面，构造page_nums页的pdf
+    """
+    src = fitz.open("pdf", open(os.path.join(current_script_dir, f"{demo_name}.pdf"), "rb").read())
+    doc = fitz.open()
+    while len(doc) < page_nums:
+        doc.insert_pdf(src, to_page=min(len(src), page_nums - len(doc)) - 1)
+    return doc.tobytes()
+
+
+def classify_features(features, seed):
+    # classify_by_text_len中随机抽页，固定种子使不同扫描方式的分类结果可比
+    np.random.seed(seed)
+    is_text_pdf, _ = classify(len(features["text_len_per_page"]), features["page_width_pts"],
+                              features["page_height_pts"], features["image_info_per_page"],
+                              features["text_len_per_page"], features["imgs_per_page"],
+                              features["text_layout_per_page"], True)
+    return is_text_pdf
+
+
+def build_magic_model(model_list, docs):
+    MagicModel(model_list, docs)
+    return model_list
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command("magic_model")
+@click.option("--repeat", type=int, default=10, help="每个样例重复运行的次数")
+def magic_model(repeat):
+    """
+    MagicModel初始化时的layout det清理(坐标缩放、低置信度过滤、高iou去重)
+    """
+    for demo_name in DEMO_NAMES:
+        docs, model_list = load_demo(demo_name)
+        # MagicModel会原地修改model_list，每次都用深拷贝
+        setup = lambda: (copy.deepcopy(model_list), docs)
+        ref_ms, ref_result = timeit(reference_fix_layout_dets, repeat, setup)
+        new_ms, new_result = timeit(build_magic_model, repeat, setup)
+        assert new_result == ref_result, f"{demo_name}: result mismatch"
+        det_nums = sum(len(page["layout_dets"]) for page in model_list)
+        click.echo(f"{demo_name}: pages {len(model_list)}, layout dets {det_nums}, "
+                   f"loop {ref_ms:.2f} ms, vectorized {new_ms:.2f} ms")
+
+
+@cli.command("tie_up")
+@click.option("--sizes", default="10,50,100,200,500", help="合成页面的框数，逗号分隔")
+@click.option("--repeat", type=int, default=3, help="每个样例重复运行的次数")
+@click.option("--seed", type=int, default=0)
+def tie_up(sizes, repeat, seed):
+    """
+    MagicModel中图片、表格与标题、脚注的关联(__tie_up_category_by_distance)
+    """
+    # 先在demo数据的每一页上校验结果一致
+    for demo_name in DEMO_NAMES:
+        docs, model_list = load_demo(demo_name)
+        magic_model = MagicModel(model_list, docs)
+        for page_no in range(len(model_list)):
+            layout_dets = magic_model.get_model_list(page_no)["layout_dets"]
+            for subject_category_id, object_category_id in TIE_UP_CATEGORY_PAIRS:
+                assert magic_model._MagicModel__tie_up_category_by_distance(
+                    page_no, subject_category_id, object_category_id
+                ) == reference_tie_up_category_by_distance(
+                    layout_dets, subject_category_id, object_category_id
+                ), f"{demo_name} page {page_no}: result mismatch"
+
+    for block_nums in [int(size) for size in sizes.split(",")]:
+        page = synthetic_page(block_nums, seed)
+        docs = fitz.open()
+        docs.new_page(width=page["page_info"]["width"], height=page["page_info"]["height"])
+        magic_model = MagicModel([page], docs)
+        layout_dets = magic_model.get_model_list(0)["layout_dets"]
+
+        def run_reference():
+            return [reference_tie_up_category_by_distance(layout_dets, subject_category_id, object_category_id)
+                    for subject_category_id, object_category_id in TIE_UP_CATEGORY_PAIRS]
+
+        def run_vectorized():
+            return [magic_model._MagicModel__tie_up_category_by_distance(0, subject_category_id, object_category_id)
+                    for subject_category_id, object_category_id in TIE_UP_CATEGORY_PAIRS]
+
+        ref_ms, ref_result = timeit(run_reference, repeat)
+        new_ms, new_result = timeit(run_vectorized, repeat)
+        assert new_result == ref_result, f"{block_nums} blocks: result mismatch"
+        click.echo(f"blocks {len(layout_dets)}: loop {ref_ms:.2f} ms, vectorized {new_ms:.2f} ms")
+
+
+@cli.command("meta_scan")
+@click.option("--pages", default="13,500,3000", help="拼接demo页面构造的pdf页数，逗号分隔")
+@click.option("--budget", type=int, default=200, help="抽样扫描的页数")
+@click.option("--repeat", type=int, default=1, help="每个样例重复运行的次数")
+@click.option("--seed", type=int, default=0)
+def meta_scan(pages, budget, repeat, seed):
+    """
+    pdf_meta_scan的特征扫描：逐项扫描、单次遍历全部页、按页数预算抽样(不含乱码检测)
+    """
+    for demo_name in DEMO_NAMES:
+        for page_nums in [int(page_num) for page_num in pages.split(",")]:
+            pdf_bytes = build_large_pdf(demo_name, page_nums)
+
+            def open_doc():
+                doc = fitz.open("pdf", pdf_bytes)
+                return doc, PdfTextLayer(doc)
+
+            ref_ms, ref_result = timeit(lambda doc, _: reference_scan_pdf_features(doc), repeat, open_doc)
+            full_ms, full_result = timeit(
+                lambda doc, text_layer: scan_pdf_features(doc, text_layer, select_scan_page_ids(len(doc))),
+                repeat, open_doc)
+            sample_ms, sample_result = timeit(
+                lambda doc, text_layer: scan_pdf_features(doc, text_layer, select_scan_page_ids(len(doc), budget)),
+                repeat, open_doc)
+            assert full_result == ref_result, f"{demo_name} {page_nums} pages: result mismatch"
+            same_class = classify_features(sample_result, seed) == classify_features(full_result, seed)
+            click.echo(f"{demo_name} x {page_nums} pages: multi pass {ref_ms:.0f} ms, single pass {full_ms:.0f} ms, "
+                       f"sampled {len(sample_result['text_len_per_page'])} pages {sample_ms:.0f} ms, "
+                       f"same classification: {same_class}")
+
+
+@cli.command("invalid_chars")
+@click.option("--repeat", type=int, default=5, help="每个样例重复运行的次数")
+def invalid_chars(repeat):
+    """
+    乱码检测：在已打开的文档上检查字形映射 vs 抽样页另存后用pdfminer重新解析
+    """
+    for demo_name in DEMO_NAMES:
+        pdf_bytes = open(os.path.join(current_script_dir, f"{demo_name}.pdf"), "rb").read()
+        docs = fitz.open("pdf", pdf_bytes)
+        ref_ms, ref_result = timeit(lambda: detect_invalid_chars(pdf_bytes, docs, method="pdfminer"), repeat)
+        new_ms, new_result = timeit(lambda: detect_invalid_chars(pdf_bytes, docs), repeat)
+        assert new_result == ref_result, f"{demo_name}: result mismatch"
+        click.echo(f"{demo_name}: pdfminer {ref_ms:.1f} ms, fitz {new_ms:.1f} ms, normal text: {new_result}")
+
+
+@cli.command("span_overlap")
+@click.option("--cases", type=int, default=300, help="随机页面的数量")
+@click.option("--span-nums", default="5,20,60", help="每页的span数，逗号分隔")
+@click.option("--seed", type=int, default=0)
+def span_overlap(cases, span_nums, seed):
+    """
+    重叠span的删除(remove_overlaps_*)和span放入block(fill_spans_in_blocks)：在随机页面上与两两比较的原始实现
+    逐个对比保留、删除以及放入各block的是哪几个span
+    """
+    remove_funcs = [
+        (remove_overlaps_low_confidence_spans, reference_remove_overlaps_low_confidence_spans),
+        (remove_overlaps_min_spans, reference_remove_overlaps_min_spans),
+    ]
+
+    def run(func, spans):
+        # 各自在深拷贝上运行，返回运行前的span列表和运行结果
+        spans = copy.deepcopy(spans)
+        return list(spans), func(spans)
+
+    for case in range(cases):
+        case_seed = seed + case
+        for nums in [int(num) for num in span_nums.split(",")]:
+            spans = random_spans(nums, case_seed)
+            for func, reference_func in remove_funcs:
+                new_spans, (new_kept, new_dropped) = run(func, spans)
+                ref_spans, (ref_kept, ref_dropped) = run(reference_func, spans)
+                assert (span_positions(new_spans, new_kept), span_positions(new_spans, new_dropped)) == \
+                       (span_positions(ref_spans, ref_kept), span_positions(ref_spans, ref_dropped)), \
+                       f"{func.__name__} seed {case_seed}, {nums} spans: result mismatch"
+
+            blocks = random_blocks(max(nums // 5, 1), case_seed)
+            for radio in [0.4, 0.6]:
+                new_spans, (new_blocks, new_rest) = run(lambda s: fill_spans_in_blocks(blocks, s, radio), spans)
+                ref_spans, (ref_blocks, ref_rest) = run(
+                    lambda s: reference_fill_spans_in_blocks(blocks, s, radio), spans)
+                # 每个block中的span(先到的block优先)以及剩余的span
+                assert [span_positions(new_spans, block['spans']) for block in new_blocks + [{'spans': new_rest}]] == \
+                       [span_positions(ref_spans, block['spans']) for block in ref_blocks + [{'spans': ref_rest}]], \
+                       f"fill_spans_in_blocks seed {case_seed}, {nums} spans, radio {radio}: result mismatch"
+    click.echo(f"{cases} random pages x spans {span_nums}: same spans kept, dropped and filled as reference")
+
+
+@cli.command("page_list")
+@click.option("--page-lists", default="9,11;1,10;0,5,6,12", help="要解析的页列表，列表之间用分号分隔")
+def page_list(page_lists):
+    """
+    只解析部分页时，不相邻的页之间不应做跨页段落连接：每页的para_blocks应与单独解析该页时一致
+    """
+    pdf_bytes = open(os.path.join(current_script_dir, "demo1.pdf"), "rb").read()
+    model_list = json.loads(open(os.path.join(current_script_dir, "demo1.json"), "r", encoding="utf-8").read())
+    image_writer = DiskReaderWriter(tempfile.mkdtemp())
+
+    def parse(page_ids):
+        # MagicModel会原地修改model_list，每次都用深拷贝
+        pdf_info = pdf_parse_union(pdf_bytes, copy.deepcopy(model_list), image_writer, "txt",
+                                   page_list=page_ids)["pdf_info"]
+        return {page_info["page_idx"]: page_info["para_blocks"] for page_info in pdf_info}
+
+    for pages in page_lists.split(";"):
+        page_ids = [int(page_id) for page_id in pages.split(",")]
+        result = parse(page_ids)
+        for page_id in page_ids:
+            # 后一页与它相邻时，跨页连接会改动该页的段落
+            if page_id + 1 in page_ids or page_id - 1 in page_ids:
+                continue
+            assert result[page_id] == parse([page_id])[page_id], f"page list {page_ids}: page {page_id} mismatch"
+        click.echo(f"page list {page_ids}: non-adjacent pages match single page parse")
+
+
+if __name__ == "__main__":
+    cli()
@@ -13,9 +13,12 @@ from collections import Counter
 from magic_pdf.libs.drop_reason import DropReason
 from magic_pdf.libs.language import detect_lang
 from magic_pdf.libs.pdf_check import detect_invalid_chars
+from magic_pdf.libs.pdf_session import PdfSession
+from magic_pdf.libs.pdf_text_layer import PdfTextLayer
 
 scan_max_page = 50
 junk_limit_min = 10
+special_limit_pages = 10
 
 
 def calculate_max_image_area_per_page(result: list, page_width_pts, page_height_pts):
@@ -27,9 +30,10 @@ def calculate_max_image_area_per_page(result: list, page_width_pts, page_height_
     return max_image_area_per_page
 
 
-def process_image(page, junk_img_bojids=[]):
+def process_image(page, junk_img_bojids=[], items=None):
     page_result = []  # 存每个页面里的多张图四元组信息
-    items = page.get_images()
+    if items is None:
+        items = page.get_images()
     dedup = set()
     for img in items:
         # 这里返回的是图片在page上的实际展示的大小。返回一个数组，每个元素第一部分是
@@ -51,17 +55,17 @@ def process_image(page, junk_img_bojids=[]):
     return page_result
 
 
-def get_image_info(doc: fitz.Document, page_width_pts, page_height_pts) -> list:
+def select_junk_img_bojids(img_bojid_counter: Counter, imgs_len_list: list, first_pages_result: list,
+                           page_width_pts, page_height_pts) -> list:
     """
-    返回每个页面里的图片的四元组，每个页面多个图片。
-    :param doc:
-    :return:
+    根据每个img_bojid出现的次数、每页的图片数和前十页的图片信息选出垃圾图片
+    :param img_bojid_counter: 每个img_bojid在所有页中出现的次数
+    :param imgs_len_list: 每页的图片数
+    :param first_pages_result: 前十页未去除垃圾图片的process_image结果
     """
-    # 使用 Counter 计数 img_bojid 的出现次数
-    img_bojid_counter = Counter(img[0] for page in doc for img in page.get_images())
     # 找出出现次数超过 len(doc) 半数的 img_bojid
 
-    junk_limit = max(len(doc) * 0.5, junk_limit_min)  # 对一些页数比较少的进行豁免
+    junk_limit = max(len(imgs_len_list) * 0.5, junk_limit_min)  # 对一些页数比较少的进行豁免
 
     junk_img_bojids = [img_bojid for img_bojid, count in img_bojid_counter.items() if count >= junk_limit]
 
@@ -70,30 +74,15 @@ def get_image_info(doc: fitz.Document, page_width_pts, page_height_pts) -> list:
     #扫描版1：每页都有所有扫描页图片，特点是图占比大，每页展示1张
     #扫描版2，每页存储的扫描页图片数量递增，特点是图占比大，每页展示1张，需要清空junklist跑前50页图片信息用于分类判断
     #文字版1.每页存储所有图片，特点是图片占页面比例不大，每页展示可能为0也可能不止1张 这种pdf需要拿前10页抽样检测img大小和个数，如果符合需要清空junklist
-    imgs_len_list = [len(page.get_images()) for page in doc]
-
-    special_limit_pages = 10
 
     # 统一用前十页结果做判断
-    result = []
-    break_loop = False
-    for i, page in enumerate(doc):
-        if break_loop:
-            break
-        if i >= special_limit_pages:
-            break
-        page_result = process_image(page)  # 这里不传junk_img_bojids，拿前十页所有图片信息用于后续分析
-        result.append(page_result)
-        for item in result:
-            if not any(item):  # 如果任何一页没有图片，说明是个文字版，需要判断是否为特殊文字版
-                if max(imgs_len_list) == min(imgs_len_list) and max(
-                        imgs_len_list) >= junk_limit_min:  # 如果是特殊文字版，就把junklist置空并break
-                    junk_img_bojids = []
-                else:  # 不是特殊文字版，是个普通文字版，但是存在垃圾图片，不置空junklist
-                    pass
-                break_loop = True
-                break
-    if not break_loop:
+    if any(not any(item) for item in first_pages_result):  # 如果任何一页没有图片，说明是个文字版，需要判断是否为特殊文字版
+        if max(imgs_len_list) == min(imgs_len_list) and max(
+                imgs_len_list) >= junk_limit_min:  # 如果是特殊文字版，就把junklist置空
+            junk_img_bojids = []
+        else:  # 不是特殊文字版，是个普通文字版，但是存在垃圾图片，不置空junklist
+            pass
+    else:
         # 获取前80%的元素
         top_eighty_percent = get_top_percent_list(imgs_len_list, 0.8)
         # 检查前80%的元素是否都相等
@@ -103,7 +92,8 @@ def get_image_info(doc: fitz.Document, page_width_pts, page_height_pts) -> list:
             # if max(imgs_len_list) == min(imgs_len_list) and max(imgs_len_list) >= junk_limit_min:
 
             #前10页都有图，且每页数量一致，需要检测图片大小占页面的比例判断是否需要清除junklist
-            max_image_area_per_page = calculate_max_image_area_per_page(result, page_width_pts, page_height_pts)
+            max_image_area_per_page = calculate_max_image_area_per_page(first_pages_result, page_width_pts,
+                                                                        page_height_pts)
             if len(max_image_area_per_page) < 0.8 * special_limit_pages:  # 前10页不全是大图，说明可能是个文字版pdf，把垃圾图片list置空
                 junk_img_bojids = []
             else:  # 前10页都有图，而且80%都是大图，且每页图片数量一致并都很多，说明是扫描版1，不需要清空junklist
@@ -111,6 +101,23 @@ def get_image_info(doc: fitz.Document, page_width_pts, page_height_pts) -> list:
         else:  # 每页图片数量不一致，需要清掉junklist全量跑前50页图片
             junk_img_bojids = []
 
+    return junk_img_bojids
+
+
+def get_image_info(doc: fitz.Document, page_width_pts, page_height_pts) -> list:
+    """
+    返回每个页面里的图片的四元组，每个页面多个图片。
+    :param doc:
+    :return:
+    """
+    # 使用 Counter 计数 img_bojid 的出现次数
+    img_bojid_counter = Counter(img[0] for page in doc for img in page.get_images())
+    imgs_len_list = [len(page.get_images()) for page in doc]
+    # 这里不传junk_img_bojids，拿前十页所有图片信息用于后续分析
+    first_pages_result = [process_image(doc[i]) for i in range(min(len(doc), special_limit_pages))]
+    junk_img_bojids = select_junk_img_bojids(img_bojid_counter, imgs_len_list, first_pages_result, page_width_pts,
+                                             page_height_pts)
+
     #正式进入取前50页图片的信息流程
     result = []
     for i, page in enumerate(doc):
@@ -144,16 +151,18 @@ def get_pdf_page_size_pts(doc: fitz.Document):
     return median_width, median_height
 
 
-def get_pdf_textlen_per_page(doc: fitz.Document):
+def get_pdf_textlen_per_page(doc: fitz.Document, text_layer: PdfTextLayer = None):
+    if text_layer is None:
+        text_layer = PdfTextLayer(doc)
     text_len_lst = []
-    for page in doc:
+    for page_id in range(len(doc)):
         # 拿包含img和text的所有blocks
         # text_block = page.get_text("blocks")
         # 拿所有text的blocks
         # text_block = page.get_text("words")
         # text_block_len = sum([len(t[4]) for t in text_block])
         #拿所有text的str
-        text_block = page.get_text("text")
+        text_block = text_layer.get_text(page_id)
         text_block_len = len(text_block)
         # logger.info(f"page {page.number} text_block_len: {text_block_len}")
         text_len_lst.append(text_block_len)
@@ -161,81 +170,87 @@ def get_pdf_textlen_per_page(doc: fitz.Document):
     return text_len_lst
 
 
-def get_pdf_text_layout_per_page(doc: fitz.Document):
+def get_page_text_layout(text_dict: dict) -> str:
+    """
+    根据一页的文本布局(page.get_text("dict")的结果)，判断该页的文本布局是横向、纵向还是未知。
+    """
+    # 创建每一页的纵向和横向的文本行数计数器
+    vertical_count = 0
+    horizontal_count = 0
+    if "blocks" in text_dict:
+        for block in text_dict["blocks"]:
+            if 'lines' in block:
+                for line in block["lines"]:
+                    # 获取line的bbox顶点坐标
+                    x0, y0, x1, y1 = line['bbox']
+                    # 计算bbox的宽高
+                    width = x1 - x0
+                    height = y1 - y0
+                    # 计算bbox的面积
+                    area = width * height
+                    font_sizes = []
+                    for span in line['spans']:
+                        if 'size' in span:
+                            font_sizes.append(span['size'])
+                    if len(font_sizes) > 0:
+                        average_font_size = sum(font_sizes) / len(font_sizes)
+                    else:
+                        average_font_size = 10  # 有的line拿不到font_size，先定一个阈值100
+                    if area <= average_font_size ** 2:  # 判断bbox的面积是否小于平均字体大小的平方,单字无法计算是横向还是纵向
+                        continue
+                    else:
+                        if 'wmode' in line:  # 通过wmode判断文本方向
+                            if line['wmode'] == 1:  # 判断是否为竖向文本
+                                vertical_count += 1
+                            elif line['wmode'] == 0:  # 判断是否为横向文本
+                                horizontal_count += 1
+                    #     if 'dir' in line:  # 通过旋转角度计算判断文本方向
+                    #         # 获取行的 "dir" 值
+                    #         dir_value = line['dir']
+                    #         cosine, sine = dir_value
+                    #         # 计算角度
+                    #         angle = math.degrees(math.acos(cosine))
+                    #
+                    #         # 判断是否为横向文本
+                    #         if abs(angle - 0) < 0.01 or abs(angle - 180) < 0.01:
+                    #             # line_text = ' '.join(span['text'] for span in line['spans'])
+                    #             # print('This line is horizontal:', line_text)
+                    #             horizontal_count += 1
+                    #         # 判断是否为纵向文本
+                    #         elif abs(angle - 90) < 0.01 or abs(angle - 270) < 0.01:
+                    #             # line_text = ' '.join(span['text'] for span in line['spans'])
+                    #             # print('This line is vertical:', line_text)
+                    #             vertical_count += 1
+    # 判断每一页的文本布局
+    if vertical_count == 0 and horizontal_count == 0:  # 该页没有文本，无法判断
+        return "unknow"
+    else:
+        if vertical_count > horizontal_count:  # 该页的文本纵向行数大于横向的
+            return "vertical"
+        else:  # 该页的文本横向行数大于纵向的
+            return "horizontal"
+
+
+def get_pdf_text_layout_per_page(doc: fitz.Document, text_layer: PdfTextLayer = None):
     """
     根据PDF文档的每一页文本布局，判断该页的文本布局是横向、纵向还是未知。
 
     Args:
         doc (fitz.Document): PDF文档对象。
+        text_layer (PdfTextLayer): 文档的文本层缓存，为None时新建。
 
     Returns:
         List[str]: 每一页的文本布局（横向、纵向、未知）。
 
     """
+    if text_layer is None:
+        text_layer = PdfTextLayer(doc)
     text_layout_list = []
 
-    for page_id, page in enumerate(doc):
+    for page_id in range(len(doc)):
         if page_id >= scan_max_page:
             break
-        # 创建每一页的纵向和横向的文本行数计数器
-        vertical_count = 0
-        horizontal_count = 0
-        text_dict = page.get_text("dict")
-        if "blocks" in text_dict:
-            for block in text_dict["blocks"]:
-                if 'lines' in block:
-                    for line in block["lines"]:
-                        # 获取line的bbox顶点坐标
-                        x0, y0, x1, y1 = line['bbox']
-                        # 计算bbox的宽高
-                        width = x1 - x0
-                        height = y1 - y0
-                        # 计算bbox的面积
-                        area = width * height
-                        font_sizes = []
-                        for span in line['spans']:
-                            if 'size' in span:
-                                font_sizes.append(span['size'])
-                        if len(font_sizes) > 0:
-                            average_font_size = sum(font_sizes) / len(font_sizes)
-                        else:
-                            average_font_size = 10  # 有的line拿不到font_size，先定一个阈值100
-                        if area <= average_font_size ** 2:  # 判断bbox的面积是否小于平均字体大小的平方,单字无法计算是横向还是纵向
-                            continue
-                        else:
-                            if 'wmode' in line:  # 通过wmode判断文本方向
-                                if line['wmode'] == 1:  # 判断是否为竖向文本
-                                    vertical_count += 1
-                                elif line['wmode'] == 0:  # 判断是否为横向文本
-                                    horizontal_count += 1
-                        #     if 'dir' in line:  # 通过旋转角度计算判断文本方向
-                        #         # 获取行的 "dir" 值
-                        #         dir_value = line['dir']
-                        #         cosine, sine = dir_value
-                        #         # 计算角度
-                        #         angle = math.degrees(math.acos(cosine))
-                        #
-                        #         # 判断是否为横向文本
-                        #         if abs(angle - 0) < 0.01 or abs(angle - 180) < 0.01:
-                        #             # line_text = ' '.join(span['text'] for span in line['spans'])
-                        #             # print('This line is horizontal:', line_text)
-                        #             horizontal_count += 1
-                        #         # 判断是否为纵向文本
-                        #         elif abs(angle - 90) < 0.01 or abs(angle - 270) < 0.01:
-                        #             # line_text = ' '.join(span['text'] for span in line['spans'])
-                        #             # print('This line is vertical:', line_text)
-                        #             vertical_count += 1
-        # print(f"page_id: {page_id}, vertical_count: {vertical_count}, horizontal_count: {horizontal_count}")
-        # 判断每一页的文本布局
-        if vertical_count == 0 and horizontal_count == 0:  # 该页没有文本，无法判断
-            text_layout_list.append("unknow")
-            continue
-        else:
-            if vertical_count > horizontal_count:  # 该页的文本纵向行数大于横向的
-                text_layout_list.append("vertical")
-            else:  # 该页的文本横向行数大于纵向的
-                text_layout_list.append("horizontal")
-        # logger.info(f"page_id: {page_id}, vertical_count: {vertical_count}, horizontal_count: {horizontal_count}")
+        text_layout_list.append(get_page_text_layout(text_layer.get_dict(page_id)))
     return text_layout_list
 
 
@@ -272,25 +287,32 @@ def get_imgs_per_page(doc: fitz.Document):
     return imgs_len_list
 
 
-def get_language(doc: fitz.Document):
+def get_language(doc: fitz.Document, text_layer: PdfTextLayer = None):
     """
     获取PDF文档的语言。
     Args:
         doc (fitz.Document): PDF文档对象。
+        text_layer (PdfTextLayer): 文档的文本层缓存，为None时新建。
     Returns:
         str: 文档语言，如 "en-US"。
     """
+    if text_layer is None:
+        text_layer = PdfTextLayer(doc)
     language_lst = []
-    for page_id, page in enumerate(doc):
+    for page_id in range(len(doc)):
         if page_id >= scan_max_page:
             break
         # 拿所有text的str
-        text_block = page.get_text("text")
+        text_block = text_layer.get_text(page_id)
         page_language = detect_lang(text_block)
         language_lst.append(page_language)
 
         # logger.info(f"page_id: {page_id}, page_language: {page_language}")
 
+    return get_most_common_language(language_lst)
+
+
+def get_most_common_language(language_lst: list) -> str:
     # 统计text_language_list中每种语言的个数
     count_dict = Counter(language_lst)
     # 输出text_language_list中出现的次数最多的语言
@@ -298,20 +320,90 @@ def get_language(doc: fitz.Document):
     return language
 
 
-def check_invalid_chars(pdf_bytes):
+def select_scan_page_ids(total_page: int, page_budget: int = None) -> list:
+    """
+    page_budget为None或不小于总页数时扫描全部页；否则扫描前面的页(最多scan_max_page页)，
+    剩余的额度在其余页中均匀抽样，返回按页码排序的page_id列表
+    """
+    if page_budget is None or page_budget >= total_page:
+        return list(range(total_page))
+    page_budget = max(page_budget, 1)
+    head_page_nums = min(page_budget, scan_max_page)
+    sample_nums = page_budget - head_page_nums
+    rest_page_nums = total_page - head_page_nums
+    sample_page_ids = [head_page_nums + i * rest_page_nums // sample_nums for i in range(sample_nums)]
+    return list(range(head_page_nums)) + sample_page_ids
+
+
+def scan_pdf_features(doc: fitz.Document, text_layer: PdfTextLayer, page_ids: list) -> dict:
+    """
+    一次遍历page_ids中的页，收集分类需要的全部特征，结果与逐项扫描全部页的各个get_xxx函数一致
+    page_ids中的前scan_max_page页额外提取页面尺寸、图片位置、文本方向和语言；
+    每页的get_images只调用一次，图片位置先不去除垃圾图片，遍历结束确定垃圾图片后再过滤
+    """
+    imgs_per_page = []
+    text_len_per_page = []
+    img_bojid_counter = Counter()
+    head_image_info = []
+    page_width_list = []
+    page_height_list = []
+    text_layout_per_page = []
+    language_lst = []
+    for index, page_id in enumerate(page_ids):
+        page = doc[page_id]
+        images = page.get_images()
+        imgs_per_page.append(len(images))
+        img_bojid_counter.update(img[0] for img in images)
+        text = text_layer.get_text(page_id)
+        text_len_per_page.append(len(text))
+        if index < scan_max_page:
+            page_rect = page.rect
+            page_width_list.append(page_rect.width)
+            page_height_list.append(page_rect.height)
+            head_image_info.append(process_image(page, items=images))
+            text_layout_per_page.append(get_page_text_layout(text_layer.get_dict(page_id)))
+            language_lst.append(detect_lang(text))
+
+    page_width_list.sort()
+    page_height_list.sort()
+    page_width_pts = page_width_list[len(page_width_list) // 2]
+    page_height_pts = page_height_list[len(page_height_list) // 2]
+
+    junk_img_bojids = select_junk_img_bojids(img_bojid_counter, imgs_per_page,
+                                             head_image_info[:special_limit_pages], page_width_pts, page_height_pts)
+    image_info_per_page = [[img for img in page_image_info if img[4] not in junk_img_bojids]
+                           for page_image_info in head_image_info]
+
+    return {
+        "page_width_pts": page_width_pts,
+        "page_height_pts": page_height_pts,
+        "image_info_per_page": image_info_per_page,
+        "text_len_per_page": text_len_per_page,
+        "text_layout_per_page": text_layout_per_page,
+        "text_language": get_most_common_language(language_lst),
+        "imgs_per_page": imgs_per_page,
+        "junk_img_bojids": junk_img_bojids,
+    }
+
+
+def check_invalid_chars(pdf_bytes, doc: fitz.Document = None):
     """
     乱码检测
     """
-    return detect_invalid_chars(pdf_bytes)
+    return detect_invalid_chars(pdf_bytes, doc)
 
 
-def pdf_meta_scan(pdf_bytes: bytes):
+def pdf_meta_scan(pdf_bytes: bytes, pdf_session: PdfSession = None, page_budget: int = None):
     """
     :param s3_pdf_path:
     :param pdf_bytes: pdf文件的二进制数据
+    :param pdf_session: 同一份pdf共享的session，为None时新建
+    :param page_budget: 最多扫描的页数，None表示扫描全部页；抽样时text_len_per_page和imgs_per_page只包含抽到的页
     几个维度来评价：是否加密，是否需要密码，纸张大小，总页数，是否文字可提取
     """
-    doc = fitz.open("pdf", pdf_bytes)
+    if pdf_session is None:
+        pdf_session = PdfSession(pdf_bytes)
+    doc = pdf_session.doc
     is_needs_password = doc.needs_pass
     is_encrypted = doc.is_encrypted
     total_page = len(doc)
@@ -320,23 +412,13 @@ def pdf_meta_scan(pdf_bytes: bytes):
         result = {"_need_drop": True, "_drop_reason": DropReason.EMPTY_PDF}
         return result
     else:
-        page_width_pts, page_height_pts = get_pdf_page_size_pts(doc)
-        # logger.info(f"page_width_pts: {page_width_pts}, page_height_pts: {page_height_pts}")
-
         # svgs_per_page = get_svgs_per_page(doc)
         # logger.info(f"svgs_per_page: {svgs_per_page}")
-        imgs_per_page = get_imgs_per_page(doc)
-        # logger.info(f"imgs_per_page: {imgs_per_page}")
-
-        image_info_per_page, junk_img_bojids = get_image_info(doc, page_width_pts, page_height_pts)
-        # logger.info(f"image_info_per_page: {image_info_per_page}, junk_img_bojids: {junk_img_bojids}")
-        text_len_per_page = get_pdf_textlen_per_page(doc)
-        # logger.info(f"text_len_per_page: {text_len_per_page}")
-        text_layout_per_page = get_pdf_text_layout_per_page(doc)
-        # logger.info(f"text_layout_per_page: {text_layout_per_page}")
-        text_language = get_language(doc)
-        # logger.info(f"text_language: {text_language}")
-        invalid_chars = check_invalid_chars(pdf_bytes)
+
+        # 一次遍历收集各页特征，每页的TextPage只构建一次，后续解析也共用
+        page_ids = select_scan_page_ids(total_page, page_budget)
+        features = scan_pdf_features(doc, pdf_session.text_layer, page_ids)
+        invalid_chars = check_invalid_chars(pdf_bytes, doc)
         # logger.info(f"invalid_chars: {invalid_chars}")
 
         # 最后输出一条json
@@ -344,15 +426,15 @@ def pdf_meta_scan(pdf_bytes: bytes):
             "is_needs_password": is_needs_password,
             "is_encrypted": is_encrypted,
             "total_page": total_page,
-            "page_width_pts": int(page_width_pts),
-            "page_height_pts": int(page_height_pts),
-            "image_info_per_page": image_info_per_page,
-            "text_len_per_page": text_len_per_page,
-            "text_layout_per_page": text_layout_per_page,
-            "text_language": text_language,
+            "page_width_pts": int(features["page_width_pts"]),
+            "page_height_pts": int(features["page_height_pts"]),
+            "image_info_per_page": features["image_info_per_page"],
+            "text_len_per_page": features["text_len_per_page"],
+            "text_layout_per_page": features["text_layout_per_page"],
+            "text_language": features["text_language"],
             # "svgs_per_page": svgs_per_page,
-            "imgs_per_page": imgs_per_page,  # 增加每页img数量list
-            "junk_img_bojids": junk_img_bojids,  # 增加垃圾图片的bojid list
+            "imgs_per_page": features["imgs_per_page"],  # 增加每页img数量list
+            "junk_img_bojids": features["junk_img_bojids"],  # 增加垃圾图片的bojid list
             "invalid_chars": invalid_chars,
             "metadata": doc.metadata
         }
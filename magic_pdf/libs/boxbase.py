@@ -1,8 +1,11 @@
 
 
 from loguru import logger
+import heapq
 import math
 
+import numpy as np
+
 def _is_in_or_part_overlap(box1, box2) -> bool:
     """
     两个bbox是否有部分重叠或者包含
@@ -56,6 +59,18 @@ def _is_in(box1, box2) -> bool:
             y0_1 >= y0_2 and  # box1的上边界不在box2的上边外
             x1_1 <= x1_2 and  # box1的右边界不在box2的右边外
             y1_1 <= y1_2)     # box1的下边界不在box2的下边外
+
+
+def is_in_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """
+    返回形状为(N, M)的bool矩阵，第(i, j)个元素与_is_in(bboxes1[i], bboxes2[j])一致
+    """
+    bboxes1 = np.asarray(bboxes1, dtype=np.float64).reshape(-1, 4)
+    bboxes2 = np.asarray(bboxes2, dtype=np.float64).reshape(-1, 4)
+    return ((bboxes1[:, None, 0] >= bboxes2[None, :, 0]) &
+            (bboxes1[:, None, 1] >= bboxes2[None, :, 1]) &
+            (bboxes1[:, None, 2] <= bboxes2[None, :, 2]) &
+            (bboxes1[:, None, 3] <= bboxes2[None, :, 3]))
     
 def _is_part_overlap(box1, box2) -> bool:
     """
@@ -194,6 +209,114 @@ def calculate_iou(bbox1, bbox2):
     return iou
 
 
+def calculate_iou_matrix(bboxes) -> np.ndarray:
+    """
+    计算一组边界框两两之间的交并比，与逐对调用calculate_iou的结果一致
+
+    Args:
+        bboxes: 形状为(N, 4)的数组或列表，每行格式为[x1, y1, x2, y2]
+
+    Returns:
+        np.ndarray: 形状为(N, N)的交并比矩阵，不相交的位置为0
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    x_left = np.maximum(bboxes[:, None, 0], bboxes[None, :, 0])
+    y_top = np.maximum(bboxes[:, None, 1], bboxes[None, :, 1])
+    x_right = np.minimum(bboxes[:, None, 2], bboxes[None, :, 2])
+    y_bottom = np.minimum(bboxes[:, None, 3], bboxes[None, :, 3])
+    intersect = (x_right >= x_left) & (y_bottom >= y_top)
+    intersection_area = np.where(intersect, (x_right - x_left) * (y_bottom - y_top), 0.0)
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    union_area = (areas[:, None] + areas[None, :]) - intersection_area
+    with np.errstate(divide="ignore", invalid="ignore"):
+        iou = np.where(intersect, intersection_area / union_area, 0.0)
+    return iou
+
+
+def get_overlapping_bbox_pairs(bboxes) -> list:
+    """
+    按y0排序做扫描线，找出所有相交(边界相接也算)的bbox对，避免两两比较
+
+    Args:
+        bboxes: bbox列表，每个格式为[x0, y0, x1, y1]
+
+    Returns:
+        list[tuple[int, int]]: 相交的bbox下标对(i, j)，i < j
+    """
+    order = sorted(range(len(bboxes)), key=lambda idx: bboxes[idx][1])
+    # 与扫描线相交的bbox，按y1建堆，y1在扫描线上方的bbox不会再与后面的bbox相交
+    active = []
+    pairs = []
+    for i in order:
+        x0, y0, x1, y1 = bboxes[i]
+        while active and active[0][0] < y0:
+            heapq.heappop(active)
+        for _, j in active:
+            bx0, by0, bx1, by1 = bboxes[j]
+            if max(x0, bx0) <= min(x1, bx1) and max(y0, by0) <= min(y1, by1):
+                pairs.append((min(i, j), max(i, j)))
+        heapq.heappush(active, (y1, i))
+    return pairs
+
+
+def build_bbox_grid_index(bboxes, cell_num=32) -> dict:
+    """
+    把bbox放进均匀网格，网格大小按所有bbox的外接范围划分为约cell_num x cell_num格，每个bbox登记到它覆盖的所有格子
+
+    Returns:
+        dict: {"cell_size": 格子边长, "bounds": 格子行列号范围, "cells": {(列号, 行号): [bbox下标, ...]}}
+    """
+    if len(bboxes) == 0:
+        return {"cell_size": 1, "bounds": (0, 0, -1, -1), "cells": {}}
+    x0, y0 = min(bbox[0] for bbox in bboxes), min(bbox[1] for bbox in bboxes)
+    x1, y1 = max(bbox[2] for bbox in bboxes), max(bbox[3] for bbox in bboxes)
+    cell_size = max(max(x1 - x0, y1 - y0) / cell_num, 1)
+    grid_index = {
+        "cell_size": cell_size,
+        "bounds": (math.floor(x0 / cell_size), math.floor(y0 / cell_size),
+                   math.floor(x1 / cell_size), math.floor(y1 / cell_size)),
+        "cells": {},
+    }
+    cells = grid_index["cells"]
+    for idx, (bx0, by0, bx1, by1) in enumerate(bboxes):
+        # bbox都在网格范围内，不需要限制行列号
+        for col in range(math.floor(bx0 / cell_size), math.floor(bx1 / cell_size) + 1):
+            for row in range(math.floor(by0 / cell_size), math.floor(by1 / cell_size) + 1):
+                bucket = cells.get((col, row))
+                if bucket is None:
+                    cells[(col, row)] = [idx]
+                else:
+                    bucket.append(idx)
+    return grid_index
+
+
+def query_bbox_grid_index(grid_index, bbox) -> list:
+    """
+    返回与bbox所覆盖的格子有交集的bbox下标(升序)，与bbox相交(边界相接也算)的bbox一定在其中
+    """
+    cells = grid_index["cells"]
+    idxes = set()
+    cols, rows = _bbox_grid_range(grid_index, bbox)
+    for col in cols:
+        for row in rows:
+            bucket = cells.get((col, row))
+            if bucket is not None:
+                idxes.update(bucket)
+    return sorted(idxes)
+
+
+def _bbox_grid_range(grid_index, bbox):
+    """
+    bbox覆盖的列号、行号范围，限制在网格范围内
+    """
+    cell_size = grid_index["cell_size"]
+    min_col, min_row, max_col, max_row = grid_index["bounds"]
+    x0, y0, x1, y1 = bbox
+    cols = range(max(math.floor(x0 / cell_size), min_col), min(math.floor(x1 / cell_size), max_col) + 1)
+    rows = range(max(math.floor(y0 / cell_size), min_row), min(math.floor(y1 / cell_size), max_row) + 1)
+    return cols, rows
+
+
 def calculate_overlap_area_2_minbox_area_ratio(bbox1, bbox2):
     """
     计算box1和box2的重叠面积占最小面积的box的比例
@@ -405,4 +528,36 @@ def bbox_distance(bbox1, bbox2):
     elif top:
         return y2 - y1b
     else:             # rectangles intersect
-        return 0
\ No newline at end of file
+        return 0
+
+
+def bbox_relative_pos_matrix(bboxes1, bboxes2) -> tuple:
+    """
+    bbox_relative_pos的矩阵版本，返回(left, right, bottom, top)四个形状为(N, M)的bool矩阵，
+    第(i, j)个元素表示bboxes1[i]相对于bboxes2[j]的位置关系
+    """
+    bboxes1 = np.asarray(bboxes1, dtype=np.float64).reshape(-1, 4)
+    bboxes2 = np.asarray(bboxes2, dtype=np.float64).reshape(-1, 4)
+    left = bboxes2[None, :, 2] < bboxes1[:, None, 0]
+    right = bboxes1[:, None, 2] < bboxes2[None, :, 0]
+    bottom = bboxes2[None, :, 3] < bboxes1[:, None, 1]
+    top = bboxes1[:, None, 3] < bboxes2[None, :, 1]
+    return left, right, bottom, top
+
+
+def bbox_distance_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """
+    bbox_distance的矩阵版本，返回形状为(N, M)的矩阵，第(i, j)个元素对应bbox_distance(bboxes1[i], bboxes2[j])
+    宽高为正且坐标为整数的框结果完全一致，浮点坐标的斜对角距离可能有末位的舍入误差
+    """
+    bboxes1 = np.asarray(bboxes1, dtype=np.float64).reshape(-1, 4)
+    bboxes2 = np.asarray(bboxes2, dtype=np.float64).reshape(-1, 4)
+    left, right, bottom, top = bbox_relative_pos_matrix(bboxes1, bboxes2)
+    # 水平和竖直方向上的间隔，没有错开的方向间隔为0
+    gap_x = np.where(left, bboxes1[:, None, 0] - bboxes2[None, :, 2],
+                     np.where(right, bboxes2[None, :, 0] - bboxes1[:, None, 2], 0.0))
+    gap_y = np.where(bottom, bboxes1[:, None, 1] - bboxes2[None, :, 3],
+                     np.where(top, bboxes2[None, :, 1] - bboxes1[:, None, 3], 0.0))
+    # 斜对角时为两个角点间的距离，否则为单个方向上的间隔
+    diagonal = (left | right) & (bottom | top)
+    return np.where(diagonal, np.sqrt(gap_x * gap_x + gap_y * gap_y), gap_x + gap_y)
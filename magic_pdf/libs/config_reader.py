@@ -77,6 +77,18 @@ def get_device():
         return device
 
 
+def get_models_memory_budget():
+    """
+    模型组件占用内存的上限(MB)，超过时淘汰最久未使用的组件，0表示不限制
+    """
+    config = read_config()
+    memory_budget = config.get("models-memory-budget-mb")
+    if memory_budget is None:
+        return 0
+    else:
+        return int(memory_budget)
+
+
 def get_table_recog_config():
     config = read_config()
     table_config = config.get("table-config")
@@ -87,5 +99,77 @@ def get_table_recog_config():
         return table_config
 
 
+def get_ocr_config():
+    config = read_config()
+    ocr_config = config.get("ocr-config")
+    if ocr_config is None:
+        logger.warning(f"'ocr-config' not found in {CONFIG_FILE_NAME}, use 'region' mode as default")
+        return json.loads('{"mode": "region", "det_limit_side_len": 2400, "rec_batch_num": 30}')
+    else:
+        return ocr_config
+
+
+def get_pipeline_config():
+    config = read_config()
+    pipeline_config = config.get("pipeline-config")
+    if pipeline_config is None:
+        logger.warning(f"'pipeline-config' not found in {CONFIG_FILE_NAME}, use 'False' as default")
+        return json.loads('{"enable": false, "stages": {}}')
+    else:
+        return pipeline_config
+
+
+def get_model_cache_config():
+    config = read_config()
+    model_cache_config = config.get("model-cache")
+    if model_cache_config is None:
+        return json.loads('{"enable": false}')
+    else:
+        return model_cache_config
+
+
+def get_formula_gate_config():
+    config = read_config()
+    formula_gate_config = config.get("formula-gate")
+    if formula_gate_config is None:
+        return json.loads('{"enable": false}')
+    else:
+        return formula_gate_config
+
+
+def get_recognition_cache_config():
+    config = read_config()
+    recognition_cache_config = config.get("recognition-cache")
+    if recognition_cache_config is None:
+        return json.loads('{"enable": false}')
+    else:
+        return recognition_cache_config
+
+
+def get_render_dpi_config():
+    config = read_config()
+    render_dpi_config = config.get("render-dpi")
+    if render_dpi_config is None:
+        return json.loads('{"mode": "fixed", "dpi": 200}')
+    else:
+        return render_dpi_config
+
+
+def get_meta_scan_page_budget():
+    """
+    分类时超大pdf只抽样扫描这么多页，None表示扫描全部页
+    分类本身不依赖配置文件，没有配置文件时也扫描全部页
+    """
+    try:
+        config = read_config()
+    except FileNotFoundError:
+        return None
+    page_budget = config.get("meta-scan", {}).get("page-budget")
+    if page_budget is None:
+        return None
+    else:
+        return int(page_budget)
+
+
 if __name__ == "__main__":
     ak, sk, endpoint = get_s3_config("llm-raw")
@@ -1,7 +1,9 @@
 def get_scale_ratio(model_page_info, page):
-    pix = page.get_pixmap(dpi=72)
-    pymu_width = int(pix.w)
-    pymu_height = int(pix.h)
+    # 与72dpi渲染得到的pixmap尺寸一致，不必真的渲染一次页面
+    rect = page.rect.irect
+    pymu_width = rect.width
+    pymu_height = rect.height
+    # 每页记录的是该页实际渲染的宽高，各页按不同dpi渲染时比例依然正确
     width_from_json = model_page_info['page_info']['width']
     height_from_json = model_page_info['page_info']['height']
     horizontal_scale_ratio = width_from_json / pymu_width
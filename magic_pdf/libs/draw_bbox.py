@@ -125,7 +125,9 @@ def draw_layout_bbox(pdf_info, pdf_bytes, out_path):
         interequations_list.append(interequations)
 
     pdf_docs = fitz.open("pdf", pdf_bytes)
-    for i, page in enumerate(pdf_docs):
+    # 只解析了部分页时，pdf_info中第i项对应的是第page_idx页
+    for i, page_info in enumerate(pdf_info):
+        page = pdf_docs[page_info["page_idx"]]
         draw_bbox_with_number(i, layout_bbox_list, page, [255, 0, 0], False)
         draw_bbox_without_number(i, dropped_bbox_list, page, [158, 158, 158], True)
         draw_bbox_without_number(i, tables_list, page, [153, 153, 0], True)  # color !
@@ -215,7 +217,8 @@ def draw_span_bbox(pdf_info, pdf_bytes, out_path):
         image_list.append(page_image_list)
         table_list.append(page_table_list)
     pdf_docs = fitz.open("pdf", pdf_bytes)
-    for i, page in enumerate(pdf_docs):
+    for i, page_info in enumerate(pdf_info):
+        page = pdf_docs[page_info["page_idx"]]
         # 获取当前页面的数据
         draw_bbox_without_number(i, text_list, page, [255, 0, 0], False)
         draw_bbox_without_number(i, inline_equation_list, page, [0, 255, 0], False)
@@ -0,0 +1,31 @@
+def parse_page_list(pages: str) -> list:
+    """
+    解析"0-9,15,20-25"形式的页码列表(页码从0开始，区间两端都包含)，返回去重并排序后的页码
+    """
+    page_ids = set()
+    for part in pages.split(","):
+        part = part.strip()
+        if part == "":
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start, end = int(start), int(end)
+            if start > end:
+                raise ValueError(f"invalid page range: {part}")
+            page_ids.update(range(start, end + 1))
+        else:
+            page_ids.add(int(part))
+    return sorted(page_ids)
+
+
+def resolve_page_ids(page_count: int, start_page_id: int = 0, end_page_id: int = None, page_list: list = None) -> list:
+    """
+    start_page_id到end_page_id(包含，None表示最后一页)之间的页码，page_list不为None时只保留其中列出的页
+    超出文档范围的页码被忽略
+    """
+    last_page_id = page_count - 1 if end_page_id is None else min(end_page_id, page_count - 1)
+    page_ids = range(max(start_page_id, 0), last_page_id + 1)
+    if page_list is not None:
+        selected = set(page_list)
+        return [page_id for page_id in page_ids if page_id in selected]
+    return list(page_ids)
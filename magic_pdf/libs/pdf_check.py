@@ -3,7 +3,14 @@ import re
 import fitz
 import numpy as np
 from loguru import logger
-from pdfminer.high_level import extract_text
+
+# 固定种子抽样，同一份pdf每次检测的页面相同，结果可复现、可缓存
+SAMPLE_SEED = 0
+# 当一篇文章存在5%以上的文本是乱码时,认为该文档为乱码文档
+INVALID_CHARS_RATIO = 0.05
+# 清除TEXT_CID_FOR_UNKNOWN_UNICODE后，没有unicode映射的字形提取为U+FFFD，而不是原始cid
+INVALID_CHARS_TEXTFLAGS = fitz.TEXTFLAGS_TEXT & ~fitz.TEXT_CID_FOR_UNKNOWN_UNICODE
+REPLACEMENT_CHAR = chr(0xFFFD)
 
 
 def calculate_sample_count(total_page: int):
@@ -14,49 +21,89 @@ def calculate_sample_count(total_page: int):
     return select_page_cnt
 
 
-def extract_pages(src_pdf_bytes: bytes):
-    pdf_docs = fitz.open("pdf", src_pdf_bytes)
+def select_sample_page_ids(total_page: int, seed: int = SAMPLE_SEED) -> list:
+    select_page_cnt = calculate_sample_count(total_page)
+    page_ids = np.random.RandomState(seed).choice(total_page, select_page_cnt, replace=False)
+    return sorted(int(page_id) for page_id in page_ids)
+
+
+def extract_pages(src_pdf_bytes: bytes, pdf_docs: fitz.Document = None, seed: int = SAMPLE_SEED):
+    if pdf_docs is None:
+        pdf_docs = fitz.open("pdf", src_pdf_bytes)
     total_page = len(pdf_docs)
     if total_page == 0:
         # 如果PDF没有页面，直接返回空文档
         logger.warning("PDF is empty, return empty document")
         return fitz.Document()
-    select_page_cnt = calculate_sample_count(total_page)
 
-    page_num = np.random.choice(total_page, select_page_cnt, replace=False)
     sample_docs = fitz.Document()
     try:
-        for index in page_num:
-            sample_docs.insert_pdf(pdf_docs, from_page=int(index), to_page=int(index))
+        for index in select_sample_page_ids(total_page, seed):
+            sample_docs.insert_pdf(pdf_docs, from_page=index, to_page=index)
     except Exception as e:
         logger.exception(e)
     return sample_docs
 
 
-def detect_invalid_chars(src_pdf_bytes: bytes) -> bool:
-    """"
-    检测PDF中是否包含非法字符
+def count_invalid_chars_by_fitz(pdf_docs: fitz.Document, page_ids: list):
+    """
+    直接在已打开的文档上统计抽样页面中没有unicode映射的字符，返回(乱码字符数, 非空白字符总数)
+    没有字体的页面(如扫描页)不含文本，不再提取
     """
-    '''pdfminer比较慢,需要先随机抽取10页左右的sample'''
-    sample_docs = extract_pages(src_pdf_bytes)
-    sample_pdf_bytes = sample_docs.tobytes()
-    sample_pdf_file_like_object = BytesIO(sample_pdf_bytes)
+    invalid_count = 0
+    chars_count = 0
+    for page_id in page_ids:
+        page = pdf_docs[page_id]
+        if len(page.get_fonts()) == 0:
+            continue
+        text = "".join(page.get_text("text", flags=INVALID_CHARS_TEXTFLAGS).split())
+        invalid_count += text.count(REPLACEMENT_CHAR)
+        chars_count += len(text)
+    return invalid_count, chars_count
+
+
+def count_invalid_chars_by_pdfminer(src_pdf_bytes: bytes, pdf_docs: fitz.Document = None, seed: int = SAMPLE_SEED):
+    """
+    抽样页面另存为新pdf后用pdfminer重新解析，乱码文本用pdfminer提取出来的文本特征是(cid:xxx)
+    返回(乱码字符数, 字符总数)
+    """
+    from pdfminer.high_level import extract_text
+
+    sample_docs = extract_pages(src_pdf_bytes, pdf_docs, seed)
+    sample_pdf_file_like_object = BytesIO(sample_docs.tobytes())
     text = extract_text(sample_pdf_file_like_object)
     text = text.replace("\n", "")
-    # logger.info(text)
-    '''乱码文本用pdfminer提取出来的文本特征是(cid:xxx)'''
     cid_pattern = re.compile(r'\(cid:\d+\)')
     matches = cid_pattern.findall(text)
     cid_count = len(matches)
     cid_len = sum(len(match) for match in matches)
-    text_len = len(text)
-    if text_len == 0:
-        cid_chars_radio = 0
+    return cid_count, cid_count + len(text) - cid_len
+
+
+def detect_invalid_chars(src_pdf_bytes: bytes, pdf_docs: fitz.Document = None, method: str = "fitz",
+                         seed: int = SAMPLE_SEED) -> bool:
+    """"
+    检测PDF中是否包含非法字符，返回False表示乱码文档
+    pdf_docs: 已经打开的文档，不为None时直接从中抽样，不再重新打开
+    method: fitz直接检查已打开文档中的字形映射；pdfminer为旧的检测方式(较慢，需要安装pdfminer.six)，
+            fitz检测出错时也会退回pdfminer
+    """
+    if method == "pdfminer":
+        invalid_count, chars_count = count_invalid_chars_by_pdfminer(src_pdf_bytes, pdf_docs, seed)
     else:
-        cid_chars_radio = cid_count/(cid_count + text_len - cid_len)
-    logger.info(f"cid_count: {cid_count}, text_len: {text_len}, cid_chars_radio: {cid_chars_radio}")
-    '''当一篇文章存在5%以上的文本是乱码时,认为该文档为乱码文档'''
-    if cid_chars_radio > 0.05:
+        if pdf_docs is None:
+            pdf_docs = fitz.open("pdf", src_pdf_bytes)
+        try:
+            invalid_count, chars_count = count_invalid_chars_by_fitz(
+                pdf_docs, select_sample_page_ids(len(pdf_docs), seed))
+        except Exception as e:
+            logger.exception(e)
+            invalid_count, chars_count = count_invalid_chars_by_pdfminer(src_pdf_bytes, pdf_docs, seed)
+
+    invalid_chars_radio = 0 if chars_count == 0 else invalid_count / chars_count
+    logger.info(f"invalid_chars_count: {invalid_count}, chars_count: {chars_count}, "
+                f"invalid_chars_radio: {invalid_chars_radio}")
+    if invalid_chars_radio > INVALID_CHARS_RATIO:
         return False  # 乱码文档
     else:
         return True   # 正常文档
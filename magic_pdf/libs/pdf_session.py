@@ -0,0 +1,48 @@
+"""
+一次处理过程中同一份pdf共享的上下文：分类、推理、解析各环节传入同一个PdfSession，
+pdf只打开一次、md5只计算一次，文本层(TextPage)也只提取一次
+"""
+from magic_pdf.libs.commons import fitz
+from magic_pdf.libs.hash_utils import compute_md5
+from magic_pdf.libs.pdf_text_layer import PdfTextLayer
+
+
+class PdfSession:
+    """
+    各属性在第一次访问时才创建
+    fitz文档不是线程安全的，同一时刻只能在一个线程中使用；需要修改页面(如绘制bbox)时应另外打开，不能改动共享的文档
+    """
+
+    def __init__(self, pdf_bytes: bytes):
+        self.pdf_bytes = pdf_bytes
+        self.__doc = None
+        self.__md5 = None
+        self.__text_layer = None
+
+    @property
+    def doc(self) -> fitz.Document:
+        if self.__doc is None:
+            self.__doc = fitz.open("pdf", self.pdf_bytes)
+        return self.__doc
+
+    @property
+    def md5(self) -> str:
+        if self.__md5 is None:
+            self.__md5 = compute_md5(self.pdf_bytes)
+        return self.__md5
+
+    @property
+    def page_count(self) -> int:
+        return self.doc.page_count
+
+    @property
+    def text_layer(self) -> PdfTextLayer:
+        if self.__text_layer is None:
+            self.__text_layer = PdfTextLayer(self.doc)
+        return self.__text_layer
+
+    def close(self):
+        self.__text_layer = None
+        if self.__doc is not None:
+            self.__doc.close()
+            self.__doc = None
@@ -0,0 +1,44 @@
+"""
+pdf文本层缓存：每页只构建一次fitz TextPage，dict/rawdict/text等视图都从同一个TextPage导出，
+避免分类、txt模式span提取等环节对同一页反复解析内容流
+"""
+from collections import OrderedDict
+
+from magic_pdf.libs.commons import fitz
+
+
+class PdfTextLayer:
+    """
+    一个文档对应一个实例，TextPage统一按TEXTFLAGS_TEXT构建(不保留图片块)
+    TextPage按页做LRU缓存，最多保留max_cached_pages页；dict/text等视图每次从TextPage导出，不另外缓存
+    """
+
+    def __init__(self, doc: fitz.Document, max_cached_pages=100):
+        self.doc = doc
+        self.max_cached_pages = max_cached_pages
+        # page_id -> (page, textpage)，get_text要求传入构建TextPage时的同一个page对象
+        self.textpages = OrderedDict()
+
+    def __get_textpage(self, page_id):
+        cached = self.textpages.get(page_id)
+        if cached is None:
+            page = self.doc[page_id]
+            cached = (page, page.get_textpage(flags=fitz.TEXTFLAGS_TEXT))
+            self.textpages[page_id] = cached
+            while len(self.textpages) > self.max_cached_pages:
+                self.textpages.popitem(last=False)
+        else:
+            self.textpages.move_to_end(page_id)
+        return cached
+
+    def get_dict(self, page_id) -> dict:
+        page, textpage = self.__get_textpage(page_id)
+        return page.get_text("dict", textpage=textpage)
+
+    def get_rawdict(self, page_id) -> dict:
+        page, textpage = self.__get_textpage(page_id)
+        return page.get_text("rawdict", textpage=textpage)
+
+    def get_text(self, page_id) -> str:
+        page, textpage = self.__get_textpage(page_id)
+        return page.get_text("text", textpage=textpage)
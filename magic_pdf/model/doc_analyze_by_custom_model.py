@@ -1,11 +1,23 @@
+import contextlib
+import ctypes
+import queue
+import threading
 import time
 
 import fitz
 import numpy as np
 from loguru import logger
 
-from magic_pdf.libs.config_reader import get_local_models_dir, get_device, get_table_recog_config
+from magic_pdf.libs.config_reader import get_local_models_dir, get_device, get_table_recog_config, get_ocr_config, \
+    get_pipeline_config, get_models_memory_budget, get_render_dpi_config, get_formula_gate_config
+from magic_pdf.libs.page_range import resolve_page_ids
+from magic_pdf.libs.pdf_session import PdfSession
+from magic_pdf.model.formula_gate import FormulaGate
+from magic_pdf.model.inference_pipeline import InferencePipeline, PipelineStage
 from magic_pdf.model.model_list import MODEL
+from magic_pdf.model.model_output_cache import ModelOutputCache, get_model_output_cache, model_fingerprint
+from magic_pdf.model.model_registry import ModelRegistry
+from magic_pdf.model.render_dpi import DpiPolicy, limit_dpi_by_side, render_size
 import magic_pdf.model as model_config
 
 
@@ -23,31 +35,119 @@ def remove_duplicates_dicts(lst):
     return unique_dicts
 
 
-def load_images_from_pdf(pdf_bytes: bytes, dpi=200) -> list:
-    try:
-        from PIL import Image
-    except ImportError:
-        logger.error("Pillow not installed, please install by pip.")
-        exit(1)
+def pixmap_to_array(pm) -> np.ndarray:
+    """
+    不复制像素，返回pixmap samples上的(height, width, n)数组
+    samples_mv不持有pixmap，pixmap被回收后这块内存即被mupdf释放；因此用持有pixmap引用的ctypes缓冲区作为数组的base，
+    数组及其所有视图存活期间pixmap都不会被回收
+    """
+    samples = pm.samples_mv
+    buffer = (ctypes.c_uint8 * len(samples)).from_buffer(samples)
+    buffer.pixmap = pm
+    return np.ndarray((pm.height, pm.width, pm.n), dtype=np.uint8, buffer=buffer, strides=(pm.stride, pm.n, 1))
+
+
+def render_page_image(page, dpi=200) -> dict:
+    # If the width or height exceeds 9000 after scaling, do not scale further.
+    # 先按页面尺寸算出渲染后的大小，超大页面不必先按原dpi渲染一次
+    dpi = limit_dpi_by_side(page, dpi)
+    mat = fitz.Matrix(dpi / 72, dpi / 72)
+    pm = page.get_pixmap(matrix=mat, alpha=False)
+
+    # 每页的像素只由mupdf分配一次，不再经过PIL中转复制
+    img = pixmap_to_array(pm)
+    img_dict = {"img": img, "width": pm.width, "height": pm.height, "dpi": dpi}
+    return img_dict
+
+
+def page_image_info(page, dpi=200) -> dict:
+    """
+    不渲染，按render_page_image的规则计算该页图片的宽高和实际使用的dpi
+    """
+    dpi = limit_dpi_by_side(page, dpi)
+    width, height = render_size(page, dpi)
+    return {"height": height, "width": width, "dpi": dpi}
+
 
+def load_images_from_pdf(pdf_bytes: bytes, dpi=200, pdf_session: PdfSession = None) -> list:
     images = []
-    with fitz.open("pdf", pdf_bytes) as doc:
-        for index in range(0, doc.page_count):
-            page = doc[index]
-            mat = fitz.Matrix(dpi / 72, dpi / 72)
-            pm = page.get_pixmap(matrix=mat, alpha=False)
-
-            # If the width or height exceeds 9000 after scaling, do not scale further.
-            if pm.width > 9000 or pm.height > 9000:
-                pm = page.get_pixmap(matrix=fitz.Matrix(1, 1), alpha=False)
-
-            img = Image.frombytes("RGB", (pm.width, pm.height), pm.samples)
-            img = np.array(img)
-            img_dict = {"img": img, "width": pm.width, "height": pm.height}
-            images.append(img_dict)
+    for img_dict in iter_images_from_pdf(pdf_bytes, dpi=dpi, prefetch=0, pdf_session=pdf_session):
+        images.append(img_dict)
     return images
 
 
+_RENDER_DONE = object()
+
+
+def iter_images_from_pdf(pdf_bytes: bytes, dpi=200, prefetch=2, page_ids=None, dpi_policy: DpiPolicy = None,
+                         formula_gate: FormulaGate = None, pdf_session: PdfSession = None):
+    """
+    按需逐页渲染pdf，每次只产出一页图片，消费方用完即可释放，峰值内存与页数无关
+    prefetch: 后台线程预渲染的页数(look-ahead深度)，<=0时在调用线程中同步渲染
+    page_ids: 只渲染这些页(按给定顺序)，None表示渲染全部页
+    dpi_policy: 不为None时由它逐页选择dpi，忽略dpi参数
+    formula_gate: 不为None时检查每页的文本层，没有公式迹象的页在img_dict中标记skip_formula
+    pdf_session: 不为None时使用session中已打开的文档(预渲染时由后台线程独占使用)，否则重新打开pdf
+    """
+    def open_doc():
+        if pdf_session is not None:
+            return contextlib.nullcontext(pdf_session.doc)
+        return fitz.open("pdf", pdf_bytes)
+
+    def page_indexes(doc):
+        return range(0, doc.page_count) if page_ids is None else page_ids
+
+    def render(page):
+        img_dict = render_page_image(page, dpi_policy.page_dpi(page) if dpi_policy is not None else dpi)
+        if formula_gate is not None:
+            img_dict["skip_formula"] = not formula_gate.need_formula(page)
+        return img_dict
+
+    if prefetch <= 0:
+        with open_doc() as doc:
+            for index in page_indexes(doc):
+                yield render(doc[index])
+        return
+
+    page_queue = queue.Queue(maxsize=prefetch)
+    stop_event = threading.Event()
+
+    def put(item):
+        # 消费方提前退出时不再阻塞在已满的队列上
+        while not stop_event.is_set():
+            try:
+                page_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def render_worker():
+        try:
+            with open_doc() as doc:
+                for index in page_indexes(doc):
+                    if not put(render(doc[index])):
+                        return
+        except Exception as e:
+            put(e)
+        put(_RENDER_DONE)
+
+    worker = threading.Thread(target=render_worker, name="pdf-render", daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = page_queue.get()
+            if item is _RENDER_DONE:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+            item = None
+    finally:
+        stop_event.set()
+        worker.join()
+
+
 class ModelSingleton:
     _instance = None
     _models = {}
@@ -58,11 +158,20 @@ class ModelSingleton:
         return cls._instance
 
     def get_model(self, ocr: bool, show_log: bool):
+        """
+        不同(ocr, show_log)配置的实例只是轻量的包装，模型权重由ModelRegistry按组件共享和懒加载
+        """
         key = (ocr, show_log)
         if key not in self._models:
             self._models[key] = custom_model_init(ocr=ocr, show_log=show_log)
         return self._models[key]
 
+    def unload(self, component: str = None):
+        """
+        卸载指定的模型组件(layout/mfd/mfr/ocr/table)，component为None时卸载全部，下次使用时会重新加载
+        """
+        ModelRegistry().unload(component)
+
 
 def custom_model_init(ocr: bool = False, show_log: bool = False):
     model = None
@@ -84,12 +193,15 @@ def custom_model_init(ocr: bool = False, show_log: bool = False):
             # 从配置文件读取model-dir和device
             local_models_dir = get_local_models_dir()
             device = get_device()
+            ModelRegistry().set_memory_budget(get_models_memory_budget() * 1024 * 1024)
             table_config = get_table_recog_config()
+            ocr_config = get_ocr_config()
             model_input = {"ocr": ocr,
                            "show_log": show_log,
                            "models_dir": local_models_dir,
                            "device": device,
-                           "table_config": table_config}
+                           "table_config": table_config,
+                           "ocr_config": ocr_config}
             custom_model = CustomPEKModel(**model_input)
         else:
             logger.error("Not allow model_name!")
@@ -103,24 +215,244 @@ def custom_model_init(ocr: bool = False, show_log: bool = False):
     return custom_model
 
 
-def doc_analyze(pdf_bytes: bytes, ocr: bool = False, show_log: bool = False):
+PIPELINE_STAGES = ["layout", "formula", "ocr", "table"]
 
-    model_manager = ModelSingleton()
-    custom_model = model_manager.get_model(ocr, show_log)
 
-    images = load_images_from_pdf(pdf_bytes)
+def pipeline_analyze_pages(custom_model, pdf_bytes: bytes, pipeline_config: dict, page_ids: list = None,
+                           dpi_policy: DpiPolicy = None, formula_gate: FormulaGate = None,
+                           pdf_session: PdfSession = None):
+    """
+    流水线推理：渲染、layout检测、公式检测、ocr、表格识别分别在各自的线程中进行，阶段之间用有界队列连接
+    各阶段的worker数和输入队列深度由pipeline_config["stages"]配置，结束时输出各阶段的耗时和队列统计
+    """
+    stage_funcs = {
+        "layout": custom_model.detect_layout,
+        "formula": custom_model.detect_formula,
+        "ocr": custom_model.recognize_text,
+        "table": custom_model.recognize_table,
+    }
+    stage_configs = pipeline_config.get("stages", {})
+    stages = []
+    for name in PIPELINE_STAGES:
+        stage_config = stage_configs.get(name, {})
+        stages.append(PipelineStage(name, stage_funcs[name], workers=stage_config.get("workers", 1),
+                                    queue_size=stage_config.get("queue_size", 2)))
+
+    def pages():
+        page_images = iter_images_from_pdf(pdf_bytes, prefetch=0, page_ids=page_ids, dpi_policy=dpi_policy,
+                                           formula_gate=formula_gate, pdf_session=pdf_session)
+        for idx, img_dict in enumerate(page_images):
+            page_no = idx if page_ids is None else page_ids[idx]
+            page = custom_model.new_page(img_dict["img"], skip_formula=img_dict.get("skip_formula", False))
+            page["page_info"] = {"page_no": page_no, "height": img_dict["height"], "width": img_dict["width"],
+                                 "dpi": img_dict["dpi"]}
+            yield page
+
+    def to_page_dict(page):
+        # 只保留推理结果，该页的像素随page一起释放
+        return {"layout_dets": page["layout_res"], "page_info": page["page_info"]}
+
+    return InferencePipeline(pages(), stages, sink=to_page_dict).run()
+
+
+def analyze_pages(custom_model, pdf_bytes: bytes, prefetch_pages: int = 2, batch_size: int = 1,
+                  pipeline_config: dict = None, page_ids: list = None, dpi_policy: DpiPolicy = None,
+                  formula_gate: FormulaGate = None, pdf_session: PdfSession = None):
+    """
+    逐页(或按批)推理；支持延迟识别的模型不在这里flush，由调用方统一回填公式和文本行识别结果
+    batch_size > 1 时按批把多页送入模型(模型需支持batch_call)，摊薄单次推理开销
+    pipeline_config["enable"]为True时改用流水线推理(模型需支持按阶段调用)，此时忽略prefetch_pages和batch_size
+    page_ids: 只推理这些页，返回结果与page_ids一一对应，None表示全部页
+    dpi_policy: 逐页选择渲染dpi，None时按200dpi渲染；每页实际使用的dpi记录在page_info中
+    formula_gate: 公式检测前置检查，只能用于支持skip_formula参数的模型
+    """
+    if pipeline_config is not None and pipeline_config.get("enable", False):
+        if hasattr(custom_model, "new_page"):
+            return pipeline_analyze_pages(custom_model, pdf_bytes, pipeline_config, page_ids, dpi_policy,
+                                          formula_gate, pdf_session)
+        logger.warning(f"{type(custom_model).__name__} does not support pipeline inference, fallback to sequential")
+
+    if batch_size > 1 and not hasattr(custom_model, "batch_call"):
+        logger.warning(f"{type(custom_model).__name__} does not support batch inference, fallback to batch_size=1")
+        batch_size = 1
+    call_kwargs = {"flush": False} if hasattr(custom_model, "flush_pending") else {}
 
     model_json = []
+
+    def analyze_batch(batch):
+        if len(batch) == 1:
+            page_kwargs = {"skip_formula": batch[0]["skip_formula"]} if formula_gate is not None else {}
+            results = [custom_model(batch[0]["img"], **call_kwargs, **page_kwargs)]
+        else:
+            page_kwargs = {"skip_formula_list": [img_dict["skip_formula"] for img_dict in batch]} \
+                if formula_gate is not None else {}
+            results = custom_model.batch_call([img_dict["img"] for img_dict in batch], **call_kwargs, **page_kwargs)
+        for img_dict, result in zip(batch, results):
+            page_no = len(model_json) if page_ids is None else page_ids[len(model_json)]
+            page_info = {"page_no": page_no, "height": img_dict["height"], "width": img_dict["width"],
+                         "dpi": img_dict["dpi"]}
+            page_dict = {"layout_dets": result, "page_info": page_info}
+            model_json.append(page_dict)
+
+    batch = []
+    for img_dict in iter_images_from_pdf(pdf_bytes, prefetch=prefetch_pages, page_ids=page_ids, dpi_policy=dpi_policy,
+                                         formula_gate=formula_gate, pdf_session=pdf_session):
+        batch.append(img_dict)
+        del img_dict
+        if len(batch) >= batch_size:
+            analyze_batch(batch)
+            # 推理完成后立即释放该批页面的像素
+            batch = []
+    if len(batch) > 0:
+        analyze_batch(batch)
+
+    return model_json
+
+
+def flush_pending(custom_model):
+    if hasattr(custom_model, "flush_pending"):
+        custom_model.flush_pending()
+
+
+def analyze_document(custom_model, pdf_bytes: bytes, ocr: bool, prefetch_pages: int, batch_size: int,
+                     pipeline_config: dict, cache: ModelOutputCache = None, dpi_policy: DpiPolicy = None,
+                     page_ids: list = None, formula_gate: FormulaGate = None, pdf_session: PdfSession = None):
+    """
+    有缓存时先按页查缓存，只渲染和推理缓存中没有的页
+    page_ids: 只推理这些页，其余页不渲染，layout_dets为空，保证返回结果仍与pdf的页一一对应；None表示全部页
+    返回(model_json, save)：新推理的页要等flush_pending回填完公式和文本行后才完整，调用方flush之后再调用save写入缓存
+    """
+    if dpi_policy is None:
+        dpi_policy = DpiPolicy()
+    if pdf_session is None:
+        pdf_session = PdfSession(pdf_bytes)
+    doc = pdf_session.doc
+    page_count = doc.page_count
+    if page_ids is None:
+        page_ids = list(range(page_count))
+    model_json = [None] * page_count
+    selected = set(page_ids)
+    for page_no in range(page_count):
+        if page_no not in selected:
+            # 占位页只需要宽高，按固定dpi计算，不为不渲染的页统计字号
+            page_info = {"page_no": page_no}
+            page_info.update(page_image_info(doc[page_no], dpi_policy.dpi))
+            model_json[page_no] = {"layout_dets": [], "page_info": page_info}
+
+    missing_page_ids = page_ids
+    if cache is not None:
+        fingerprint = model_fingerprint(custom_model, ocr, dpi_policy.fingerprint(), formula_gate)
+        pdf_md5 = pdf_session.md5
+        for page_no in page_ids:
+            model_json[page_no] = cache.get(pdf_md5, fingerprint, page_no)
+        missing_page_ids = [page_no for page_no in page_ids if model_json[page_no] is None]
+        logger.info(f"model output cache hit pages: {len(page_ids) - len(missing_page_ids)}, "
+                    f"miss pages: {len(missing_page_ids)}")
+
+    new_pages = []
+    if len(missing_page_ids) > 0:
+        new_pages = analyze_pages(custom_model, pdf_bytes, prefetch_pages, batch_size, pipeline_config,
+                                  missing_page_ids, dpi_policy, formula_gate, pdf_session)
+        for page_dict in new_pages:
+            model_json[page_dict["page_info"]["page_no"]] = page_dict
+
+    def save():
+        if cache is None:
+            return
+        for page_dict in new_pages:
+            cache.put(pdf_md5, fingerprint, page_dict["page_info"]["page_no"], page_dict)
+
+    return model_json, save
+
+
+def init_formula_gate(custom_model):
+    """
+    开启了公式检测且配置中启用了formula-gate时返回FormulaGate，否则返回None
+    """
+    if not getattr(custom_model, "apply_formula", False):
+        return None
+    return FormulaGate.from_config(get_formula_gate_config())
+
+
+def select_page_ids(pdf_session: PdfSession, start_page_id: int = 0, end_page_id: int = None, page_list: list = None):
+    """
+    未限定页码范围时返回None(推理全部页)
+    """
+    if start_page_id == 0 and end_page_id is None and page_list is None:
+        return None
+    return resolve_page_ids(pdf_session.page_count, start_page_id, end_page_id, page_list)
+
+
+def doc_analyze(pdf_bytes: bytes, ocr: bool = False, show_log: bool = False, prefetch_pages: int = 2,
+                batch_size: int = 1, pipeline_config: dict = None, use_cache: bool = True,
+                start_page_id: int = 0, end_page_id: int = None, page_list: list = None,
+                pdf_session: PdfSession = None):
+    """
+    start_page_id/end_page_id(包含)/page_list限定要推理的页，范围外的页返回空的layout_dets
+    pdf_session: 与分类、解析共用的PdfSession，为None时新建
+    """
+
+    model_manager = ModelSingleton()
+    custom_model = model_manager.get_model(ocr, show_log)
+    if pipeline_config is None:
+        pipeline_config = get_pipeline_config()
+    cache = get_model_output_cache() if use_cache else None
+    dpi_policy = DpiPolicy.from_config(get_render_dpi_config())
+    formula_gate = init_formula_gate(custom_model)
+
     doc_analyze_start = time.time()
-    for index, img_dict in enumerate(images):
-        img = img_dict["img"]
-        page_width = img_dict["width"]
-        page_height = img_dict["height"]
-        result = custom_model(img)
-        page_info = {"page_no": index, "height": page_height, "width": page_width}
-        page_dict = {"layout_dets": result, "page_info": page_info}
-        model_json.append(page_dict)
+    if pdf_session is None:
+        pdf_session = PdfSession(pdf_bytes)
+    page_ids = select_page_ids(pdf_session, start_page_id, end_page_id, page_list)
+    model_json, save_to_cache = analyze_document(custom_model, pdf_bytes, ocr, prefetch_pages, batch_size,
+                                                 pipeline_config, cache, dpi_policy, page_ids, formula_gate,
+                                                 pdf_session)
+    # 整篇文档的公式/文本行截图攒满batch后识别，最后把剩余的一次识别完
+    flush_pending(custom_model)
+    save_to_cache()
+    if formula_gate is not None:
+        formula_gate.log_stats()
     doc_analyze_cost = time.time() - doc_analyze_start
     logger.info(f"doc analyze cost: {doc_analyze_cost}")
 
     return model_json
+
+
+def batch_doc_analyze(pdf_bytes_list: list, ocr: bool = False, show_log: bool = False, prefetch_pages: int = 2,
+                      batch_size: int = 1, pipeline_config: dict = None, use_cache: bool = True,
+                      start_page_id: int = 0, end_page_id: int = None, page_list: list = None):
+    """
+    批量任务中多篇文档共用同一组识别队列，所有文档推理完成后统一回填公式和文本行识别结果
+    页码范围对每篇文档分别生效
+    返回与pdf_bytes_list一一对应的model_json列表
+    """
+    model_manager = ModelSingleton()
+    custom_model = model_manager.get_model(ocr, show_log)
+    if pipeline_config is None:
+        pipeline_config = get_pipeline_config()
+    cache = get_model_output_cache() if use_cache else None
+    dpi_policy = DpiPolicy.from_config(get_render_dpi_config())
+    formula_gate = init_formula_gate(custom_model)
+
+    doc_analyze_start = time.time()
+    model_json_list = []
+    save_list = []
+    for pdf_bytes in pdf_bytes_list:
+        pdf_session = PdfSession(pdf_bytes)
+        page_ids = select_page_ids(pdf_session, start_page_id, end_page_id, page_list)
+        model_json, save_to_cache = analyze_document(custom_model, pdf_bytes, ocr, prefetch_pages, batch_size,
+                                                     pipeline_config, cache, dpi_policy, page_ids,
+                                                     formula_gate, pdf_session)
+        # 推理完成后不再需要打开的文档，只保留缓存写入需要的md5
+        pdf_session.close()
+        model_json_list.append(model_json)
+        save_list.append(save_to_cache)
+    flush_pending(custom_model)
+    for save_to_cache in save_list:
+        save_to_cache()
+    if formula_gate is not None:
+        formula_gate.log_stats()
+    doc_analyze_cost = time.time() - doc_analyze_start
+    logger.info(f"batch doc analyze cost: {doc_analyze_cost}, doc nums: {len(pdf_bytes_list)}")
+
+    return model_json_list
@@ -0,0 +1,120 @@
+"""
+公式检测前置检查：对有文本层的页面扫描其中的数学字体(CMMI/CMSY等)、数学符号unicode和运算符密度，
+没有任何数学迹象的页跳过公式检测和公式识别。
+只能判断文本层中的公式，以图片形式嵌入的公式会被漏掉，因此默认关闭
+"""
+import re
+import threading
+
+from loguru import logger
+
+# TeX数学字体、AMS符号字体、公式编辑器字体以及名字中带Math的字体(STIXMath、CambriaMath、AdvMathSymb等)
+MATH_FONT_PATTERN = re.compile(
+    r"CMMI|CMSY|CMEX|CMBSY|MSAM|MSBM|EUFM|EUSM|RSFS|ESINT|MTMI|MTSY|MTEX|RMTMI|EUCLID|SYMBOL|MATH",
+    re.IGNORECASE,
+)
+
+# 数学运算符、数学字母、箭头、希腊字母、上下标等unicode区间
+MATH_UNICODE_RANGES = [
+    (0x0370, 0x03FF),
+    (0x2070, 0x209F),
+    (0x2190, 0x21FF),
+    (0x2200, 0x22FF),
+    (0x27C0, 0x27EF),
+    (0x2980, 0x29FF),
+    (0x2A00, 0x2AFF),
+    (0x1D400, 0x1D7FF),
+]
+MATH_CHARS = {0x00B1, 0x00D7, 0x00F7, 0x00AC}
+OPERATOR_CHARS = {ord(c) for c in "=+<>^"}
+
+
+def is_math_unicode(code: int) -> bool:
+    if code in MATH_CHARS:
+        return True
+    for start, end in MATH_UNICODE_RANGES:
+        if start <= code <= end:
+            return True
+    return False
+
+
+def scan_math_evidence(page) -> dict:
+    """
+    统计页面文本层中的总字符数、数学字体字符数、数学符号字符数、运算符字符数，
+    以及不属于正文字体、不超过3个字符且含字母的短span数：很多排版系统把公式中的变量和符号
+    用单独的斜体/符号字体排成孤立的短span，且符号常被映射成普通拉丁字母(如用Z表示=)
+    """
+    spans = page.get_texttrace()
+    font_char_nums = {}
+    for span in spans:
+        font_char_nums[span["font"]] = font_char_nums.get(span["font"], 0) + len(span["chars"])
+    body_font = max(font_char_nums, key=font_char_nums.get) if font_char_nums else None
+
+    text_nums = math_font_nums = math_unicode_nums = operator_nums = short_span_nums = 0
+    for span in spans:
+        chars = span["chars"]
+        text_nums += len(chars)
+        if MATH_FONT_PATTERN.search(span["font"]):
+            math_font_nums += len(chars)
+        for char in chars:
+            code = char[0]
+            if is_math_unicode(code):
+                math_unicode_nums += 1
+            elif code in OPERATOR_CHARS:
+                operator_nums += 1
+        if span["font"] != body_font:
+            text = "".join(chr(char[0]) for char in chars).strip()
+            if 0 < len(text) <= 3 and any(c.isalpha() for c in text):
+                short_span_nums += 1
+    return {"text_nums": text_nums, "math_font_nums": math_font_nums, "math_unicode_nums": math_unicode_nums,
+            "operator_nums": operator_nums, "short_span_nums": short_span_nums}
+
+
+class FormulaGate:
+    """
+    文本层字符数不足min_text_chars的页(扫描件、纯图片页)无法判断，照常做公式检测
+    数学字体字符和数学符号字符合计达到min_math_chars、运算符密度达到min_operator_density，
+    或非正文字体的短span数达到min_short_spans时认为有公式
+    """
+
+    def __init__(self, min_text_chars=50, min_math_chars=1, min_operator_density=0.005, min_short_spans=1):
+        self.min_text_chars = min_text_chars
+        self.min_math_chars = min_math_chars
+        self.min_operator_density = min_operator_density
+        self.min_short_spans = min_short_spans
+        self.lock = threading.Lock()
+        self.checked_nums = 0
+        self.skipped_nums = 0
+
+    @classmethod
+    def from_config(cls, gate_config: dict):
+        """
+        未启用时返回None
+        """
+        if not gate_config.get("enable", False):
+            return None
+        return cls(min_text_chars=gate_config.get("min-text-chars", 50),
+                   min_math_chars=gate_config.get("min-math-chars", 1),
+                   min_operator_density=gate_config.get("min-operator-density", 0.005),
+                   min_short_spans=gate_config.get("min-short-spans", 1))
+
+    def need_formula(self, page) -> bool:
+        evidence = scan_math_evidence(page)
+        need = True
+        if evidence["text_nums"] >= self.min_text_chars:
+            math_nums = evidence["math_font_nums"] + evidence["math_unicode_nums"]
+            operator_density = evidence["operator_nums"] / evidence["text_nums"]
+            need = (math_nums >= self.min_math_chars or operator_density >= self.min_operator_density
+                    or evidence["short_span_nums"] >= self.min_short_spans)
+        with self.lock:
+            self.checked_nums += 1
+            if not need:
+                self.skipped_nums += 1
+        return need
+
+    def fingerprint(self) -> dict:
+        return {"min_text_chars": self.min_text_chars, "min_math_chars": self.min_math_chars,
+                "min_operator_density": self.min_operator_density, "min_short_spans": self.min_short_spans}
+
+    def log_stats(self):
+        logger.info(f"formula gate checked pages: {self.checked_nums}, skipped pages: {self.skipped_nums}")
@@ -0,0 +1,203 @@
+"""
+多阶段推理流水线：页面渲染 -> layout检测 -> 公式检测 -> ocr -> 表格识别，各阶段之间用有界队列连接，
+每个阶段由独立的线程(可配置多个worker)消费上游队列，使CPU上的渲染/裁图与GPU推理相互重叠。
+队列有界保证了同时在途的页面数(以及页面图片占用的内存)有上限。
+"""
+import queue
+import threading
+import time
+
+from loguru import logger
+
+_STAGE_DONE = object()
+_ABORTED = object()
+
+
+class PipelineStage:
+    """
+    func(payload)原地处理一页的上下文；workers为该阶段的线程数，queue_size为该阶段输入队列的深度
+    多个worker会并发调用func，只有func用到的模型可重入时才适合把workers调大
+    """
+
+    def __init__(self, name, func, workers=1, queue_size=2):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.queue_size = max(1, int(queue_size))
+        self.queue = queue.Queue(maxsize=self.queue_size)
+        self.lock = threading.Lock()
+        self.alive_workers = self.workers
+        self.item_nums = 0
+        self.busy_time = 0.0
+        self.input_wait_time = 0.0
+        self.output_wait_time = 0.0
+        self.max_queue_depth = 0
+
+    def stats(self) -> dict:
+        return {
+            "stage": self.name,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "item_nums": self.item_nums,
+            "busy_time": round(self.busy_time, 2),
+            "input_wait_time": round(self.input_wait_time, 2),
+            "output_wait_time": round(self.output_wait_time, 2),
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class InferencePipeline:
+    """
+    source: 可迭代对象，在单独的线程中依次产出每一页的上下文(渲染阶段)
+    stages: PipelineStage列表，按顺序串联
+    sink: 最后一个阶段处理完一页后调用sink(payload)，返回值作为该页的结果；可在这里释放页面图片
+    run()按source的产出顺序返回所有页面的结果，任一阶段抛出的异常会终止整条流水线并在run()中重新抛出
+    """
+
+    def __init__(self, source, stages: list, sink=None, source_name="rasterize"):
+        assert len(stages) > 0, "pipeline must contain at least one stage"
+        self.source = source
+        self.stages = stages
+        self.sink = sink
+        self.source_name = source_name
+        self.abort_event = threading.Event()
+        self.error = None
+        self.results = {}
+        self.results_lock = threading.Lock()
+        self.source_item_nums = 0
+        self.source_busy_time = 0.0
+        self.source_output_wait_time = 0.0
+
+    def __fail(self, e):
+        with self.results_lock:
+            if self.error is None:
+                self.error = e
+        self.abort_event.set()
+
+    def __get(self, stage):
+        while not self.abort_event.is_set():
+            try:
+                return stage.queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _ABORTED
+
+    def __put(self, stage, item):
+        # 下游出错退出后不再阻塞在已满的队列上
+        while not self.abort_event.is_set():
+            try:
+                stage.queue.put(item, timeout=0.1)
+                if item is not _STAGE_DONE:
+                    stage.max_queue_depth = max(stage.max_queue_depth, stage.queue.qsize())
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def __close(self, stage):
+        for _ in range(stage.workers):
+            if not self.__put(stage, _STAGE_DONE):
+                return
+
+    def __source_worker(self):
+        first_stage = self.stages[0]
+        iterator = iter(self.source)
+        try:
+            index = 0
+            while True:
+                start = time.time()
+                try:
+                    payload = next(iterator)
+                except StopIteration:
+                    break
+                self.source_busy_time += time.time() - start
+                start = time.time()
+                if not self.__put(first_stage, (index, payload)):
+                    return
+                self.source_output_wait_time += time.time() - start
+                self.source_item_nums += 1
+                index += 1
+                del payload
+        except Exception as e:
+            self.__fail(e)
+            return
+        finally:
+            # 提前退出时也要关闭生成器，释放其中打开的pdf文档
+            if hasattr(iterator, "close"):
+                iterator.close()
+        self.__close(first_stage)
+
+    def __stage_worker(self, stage_idx):
+        stage = self.stages[stage_idx]
+        next_stage = self.stages[stage_idx + 1] if stage_idx + 1 < len(self.stages) else None
+        try:
+            while True:
+                start = time.time()
+                item = self.__get(stage)
+                with stage.lock:
+                    stage.input_wait_time += time.time() - start
+                if item is _STAGE_DONE or item is _ABORTED:
+                    break
+                index, payload = item
+                start = time.time()
+                stage.func(payload)
+                with stage.lock:
+                    stage.busy_time += time.time() - start
+                    stage.item_nums += 1
+                if next_stage is not None:
+                    start = time.time()
+                    if not self.__put(next_stage, (index, payload)):
+                        break
+                    with stage.lock:
+                        stage.output_wait_time += time.time() - start
+                else:
+                    result = self.sink(payload) if self.sink is not None else payload
+                    with self.results_lock:
+                        self.results[index] = result
+                item = payload = None
+        except Exception as e:
+            self.__fail(e)
+        finally:
+            with stage.lock:
+                stage.alive_workers -= 1
+                last_worker = stage.alive_workers == 0
+            # 本阶段所有worker都退出后，通知下游阶段的每个worker结束
+            if last_worker and next_stage is not None and not self.abort_event.is_set():
+                self.__close(next_stage)
+
+    def run(self) -> list:
+        threads = [threading.Thread(target=self.__source_worker, name=f"pipeline-{self.source_name}", daemon=True)]
+        for stage_idx, stage in enumerate(self.stages):
+            for worker_idx in range(stage.workers):
+                threads.append(threading.Thread(target=self.__stage_worker, args=(stage_idx,),
+                                                name=f"pipeline-{stage.name}-{worker_idx}", daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.log_stats()
+        if self.error is not None:
+            raise self.error
+        return [self.results[index] for index in sorted(self.results.keys())]
+
+    def stats(self) -> list:
+        source_stats = {
+            "stage": self.source_name,
+            "workers": 1,
+            "queue_size": self.stages[0].queue_size,
+            "item_nums": self.source_item_nums,
+            "busy_time": round(self.source_busy_time, 2),
+            "input_wait_time": 0.0,
+            "output_wait_time": round(self.source_output_wait_time, 2),
+            "max_queue_depth": 0,
+        }
+        return [source_stats] + [stage.stats() for stage in self.stages]
+
+    def log_stats(self):
+        for stage_stats in self.stats():
+            logger.info(f"pipeline stage: {stage_stats['stage']}, workers: {stage_stats['workers']}, "
+                        f"queue size: {stage_stats['queue_size']}, items: {stage_stats['item_nums']}, "
+                        f"busy: {stage_stats['busy_time']}, wait input: {stage_stats['input_wait_time']}, "
+                        f"wait output: {stage_stats['output_wait_time']}, "
+                        f"max queue depth: {stage_stats['max_queue_depth']}")
@@ -1,6 +1,8 @@
 import json
 import math
 
+import numpy as np
+
 from magic_pdf.libs.commons import fitz
 from loguru import logger
 
@@ -12,15 +14,19 @@ from magic_pdf.rw.DiskReaderWriter import DiskReaderWriter
 from magic_pdf.libs.local_math import float_gt
 from magic_pdf.libs.boxbase import (
     _is_in,
-    bbox_relative_pos,
     bbox_distance,
     _is_part_overlap,
     calculate_overlap_area_in_bbox1_area_ratio,
-    calculate_iou,
+    calculate_iou_matrix,
+    is_in_matrix,
+    bbox_relative_pos_matrix,
+    bbox_distance_matrix,
 )
 from magic_pdf.libs.ModelBlockTypeEnum import ModelBlockTypeEnum
 
 CAPATION_OVERLAP_AREA_RATIO = 0.6
+# layout模型输出的版面类别(标题、正文、图片、表格等)，只在这些类别之间做高iou去重
+LAYOUT_CATEGORY_IDS = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]
 
 
 class MagicModel:
@@ -29,106 +35,102 @@ class MagicModel:
 
     """
 
-    def __fix_axis(self):
-        for model_page_info in self.__model_list:
-            need_remove_list = []
-            page_no = model_page_info["page_info"]["page_no"]
-            horizontal_scale_ratio, vertical_scale_ratio = get_scale_ratio(
-                model_page_info, self.__docs[page_no]
-            )
-            layout_dets = model_page_info["layout_dets"]
-            for layout_det in layout_dets:
-
-                if layout_det.get("bbox") is not None:
-                    # 兼容直接输出bbox的模型数据,如paddle
-                    x0, y0, x1, y1 = layout_det["bbox"]
-                else:
-                    # 兼容直接输出poly的模型数据，如xxx
-                    x0, y0, _, _, x1, y1, _, _ = layout_det["poly"]
-
-                bbox = [
-                    int(x0 / horizontal_scale_ratio),
-                    int(y0 / vertical_scale_ratio),
-                    int(x1 / horizontal_scale_ratio),
-                    int(y1 / vertical_scale_ratio),
-                ]
-                layout_det["bbox"] = bbox
-                # 删除高度或者宽度小于等于0的spans
-                if bbox[2] - bbox[0] <= 0 or bbox[3] - bbox[1] <= 0:
-                    need_remove_list.append(layout_det)
-            for need_remove in need_remove_list:
-                layout_dets.remove(need_remove)
-
-    def __fix_by_remove_low_confidence(self):
-        for model_page_info in self.__model_list:
-            need_remove_list = []
-            layout_dets = model_page_info["layout_dets"]
-            for layout_det in layout_dets:
-                if layout_det["score"] <= 0.05:
-                    need_remove_list.append(layout_det)
-                else:
-                    continue
-            for need_remove in need_remove_list:
-                layout_dets.remove(need_remove)
-
-    def __fix_by_remove_high_iou_and_low_confidence(self):
-        for model_page_info in self.__model_list:
-            need_remove_list = []
-            layout_dets = model_page_info["layout_dets"]
-            for layout_det1 in layout_dets:
-                for layout_det2 in layout_dets:
-                    if layout_det1 == layout_det2:
-                        continue
-                    if layout_det1["category_id"] in [
-                        0,
-                        1,
-                        2,
-                        3,
-                        4,
-                        5,
-                        6,
-                        7,
-                        8,
-                        9,
-                    ] and layout_det2["category_id"] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                        if (
-                            calculate_iou(layout_det1["bbox"], layout_det2["bbox"])
-                            > 0.9
-                        ):
-                            if layout_det1["score"] < layout_det2["score"]:
-                                layout_det_need_remove = layout_det1
-                            else:
-                                layout_det_need_remove = layout_det2
-
-                            if layout_det_need_remove not in need_remove_list:
-                                need_remove_list.append(layout_det_need_remove)
-                        else:
-                            continue
-                    else:
-                        continue
-            for need_remove in need_remove_list:
-                layout_dets.remove(need_remove)
+    def __fix_axis(self, model_page_info):
+        page_no = model_page_info["page_info"]["page_no"]
+        horizontal_scale_ratio, vertical_scale_ratio = get_scale_ratio(
+            model_page_info, self.__docs[page_no]
+        )
+        layout_dets = model_page_info["layout_dets"]
+        if len(layout_dets) == 0:
+            return
+        coords = np.array(
+            [
+                # 兼容直接输出bbox的模型数据,如paddle；兼容直接输出poly的模型数据，如xxx
+                layout_det["bbox"] if layout_det.get("bbox") is not None
+                else [layout_det["poly"][0], layout_det["poly"][1], layout_det["poly"][4], layout_det["poly"][5]]
+                for layout_det in layout_dets
+            ],
+            dtype=np.float64,
+        )
+        scale_ratios = np.array(
+            [horizontal_scale_ratio, vertical_scale_ratio, horizontal_scale_ratio, vertical_scale_ratio]
+        )
+        # 与int()一样向0取整
+        bboxes = np.trunc(coords / scale_ratios).astype(np.int64)
+        for layout_det, bbox in zip(layout_dets, bboxes.tolist()):
+            layout_det["bbox"] = bbox
+        # 删除高度或者宽度小于等于0的spans
+        keep = (bboxes[:, 2] > bboxes[:, 0]) & (bboxes[:, 3] > bboxes[:, 1])
+        layout_dets[:] = [layout_det for layout_det, k in zip(layout_dets, keep) if k]
+
+    def __fix_by_remove_low_confidence(self, model_page_info):
+        layout_dets = model_page_info["layout_dets"]
+        layout_dets[:] = [layout_det for layout_det in layout_dets if layout_det["score"] > 0.05]
 
-    def __init__(self, model_list: list, docs: fitz.Document):
+    def __fix_by_remove_high_iou_and_low_confidence(self, model_page_info):
+        layout_dets = model_page_info["layout_dets"]
+        candidates = [
+            layout_det for layout_det in layout_dets
+            if layout_det["category_id"] in LAYOUT_CATEGORY_IDS
+        ]
+        if len(candidates) < 2:
+            return
+        iou = calculate_iou_matrix([layout_det["bbox"] for layout_det in candidates])
+        np.fill_diagonal(iou, 0)
+        need_remove_list = []
+        # 两两比较iou>0.9的一对中删除置信度较低的那个，置信度相同时两个都删除；内容完全相同的两条不互相比较
+        for i, j in np.argwhere(iou > 0.9).tolist():
+            layout_det1, layout_det2 = candidates[i], candidates[j]
+            if layout_det1 == layout_det2:
+                continue
+            if layout_det1["score"] < layout_det2["score"]:
+                layout_det_need_remove = layout_det1
+            else:
+                layout_det_need_remove = layout_det2
+            if layout_det_need_remove not in need_remove_list:
+                need_remove_list.append(layout_det_need_remove)
+        for need_remove in need_remove_list:
+            layout_dets.remove(need_remove)
+
+    def __init__(self, model_list: list, docs: fitz.Document, lazy: bool = False):
+        """
+        lazy为True时只在第一次取某页的数据时才对该页做坐标修正和去重，没有被取过的页保持原样
+        """
         self.__model_list = model_list
         self.__docs = docs
-        """为所有模型数据添加bbox信息(缩放，poly->bbox)"""
-        self.__fix_axis()
-        """删除置信度特别低的模型数据(<0.05),提高质量"""
-        self.__fix_by_remove_low_confidence()
-        """删除高iou(>0.9)数据中置信度较低的那个"""
-        self.__fix_by_remove_high_iou_and_low_confidence()
+        # page_no -> {category_id: [layout_det, ...]}，同一类别内保持原有顺序
+        self.__page_index = {}
+        if not lazy:
+            for page_no in range(len(model_list)):
+                self.__get_page_index(page_no)
+
+    def __get_page_index(self, page_no: int) -> dict:
+        page_index = self.__page_index.get(page_no)
+        if page_index is None:
+            model_page_info = self.__model_list[page_no]
+            """为模型数据添加bbox信息(缩放，poly->bbox)"""
+            self.__fix_axis(model_page_info)
+            """删除置信度特别低的模型数据(<0.05),提高质量"""
+            self.__fix_by_remove_low_confidence(model_page_info)
+            """删除高iou(>0.9)数据中置信度较低的那个"""
+            self.__fix_by_remove_high_iou_and_low_confidence(model_page_info)
+            page_index = {}
+            for layout_det in model_page_info["layout_dets"]:
+                page_index.setdefault(layout_det.get("category_id", -1), []).append(layout_det)
+            self.__page_index[page_no] = page_index
+        return page_index
+
+    def __get_layout_dets_by_category(self, page_no: int, category_id) -> list:
+        return self.__get_page_index(page_no).get(category_id, [])
 
     def __reduct_overlap(self, bboxes):
         N = len(bboxes)
-        keep = [True] * N
-        for i in range(N):
-            for j in range(N):
-                if i == j:
-                    continue
-                if _is_in(bboxes[i]["bbox"], bboxes[j]["bbox"]):
-                    keep[i] = False
-
+        if N < 2:
+            return list(bboxes)
+        # is_in[i][j]: 第i个框完全在第j个框里面，被其它框包含的框都去掉
+        is_in = is_in_matrix([bbox["bbox"] for bbox in bboxes], [bbox["bbox"] for bbox in bboxes])
+        np.fill_diagonal(is_in, False)
+        keep = ~is_in.any(axis=1)
         return [bboxes[i] for i in range(N) if keep[i]]
 
     def __tie_up_category_by_distance(
@@ -143,44 +145,25 @@ class MagicModel:
         # subject 和 object 的 bbox 会合并成一个大的 bbox （named: merged bbox）。 筛选出所有和 merged bbox 有 overlap 且 overlap 面积大于 object 的面积的 subjects。
         # 再求出筛选出的 subjects 和 object 的最短距离！
         def may_find_other_nearest_bbox(subject_idx, object_idx):
-            ret = float("inf")
-
-            x0 = min(
-                all_bboxes[subject_idx]["bbox"][0], all_bboxes[object_idx]["bbox"][0]
-            )
-            y0 = min(
-                all_bboxes[subject_idx]["bbox"][1], all_bboxes[object_idx]["bbox"][1]
-            )
-            x1 = max(
-                all_bboxes[subject_idx]["bbox"][2], all_bboxes[object_idx]["bbox"][2]
-            )
-            y1 = max(
-                all_bboxes[subject_idx]["bbox"][3], all_bboxes[object_idx]["bbox"][3]
-            )
-
-            object_area = abs(
-                all_bboxes[object_idx]["bbox"][2] - all_bboxes[object_idx]["bbox"][0]
-            ) * abs(
-                all_bboxes[object_idx]["bbox"][3] - all_bboxes[object_idx]["bbox"][1]
-            )
-
-            for i in range(len(all_bboxes)):
-                if (
-                    i == subject_idx
-                    or all_bboxes[i]["category_id"] != subject_category_id
-                ):
-                    continue
-                if _is_part_overlap([x0, y0, x1, y1], all_bboxes[i]["bbox"]) or _is_in(
-                    all_bboxes[i]["bbox"], [x0, y0, x1, y1]
-                ):
-
-                    i_area = abs(
-                        all_bboxes[i]["bbox"][2] - all_bboxes[i]["bbox"][0]
-                    ) * abs(all_bboxes[i]["bbox"][3] - all_bboxes[i]["bbox"][1])
-                    if i_area >= object_area:
-                        ret = min(float("inf"), dis[i][object_idx])
-
-            return ret
+            x0, y0 = np.minimum(boxes[subject_idx, :2], boxes[object_idx, :2])
+            x1, y1 = np.maximum(boxes[subject_idx, 2:], boxes[object_idx, 2:])
+            subject_boxes = boxes[:subject_nums]
+
+            # _is_part_overlap([x0, y0, x1, y1], bbox) or _is_in(bbox, [x0, y0, x1, y1])
+            overlap = ~((x1 < subject_boxes[:, 0]) | (x0 > subject_boxes[:, 2])
+                        | (y1 < subject_boxes[:, 1]) | (y0 > subject_boxes[:, 3]))
+            merged_in = ((x0 >= subject_boxes[:, 0]) & (y0 >= subject_boxes[:, 1])
+                         & (x1 <= subject_boxes[:, 2]) & (y1 <= subject_boxes[:, 3]))
+            subject_in = ((subject_boxes[:, 0] >= x0) & (subject_boxes[:, 1] >= y0)
+                          & (subject_boxes[:, 2] <= x1) & (subject_boxes[:, 3] <= y1))
+            mask = ((overlap & ~merged_in) | subject_in) & (areas[:subject_nums] >= areas[object_idx])
+            mask[subject_idx] = False
+
+            # 取满足条件的最后一个 subject 的距离
+            idxes = np.flatnonzero(mask)
+            if len(idxes) == 0:
+                return float("inf")
+            return dis[idxes[-1]][object_idx]
 
         def expand_bbbox(idxes):
             x0s = [all_bboxes[idx]["bbox"][0] for idx in idxes] 
@@ -193,10 +176,7 @@ class MagicModel:
             list(
                 map(
                     lambda x: {"bbox": x["bbox"], "score": x["score"]},
-                    filter(
-                        lambda x: x["category_id"] == subject_category_id,
-                        self.__model_list[page_no]["layout_dets"],
-                    ),
+                    self.__get_layout_dets_by_category(page_no, subject_category_id),
                 )
             )
         )
@@ -205,13 +185,12 @@ class MagicModel:
             list(
                 map(
                     lambda x: {"bbox": x["bbox"], "score": x["score"]},
-                    filter(
-                        lambda x: x["category_id"] == object_category_id,
-                        self.__model_list[page_no]["layout_dets"],
-                    ),
+                    self.__get_layout_dets_by_category(page_no, object_category_id),
                 )
             )
         )
+        if len(subjects) == 0:
+            return ret, 0
         subject_object_relation_map = {}
 
         subjects.sort(
@@ -238,110 +217,72 @@ class MagicModel:
                 }
             )
 
+        # all_bboxes 中前 subject_nums 个是 subject，其余是 object
         N = len(all_bboxes)
-        dis = [[MAX_DIS_OF_POINT] * N for _ in range(N)]
-
-        for i in range(N):
-            for j in range(i):
-                if (
-                    all_bboxes[i]["category_id"] == subject_category_id
-                    and all_bboxes[j]["category_id"] == subject_category_id
-                ):
-                    continue
-
-                dis[i][j] = bbox_distance(all_bboxes[i]["bbox"], all_bboxes[j]["bbox"])
-                dis[j][i] = dis[i][j]
+        subject_nums = len(subjects)
+        is_object = np.arange(N) >= subject_nums
+        boxes = np.array([v["bbox"] for v in all_bboxes], dtype=np.float64).reshape(-1, 4)
+        areas = np.abs(boxes[:, 2] - boxes[:, 0]) * np.abs(boxes[:, 3] - boxes[:, 1])
+
+        # dis 按下三角计算后对称复制，subject 之间以及自身的距离为 MAX_DIS_OF_POINT
+        dis = bbox_distance_matrix(boxes, boxes)
+        dis = np.where(np.tri(N, k=-1, dtype=bool), dis, dis.T)
+        dis[:subject_nums, :subject_nums] = MAX_DIS_OF_POINT
+        np.fill_diagonal(dis, MAX_DIS_OF_POINT)
+
+        # pos_flag_count[i][j]: 第 i 个 bbox 相对第 j 个 bbox 同时处于几个方向上，大于 1 时两者是斜对角关系
+        left, right, bottom, top = bbox_relative_pos_matrix(boxes, boxes)
+        pos_flag_count = left.astype(np.int8) + right + bottom + top
+
+        # linked[i][j]: 第 j 个 bbox 是 object，且和第 i 个 bbox 不是斜对角关系、距离有效
+        linked = is_object & (pos_flag_count <= 1) & (dis != MAX_DIS_OF_POINT)
+        # 由 pos_flag_count 保证 left/right 只在上下没有错开时才成立，左右相邻时距离不超过 subject 的宽，上下相邻时不超过高
+        one_way_dis = np.where(
+            left | right,
+            (boxes[:, 2] - boxes[:, 0])[:, None],
+            (boxes[:, 3] - boxes[:, 1])[:, None],
+        )
+        reachable = linked & (dis <= one_way_dis)
 
         used = set()
-        for i in range(N):
+        used_mask = np.zeros(N, dtype=bool)
+        for i in range(subject_nums):
             # 求第 i 个 subject 所关联的 object
-            if all_bboxes[i]["category_id"] != subject_category_id:
-                continue
             seen = set()
+            seen_mask = np.zeros(N, dtype=bool)
             candidates = []
-            arr = []
-            for j in range(N):
-
-                pos_flag_count = sum(
-                    list(
-                        map(
-                            lambda x: 1 if x else 0,
-                            bbox_relative_pos(
-                                all_bboxes[i]["bbox"], all_bboxes[j]["bbox"]
-                            ),
-                        )
-                    )
-                )
-                if pos_flag_count > 1:
-                    continue
-                if (
-                    all_bboxes[j]["category_id"] != object_category_id
-                    or j in used
-                    or dis[i][j] == MAX_DIS_OF_POINT
-                ):
-                    continue
-                left, right, _, _ = bbox_relative_pos(
-                    all_bboxes[i]["bbox"], all_bboxes[j]["bbox"]
-                )  # 由  pos_flag_count 相关逻辑保证本段逻辑准确性
-                if left or right:
-                    one_way_dis = all_bboxes[i]["bbox"][2] - all_bboxes[i]["bbox"][0]
-                else:
-                    one_way_dis = all_bboxes[i]["bbox"][3] - all_bboxes[i]["bbox"][1]
-                if dis[i][j] > one_way_dis:
-                    continue
-                arr.append((dis[i][j], j))
 
-            arr.sort(key=lambda x: x[0])
+            arr = np.flatnonzero(reachable[i] & ~used_mask)
             if len(arr) > 0:
+                # 距离相同时取下标最小的 object
+                nearest = int(arr[np.argmin(dis[i][arr])])
                 # bug: 离该subject 最近的 object 可能跨越了其它的 subject 。比如 [this subect] [some sbuject] [the nearest objec of subject]
-                if may_find_other_nearest_bbox(i, arr[0][1]) >= arr[0][0]:
+                if may_find_other_nearest_bbox(i, nearest) >= dis[i][nearest]:
 
-                    candidates.append(arr[0][1])
-                    seen.add(arr[0][1])
+                    candidates.append(nearest)
+                    seen.add(nearest)
+                    seen_mask[nearest] = True
 
             # 已经获取初始种子
             for j in set(candidates):
                 tmp = []
-                for k in range(i + 1, N):
-                    pos_flag_count = sum(
-                        list(
-                            map(
-                                lambda x: 1 if x else 0,
-                                bbox_relative_pos(
-                                    all_bboxes[j]["bbox"], all_bboxes[k]["bbox"]
-                                ),
-                            )
-                        )
-                    )
-
-                    if pos_flag_count > 1:
+                ks = linked[j] & (dis[j] <= dis[i][j]) & ~used_mask & ~seen_mask
+                ks[:i + 1] = False
+                for k in np.flatnonzero(ks).tolist():
+                    # k 到其它 bbox 的距离都要比到 j 的距离大，才认为 k 和 j 最近
+                    ls = ~used_mask & ~seen_mask
+                    ls[:i + 1] = False
+                    ls[[j, k]] = False
+                    if not np.all(dis[ls, k] - dis[j][k] > 0.0001):
                         continue
 
-                    if (
-                        all_bboxes[k]["category_id"] != object_category_id
-                        or k in used
-                        or k in seen
-                        or dis[j][k] == MAX_DIS_OF_POINT
-                        or dis[j][k] > dis[i][j]
-                    ):
+                    nx0, ny0, nx1, ny1 = expand_bbbox(list(seen) + [k])
+                    n_dis = bbox_distance(all_bboxes[i]["bbox"], [nx0, ny0, nx1, ny1])
+                    if float_gt(dis[i][j], n_dis):
                         continue
-
-                    is_nearest = True
-                    for l in range(i + 1, N):
-                        if l in (j, k) or l in used or l in seen:
-                            continue
-
-                        if not float_gt(dis[l][k], dis[j][k]):
-                            is_nearest = False
-                            break
-
-                    if is_nearest:
-                        nx0, ny0, nx1, ny1 = expand_bbbox(list(seen) + [k])
-                        n_dis = bbox_distance(all_bboxes[i]["bbox"], [nx0, ny0, nx1, ny1])
-                        if float_gt(dis[i][j], n_dis):
-                            continue
-                        tmp.append(k)
-                        seen.add(k)
+                    tmp.append(k)
+                    seen.add(k)
+                    seen_mask[k] = True
 
                 candidates = tmp
                 if len(candidates) == 0:
@@ -396,6 +337,7 @@ class MagicModel:
                         > CAPATION_OVERLAP_AREA_RATIO
                     ):
                         used.add(j)
+                        used_mask[j] = True
                         subject_object_relation_map[i].append(j)
 
         for i in sorted(subject_object_relation_map.keys()):
@@ -443,21 +385,12 @@ class MagicModel:
                 if len(subject_object_relation_map[i]) > 0
             ]
         )
-        for i in range(N):
-            if all_bboxes[i]["category_id"] != object_category_id or i in used:
-                continue
-            candidates = []
-            for j in range(N):
-                if (
-                    all_bboxes[j]["category_id"] != subject_category_id
-                    or j in with_caption_subject
-                ):
+        free_subjects = [j for j in range(subject_nums) if j not in with_caption_subject]
+        if len(free_subjects) > 0:
+            for i in range(subject_nums, N):
+                if i in used:
                     continue
-                candidates.append((dis[i][j], j))
-            if len(candidates) > 0:
-                candidates.sort(key=lambda x: x[0])
-                total_subject_object_dis += candidates[0][1]
-                with_caption_subject.add(j)
+                total_subject_object_dis += free_subjects[int(np.argmin(dis[i][free_subjects]))]
         return ret, total_subject_object_dis
 
     def get_imgs(self, page_no: int):
@@ -524,15 +457,12 @@ class MagicModel:
 
     def get_ocr_text(self, page_no: int) -> list:  # paddle 搞的，有字也有坐标
         text_spans = []
-        model_page_info = self.__model_list[page_no]
-        layout_dets = model_page_info["layout_dets"]
-        for layout_det in layout_dets:
-            if layout_det["category_id"] == "15":
-                span = {
-                    "bbox": layout_det["bbox"],
-                    "content": layout_det["text"],
-                }
-                text_spans.append(span)
+        for layout_det in self.__get_layout_dets_by_category(page_no, "15"):
+            span = {
+                "bbox": layout_det["bbox"],
+                "content": layout_det["text"],
+            }
+            text_spans.append(span)
         return text_spans
 
     def get_all_spans(self, page_no: int) -> list:
@@ -544,6 +474,7 @@ class MagicModel:
             return new_spans
 
         all_spans = []
+        self.__get_page_index(page_no)
         model_page_info = self.__model_list[page_no]
         layout_dets = model_page_info["layout_dets"]
         allow_category_id_list = [3, 5, 13, 14, 15]
@@ -589,27 +520,18 @@ class MagicModel:
         self, type: int, page_no: int, extra_col: list[str] = []
     ) -> list:
         blocks = []
-        for page_dict in self.__model_list:
-            layout_dets = page_dict.get("layout_dets", [])
-            page_info = page_dict.get("page_info", {})
-            page_number = page_info.get("page_no", -1)
-            if page_no != page_number:
-                continue
-            for item in layout_dets:
-                category_id = item.get("category_id", -1)
-                bbox = item.get("bbox", None)
-
-                if category_id == type:
-                    block = {
-                        "bbox": bbox,
-                        "score": item.get("score"),
-                    }
-                    for col in extra_col:
-                        block[col] = item.get(col, None)
-                    blocks.append(block)
+        for item in self.__get_layout_dets_by_category(page_no, type):
+            block = {
+                "bbox": item.get("bbox", None),
+                "score": item.get("score"),
+            }
+            for col in extra_col:
+                block[col] = item.get(col, None)
+            blocks.append(block)
         return blocks
 
     def get_model_list(self, page_no):
+        self.__get_page_index(page_no)
         return self.__model_list[page_no]
 
 
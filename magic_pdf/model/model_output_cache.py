@@ -0,0 +1,207 @@
+"""
+模型推理结果缓存：以pdf内容的md5、页码和模型配置指纹为key，缓存每一页的layout_dets
+本地磁盘一级缓存按总大小做LRU淘汰，可选的远端二级缓存(AbsReaderWriter，如s3)供多台机器共享
+"""
+import json
+import os
+import threading
+
+from loguru import logger
+
+from magic_pdf.libs.config_reader import get_s3_config, get_model_cache_config
+from magic_pdf.libs.hash_utils import compute_md5
+from magic_pdf.libs.path_utils import parse_s3path
+from magic_pdf.libs.version import __version__
+from magic_pdf.rw.AbsReaderWriter import AbsReaderWriter
+from magic_pdf.rw.DiskReaderWriter import DiskReaderWriter
+
+# 缓存内容的格式变化时递增，使旧缓存自动失效
+CACHE_FORMAT_VERSION = 1
+# 表格/ocr配置中影响推理结果的项，workers、rec_max_pending等并发参数不影响结果，不计入指纹
+TABLE_RESULT_KEYS = ("is_table_recog_enable", "max_time")
+OCR_RESULT_KEYS = ("mode", "det_limit_side_len", "rec_batch_num")
+
+
+def select_result_keys(config, keys):
+    if config is None:
+        return None
+    return {key: config.get(key) for key in keys}
+
+
+def model_fingerprint(custom_model, ocr: bool, dpi, formula_gate=None) -> str:
+    """
+    影响推理结果的所有配置：模型类型、ocr开关、渲染dpi(或dpi策略)、模型权重、表格/ocr配置、公式检测前置检查以及magic_pdf版本
+    """
+    configs = getattr(custom_model, "configs", {})
+    fingerprint = {
+        "format": CACHE_FORMAT_VERSION,
+        "version": __version__,
+        "model": type(custom_model).__name__,
+        "ocr": ocr,
+        "dpi": dpi,
+        "weights": configs.get("weights"),
+        "apply_formula": getattr(custom_model, "apply_formula", None),
+        "table_config": select_result_keys(getattr(custom_model, "table_config", None), TABLE_RESULT_KEYS),
+        "ocr_config": select_result_keys(getattr(custom_model, "ocr_config", None), OCR_RESULT_KEYS),
+    }
+    # 未启用前置检查时不写入，保持与之前的缓存兼容
+    if formula_gate is not None:
+        fingerprint["formula_gate"] = formula_gate.fingerprint()
+    return compute_md5(json.dumps(fingerprint, sort_keys=True, default=str).encode("utf-8"))
+
+
+class LocalDiskCache:
+    """
+    本地磁盘缓存，每页一个json文件；读命中时刷新文件mtime，总大小超过max_size时按mtime从旧到新删除
+    """
+
+    def __init__(self, cache_dir: str, max_size: int):
+        self.cache_dir = os.path.expanduser(cache_dir)
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.total_size = sum(size for _, size, _ in self.__entries())
+
+    def __entries(self):
+        for root, _, files in os.walk(self.cache_dir):
+            for file_name in files:
+                path = os.path.join(root, file_name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def read(self, key: str):
+        path = os.path.join(self.cache_dir, key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                content = f.read()
+            os.utime(path)
+            return content
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, content: str):
+        path = os.path.join(self.cache_dir, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再替换，避免并发读到写了一半的文件
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(content)
+        old_size = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+        with self.lock:
+            self.total_size += os.path.getsize(path) - old_size
+            if self.total_size > self.max_size:
+                self.__evict()
+
+    def __evict(self):
+        # 淘汰到上限的90%，避免每次写入都触发一次全目录扫描
+        target_size = self.max_size * 0.9
+        entries = sorted(self.__entries(), key=lambda entry: entry[2])
+        self.total_size = sum(size for _, size, _ in entries)
+        evict_nums = 0
+        for path, size, _ in entries:
+            if self.total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_size -= size
+            evict_nums += 1
+        logger.info(f"model output cache evicted {evict_nums} pages, size: {self.total_size}")
+
+
+class ModelOutputCache:
+    """
+    local: LocalDiskCache，remote: AbsReaderWriter(可选)，remote命中的结果会回填到local
+    """
+
+    def __init__(self, local: LocalDiskCache = None, remote: AbsReaderWriter = None):
+        self.local = local
+        self.remote = remote
+        self.hit_nums = 0
+        self.miss_nums = 0
+
+    @staticmethod
+    def page_key(pdf_md5: str, fingerprint: str, page_no: int) -> str:
+        return f"{fingerprint}/{pdf_md5}/{page_no}.json"
+
+    def get(self, pdf_md5: str, fingerprint: str, page_no: int):
+        key = self.page_key(pdf_md5, fingerprint, page_no)
+        content = self.local.read(key) if self.local is not None else None
+        if content is None and self.remote is not None:
+            content = self.__read_remote(key)
+            if content is not None and self.local is not None:
+                self.local.write(key, content)
+        if content is None:
+            self.miss_nums += 1
+            return None
+        self.hit_nums += 1
+        return json.loads(content)
+
+    def __read_remote(self, key: str):
+        # DiskReaderWriter读不存在的文件会先打error日志，未命中是常态，先判断文件是否存在
+        if isinstance(self.remote, DiskReaderWriter) and not os.path.exists(os.path.join(self.remote.path, key)):
+            return None
+        try:
+            return self.remote.read(key, AbsReaderWriter.MODE_TXT)
+        except Exception:
+            return None
+
+    def put(self, pdf_md5: str, fingerprint: str, page_no: int, page_dict: dict):
+        key = self.page_key(pdf_md5, fingerprint, page_no)
+        # 模型输出中可能混有numpy标量
+        content = json.dumps(page_dict, ensure_ascii=False,
+                             default=lambda o: o.item() if hasattr(o, "item") else str(o))
+        if self.local is not None:
+            self.local.write(key, content)
+        if self.remote is not None:
+            try:
+                self.remote.write(content, key, AbsReaderWriter.MODE_TXT)
+            except Exception as e:
+                logger.warning(f"write model output cache to remote failed: {e}")
+
+
+def build_remote_rw(remote_dir: str) -> AbsReaderWriter:
+    if remote_dir.startswith("s3://"):
+        from magic_pdf.rw.S3ReaderWriter import S3ReaderWriter
+        bucket, _ = parse_s3path(remote_dir)
+        ak, sk, endpoint = get_s3_config(bucket)
+        return S3ReaderWriter(ak, sk, endpoint, "auto", remote_dir)
+    else:
+        return DiskReaderWriter(remote_dir)
+
+
+def init_model_output_cache(cache_config: dict):
+    """
+    根据magic-pdf.json中的model-cache配置构造缓存，未启用时返回None
+    """
+    if not cache_config.get("enable", False):
+        return None
+    local = None
+    if cache_config.get("local-dir"):
+        local = LocalDiskCache(cache_config["local-dir"], int(cache_config.get("max-size-mb", 2048)) * 1024 * 1024)
+    remote = None
+    if cache_config.get("remote-dir"):
+        remote = build_remote_rw(cache_config["remote-dir"])
+    if local is None and remote is None:
+        logger.warning("model cache is enabled but neither local-dir nor remote-dir is configured")
+        return None
+    return ModelOutputCache(local, remote)
+
+
+_output_cache = None
+_output_cache_inited = False
+_output_cache_lock = threading.Lock()
+
+
+def get_model_output_cache():
+    global _output_cache, _output_cache_inited
+    with _output_cache_lock:
+        if not _output_cache_inited:
+            _output_cache = init_model_output_cache(get_model_cache_config())
+            _output_cache_inited = True
+    return _output_cache
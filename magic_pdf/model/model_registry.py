@@ -0,0 +1,114 @@
+"""
+模型组件注册表：layout、公式检测、公式识别、ocr、表格识别等模型按(组件名, 加载参数)各自懒加载，
+不同配置(ocr与非ocr等)的模型实例共用同一份权重；设置内存预算后按最近使用顺序淘汰不常用的组件
+"""
+import gc
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+
+def dir_size(path) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for file_name in files:
+            total += os.path.getsize(os.path.join(root, file_name))
+    return total
+
+
+def estimate_component_size(component, depth=0) -> int:
+    """
+    估算组件占用的内存：torch模型按参数和buffer统计，paddle推理模型按模型目录的文件大小统计，其余记为0
+    """
+    if isinstance(component, (list, tuple)):
+        return sum(estimate_component_size(item, depth) for item in component)
+    if callable(getattr(component, "parameters", None)) and callable(getattr(component, "buffers", None)):
+        try:
+            return sum(t.numel() * t.element_size() for t in itertools.chain(component.parameters(), component.buffers()))
+        except Exception:
+            return 0
+    args = getattr(component, "args", None)
+    if args is not None and hasattr(args, "det_model_dir"):
+        model_dirs = [getattr(args, attr, None) for attr in ["det_model_dir", "rec_model_dir", "cls_model_dir"]]
+        return sum(dir_size(model_dir) for model_dir in model_dirs if model_dir and os.path.isdir(model_dir))
+    if depth < 3:
+        for attr in ["model", "predictor"]:
+            if hasattr(component, attr):
+                return estimate_component_size(getattr(component, attr), depth + 1)
+    return 0
+
+
+class ModelRegistry:
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if cls._instance is None:
+            cls._instance = super().__new__(cls)
+            cls._instance.components = OrderedDict()
+            cls._instance.lock = threading.RLock()
+            # 单位字节，<=0表示不限制
+            cls._instance.memory_budget = 0
+        return cls._instance
+
+    def get(self, name: str, key: tuple, loader):
+        """
+        返回(name, key)对应的组件，不存在时调用loader()加载；key应包含所有影响加载结果的参数(权重路径、device等)
+        """
+        with self.lock:
+            component_key = (name, key)
+            entry = self.components.get(component_key)
+            if entry is None:
+                load_start = time.time()
+                component = loader()
+                size = estimate_component_size(component)
+                entry = {"name": name, "component": component, "size": size}
+                self.components[component_key] = entry
+                logger.info(f"model component {name} loaded, size: {round(size / 1024 / 1024, 2)}MB, "
+                            f"cost: {round(time.time() - load_start, 2)}")
+                self.__evict(keep=component_key)
+            self.components.move_to_end(component_key)
+            return entry["component"]
+
+    def set_memory_budget(self, memory_budget: int):
+        with self.lock:
+            self.memory_budget = memory_budget
+            self.__evict()
+
+    def total_size(self) -> int:
+        return sum(entry["size"] for entry in self.components.values())
+
+    def loaded(self) -> list:
+        return [(entry["name"], entry["size"]) for entry in self.components.values()]
+
+    def unload(self, name: str = None):
+        """
+        卸载名为name的所有组件，name为None时卸载全部；正在使用中的组件在使用结束后才会真正释放
+        """
+        with self.lock:
+            for component_key in [k for k in self.components.keys() if name is None or k[0] == name]:
+                self.__release(component_key)
+
+    def __evict(self, keep=None):
+        if self.memory_budget <= 0:
+            return
+        # 从最久未使用的组件开始淘汰，刚加载的组件保留
+        for component_key in list(self.components.keys()):
+            if self.total_size() <= self.memory_budget:
+                break
+            if component_key == keep:
+                continue
+            logger.info(f"model component {component_key[0]} evicted, memory budget: "
+                        f"{round(self.memory_budget / 1024 / 1024, 2)}MB")
+            self.__release(component_key)
+
+    def __release(self, component_key):
+        del self.components[component_key]
+        gc.collect()
+        torch = sys.modules.get("torch")
+        if torch is not None and torch.cuda.is_available():
+            torch.cuda.empty_cache()
@@ -1,5 +1,7 @@
 from loguru import logger
 import os
+import queue
+import threading
 import time
 
 from magic_pdf.libs.Constants import TABLE_MAX_TIME_VALUE
@@ -17,7 +19,6 @@ try:
         torchtext.disable_torchtext_deprecation_warning()
     from PIL import Image
     from torchvision import transforms
-    from torch.utils.data import Dataset, DataLoader
     from ultralytics import YOLO
     from unimernet.common.config import Config
     import unimernet.tasks as tasks
@@ -30,9 +31,12 @@ except ImportError as e:
         '"pip install magic-pdf[full] --extra-index-url https://myhloli.github.io/wheels/"')
     exit(1)
 
+from magic_pdf.libs.hash_utils import compute_md5
+from magic_pdf.model.model_registry import ModelRegistry
+from magic_pdf.model.recognition_cache import RecognitionCache, get_recognition_cache, image_fingerprint
 from magic_pdf.model.pek_sub_modules.layoutlmv3.model_init import Layoutlmv3_Predictor
-from magic_pdf.model.pek_sub_modules.post_process import get_croped_image, latex_rm_whitespace
-from magic_pdf.model.pek_sub_modules.self_modify import ModifiedPaddleOCR
+from magic_pdf.model.pek_sub_modules.post_process import latex_rm_whitespace
+from magic_pdf.model.pek_sub_modules.self_modify import ModifiedPaddleOCR, OcrRecQueue
 from magic_pdf.model.pek_sub_modules.structeqtable.StructTableModel import StructTableModel
 
 
@@ -64,23 +68,296 @@ def layout_model_init(weight, config_file, device):
     return model
 
 
-class MathDataset(Dataset):
-    def __init__(self, image_paths, transform=None):
-        self.image_paths = image_paths
-        self.transform = transform
-
-    def __len__(self):
-        return len(self.image_paths)
-
-    def __getitem__(self, idx):
-        # if not pil image, then convert to pil image
-        if isinstance(self.image_paths[idx], str):
-            raw_image = Image.open(self.image_paths[idx])
-        else:
-            raw_image = self.image_paths[idx]
-        if self.transform:
-            image = self.transform(raw_image)
-            return image
+def select_regions(layout_res):
+    """
+    Select regions for OCR / table regions / formula regions
+    """
+    ocr_res_list = []
+    table_res_list = []
+    single_page_mfdetrec_res = []
+    for res in layout_res:
+        if int(res['category_id']) in [13, 14]:
+            single_page_mfdetrec_res.append({
+                "bbox": [int(res['poly'][0]), int(res['poly'][1]),
+                         int(res['poly'][4]), int(res['poly'][5])],
+            })
+        elif int(res['category_id']) in [0, 1, 2, 4, 6, 7]:
+            ocr_res_list.append(res)
+        elif int(res['category_id']) in [5]:
+            table_res_list.append(res)
+    return ocr_res_list, table_res_list, single_page_mfdetrec_res
+
+
+def crop_array(image, bbox):
+    """
+    在页面数组上按bbox裁剪，返回视图不复制像素；bbox超出页面的部分被截掉
+    """
+    height, width = image.shape[:2]
+    x_min, y_min, x_max, y_max = bbox
+    return image[max(int(y_min), 0):min(int(y_max), height), max(int(x_min), 0):min(int(x_max), width)]
+
+
+#  Unified crop img logic
+def crop_img(input_res, input_img, crop_paste_x=0, crop_paste_y=0, bgr=False):
+    """
+    input_img为页面RGB数组，截图贴在四周留白crop_paste_x/crop_paste_y的白色背景上，只分配一次截图大小的内存
+    bgr=True时在复制的同时转换为BGR通道顺序，供ocr直接使用
+    """
+    crop_xmin, crop_ymin = int(input_res['poly'][0]), int(input_res['poly'][1])
+    crop_xmax, crop_ymax = int(input_res['poly'][4]), int(input_res['poly'][5])
+    # Create a white background with an additional width and height of 50
+    crop_new_width = crop_xmax - crop_xmin + crop_paste_x * 2
+    crop_new_height = crop_ymax - crop_ymin + crop_paste_y * 2
+    return_image = np.full((crop_new_height, crop_new_width, 3), 255, dtype=np.uint8)
+
+    # Crop image
+    cropped_img = crop_array(input_img, [crop_xmin, crop_ymin, crop_xmax, crop_ymax])
+    if bgr:
+        cropped_img = cropped_img[:, :, ::-1]
+    paste_x = crop_paste_x + max(-crop_xmin, 0)
+    paste_y = crop_paste_y + max(-crop_ymin, 0)
+    return_image[paste_y:paste_y + cropped_img.shape[0], paste_x:paste_x + cropped_img.shape[1]] = cropped_img
+    return_list = [crop_paste_x, crop_paste_y, crop_xmin, crop_ymin, crop_xmax, crop_ymax, crop_new_width, crop_new_height]
+    return return_image, return_list
+
+
+class MFRScheduler:
+    """
+    公式识别调度器：跨页(以及跨文档)累积公式截图，按宽高比分桶，桶满一个batch才做一次识别，
+    识别结果回填到对应的layout_dets条目中；flush时把各桶剩余的截图按宽高比排序后拼成完整batch
+    add/flush可以在多个线程中调用(流水线模式下formula stage与最后的flush不在同一线程)
+    result_cache不为None时先查识别结果缓存，同一张截图在队列中只识别一次
+    """
+    ASPECT_RATIO_BOUNDS = [1, 2, 4, 8, 16]
+
+    def __init__(self, get_mfr_model, device, batch_size=64, result_cache: RecognitionCache = None,
+                 cache_namespace="mfr"):
+        # get_mfr_model() -> (mfr_model, transform)，每个batch都重新获取，模型被注册表淘汰后可以重新加载
+        self.get_mfr_model = get_mfr_model
+        self.device = device
+        self.batch_size = batch_size
+        self.result_cache = result_cache
+        self.cache_namespace = cache_namespace
+        self.lock = threading.Lock()
+        self.buckets = {}
+        # 正在排队的截图 -> 与它相同、等着回填同一结果的其他layout_dets条目
+        self.duplicates = {}
+        self.formula_nums = 0
+        self.batch_nums = 0
+        self.mfr_cost = 0
+
+    def __bucket_key(self, image):
+        width, height = image.size
+        aspect_ratio = width / max(height, 1)
+        for idx, bound in enumerate(self.ASPECT_RATIO_BOUNDS):
+            if aspect_ratio < bound:
+                return idx
+        return len(self.ASPECT_RATIO_BOUNDS)
+
+    def add(self, image, layout_det):
+        """
+        image: 公式截图(PIL.Image)；layout_det: 需要回填latex的layout_dets条目
+        """
+        fingerprint = image_fingerprint(image) if self.result_cache is not None else None
+        with self.lock:
+            if fingerprint is not None:
+                match_key = self.result_cache.match_key(fingerprint)
+                if match_key in self.duplicates:
+                    self.duplicates[match_key].append(layout_det)
+                    return
+                latex = self.result_cache.get(self.cache_namespace, fingerprint)
+                if latex is not None:
+                    layout_det['latex'] = latex
+                    return
+                self.duplicates[match_key] = []
+            bucket = self.buckets.setdefault(self.__bucket_key(image), [])
+            bucket.append((image, layout_det, fingerprint))
+            if len(bucket) >= self.batch_size:
+                # 先移出队列，识别失败时这些截图不会在下次add时被反复重试
+                batch = bucket[:self.batch_size]
+                del bucket[:self.batch_size]
+                self.__run_batch(batch)
+
+    def pending(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def flush(self):
+        with self.lock:
+            self.__flush()
+
+    def __flush(self):
+        rest = []
+        for key in sorted(self.buckets.keys()):
+            rest.extend(self.buckets[key])
+        self.buckets = {}
+        rest.sort(key=lambda item: item[0].size[0] / max(item[0].size[1], 1))
+        try:
+            for start in range(0, len(rest), self.batch_size):
+                self.__run_batch(rest[start:start + self.batch_size])
+        finally:
+            # 某个batch失败时，后面还没识别的截图也已移出队列
+            self.__drop_duplicates(rest)
+        if self.formula_nums > 0:
+            logger.info(f"formula nums: {self.formula_nums}, mfr batch nums: {self.batch_nums}, "
+                        f"mfr time: {round(self.mfr_cost, 2)}")
+        self.formula_nums, self.batch_nums, self.mfr_cost = 0, 0, 0
+
+    def __drop_duplicates(self, items):
+        """
+        识别失败(如显存不足)时丢弃这些截图登记的重复条目，否则之后相同的截图(包括后续文档中的)
+        都会挂在永远不会回填的条目上；识别成功的条目已经回填并移除
+        """
+        for _, _, fingerprint in items:
+            if fingerprint is not None:
+                self.duplicates.pop(self.result_cache.match_key(fingerprint), None)
+
+    def __run_batch(self, items):
+        mfr_start = time.time()
+        try:
+            mfr_model, transform = self.get_mfr_model()
+            mf_img = torch.stack([transform(image) for image, _, _ in items]).to(self.device)
+            output = mfr_model.generate({'image': mf_img})
+            for (_, layout_det, fingerprint), latex in zip(items, output['pred_str']):
+                latex = latex_rm_whitespace(latex)
+                layout_det['latex'] = latex
+                if fingerprint is not None:
+                    for duplicate in self.duplicates.pop(self.result_cache.match_key(fingerprint), []):
+                        duplicate['latex'] = latex
+                    self.result_cache.put(self.cache_namespace, fingerprint, latex)
+        finally:
+            self.__drop_duplicates(items)
+        self.formula_nums += len(items)
+        self.batch_nums += 1
+        self.mfr_cost += time.time() - mfr_start
+
+
+class TableScheduler:
+    """
+    表格识别worker池：表格截图提交后由后台线程识别，调用方不必等待，可以继续处理后面的页面，
+    flush时等待所有已提交的表格并把latex回填到对应的layout_dets条目中
+    每张表格从开始识别起超过deadline秒仍未完成即被放弃，该表格不写latex，后续只保留截图；
+    被卡住的线程无法中断，只能等它自行结束后退出，同时补充一个新的worker，保证并发数不变
+    result_cache不为None时先查识别结果缓存，同一张截图在队列中只识别一次
+    """
+
+    def __init__(self, get_table_model, workers=1, deadline=TABLE_MAX_TIME_VALUE, max_pending=16,
+                 result_cache: RecognitionCache = None, cache_namespace="table"):
+        self.get_table_model = get_table_model
+        self.result_cache = result_cache
+        self.cache_namespace = cache_namespace
+        self.duplicates = {}
+        self.workers = max(1, int(workers))
+        self.deadline = deadline
+        # 未开始识别的表格数有上限，避免整篇文档的表格截图同时留在内存中
+        self.tasks = queue.Queue(maxsize=max(1, int(max_pending)))
+        self.lock = threading.Lock()
+        self.submitted = []
+        self.worker_threads = []
+        self.table_nums = 0
+        self.timeout_nums = 0
+        self.fail_nums = 0
+
+    def __start_worker(self):
+        worker = threading.Thread(target=self.__worker, name=f"table-rec-{len(self.worker_threads)}", daemon=True)
+        self.worker_threads.append(worker)
+        worker.start()
+
+    def __worker(self):
+        while True:
+            task = self.tasks.get()
+            with self.lock:
+                task["start"] = time.time()
+            try:
+                with torch.no_grad():
+                    task["latex"] = self.get_table_model().image2latex(task["image"])[0]
+            except Exception as e:
+                task["error"] = e
+            task["image"] = None
+            task["done"].set()
+            with self.lock:
+                # 该worker已被替换(识别超时)，退出
+                if task["abandoned"]:
+                    return
+
+    def add(self, image, table_res):
+        """
+        image: 表格截图(PIL.Image)；table_res: 需要回填latex的layout_dets条目
+        """
+        fingerprint = image_fingerprint(image) if self.result_cache is not None else None
+        task = {"image": image, "res": table_res, "start": None, "done": threading.Event(),
+                "latex": None, "error": None, "abandoned": False, "fingerprint": fingerprint}
+        with self.lock:
+            if fingerprint is not None:
+                match_key = self.result_cache.match_key(fingerprint)
+                if match_key in self.duplicates:
+                    self.duplicates[match_key].append(table_res)
+                    return
+                latex_code = self.result_cache.get(self.cache_namespace, fingerprint)
+                if latex_code is not None:
+                    table_res["latex"] = latex_code
+                    return
+                self.duplicates[match_key] = []
+            if len(self.worker_threads) == 0:
+                for _ in range(self.workers):
+                    self.__start_worker()
+            self.submitted.append(task)
+        while True:
+            try:
+                self.tasks.put(task, timeout=0.1)
+                return
+            except queue.Full:
+                # 所有worker都卡住时队列不会再被消费，这里也要检查超时并补充worker
+                with self.lock:
+                    for submitted_task in self.submitted:
+                        self.__abandon_if_expired(submitted_task)
+
+    def __abandon_if_expired(self, task):
+        # 调用方需持有self.lock
+        if task["abandoned"] or task["start"] is None or task["done"].is_set():
+            return
+        if time.time() - task["start"] > self.deadline:
+            task["abandoned"] = True
+            self.__start_worker()
+
+    def __wait(self, task):
+        while not task["done"].wait(timeout=0.1):
+            with self.lock:
+                self.__abandon_if_expired(task)
+                if task["abandoned"]:
+                    return False
+        return True
+
+    def flush(self):
+        with self.lock:
+            submitted, self.submitted = self.submitted, []
+        for task in submitted:
+            self.table_nums += 1
+            duplicates = []
+            if task["fingerprint"] is not None:
+                with self.lock:
+                    duplicates = self.duplicates.pop(self.result_cache.match_key(task["fingerprint"]), [])
+            if not self.__wait(task):
+                self.timeout_nums += 1
+                logger.warning(f"------------table recognition processing exceeds max time {self.deadline}s, "
+                               f"fallback to table image----------")
+                continue
+            latex_code = task["latex"]
+            if task["error"] is not None:
+                logger.error(f"table recognition error: {task['error']}")
+                latex_code = None
+            # 判断是否返回正常
+            if latex_code and (latex_code.strip().endswith('end{tabular}') or latex_code.strip().endswith('end{table}')):
+                for table_res in [task["res"]] + duplicates:
+                    table_res["latex"] = latex_code
+                if task["fingerprint"] is not None:
+                    self.result_cache.put(self.cache_namespace, task["fingerprint"], latex_code)
+            else:
+                self.fail_nums += 1
+                logger.warning(f"------------table recognition processing fails----------")
+        if self.table_nums > 0:
+            logger.info(f"table nums: {self.table_nums}, timeout nums: {self.timeout_nums}, "
+                        f"fail nums: {self.fail_nums}")
+        self.table_nums, self.timeout_nums, self.fail_nums = 0, 0, 0
 
 
 class CustomPEKModel:
@@ -107,10 +384,14 @@ class CustomPEKModel:
         self.table_config = kwargs.get("table_config", self.configs["config"]["table_config"])
         self.apply_table = self.table_config.get("is_table_recog_enable", False)
         self.table_max_time = self.table_config.get("max_time", TABLE_MAX_TIME_VALUE)
+        self.table_workers = self.table_config.get("workers", 1)
         self.apply_ocr = ocr
+        self.ocr_config = kwargs.get("ocr_config", self.configs["config"]["ocr_config"])
+        # region: 每个文本区域单独截图做检测和识别；page: 整页只做一次检测，再按区域分配文本行
+        self.ocr_mode = self.ocr_config.get("mode", "region")
         logger.info(
-            "DocAnalysis init, this may take some times. apply_layout: {}, apply_formula: {}, apply_ocr: {}, apply_table: {}".format(
-                self.apply_layout, self.apply_formula, self.apply_ocr, self.apply_table
+            "DocAnalysis init, this may take some times. apply_layout: {}, apply_formula: {}, apply_ocr: {}, apply_table: {}, ocr_mode: {}".format(
+                self.apply_layout, self.apply_formula, self.apply_ocr, self.apply_table, self.ocr_mode
             )
         )
         assert self.apply_layout, "DocAnalysis must contain layout model."
@@ -120,113 +401,221 @@ class CustomPEKModel:
         models_dir = kwargs.get("models_dir", os.path.join(root_dir, "resources", "models"))
         logger.info("using models_dir: {}".format(models_dir))
 
+        # 各模型组件在第一次使用时才通过注册表加载，相同参数的组件在不同配置的实例间共用
+        self.registry = ModelRegistry()
+        self.component_specs = {}
+        # 公式和表格识别结果缓存，未启用时为None
+        self.recognition_cache = get_recognition_cache()
+        # 初始化layout模型
+        layout_weight = str(os.path.join(models_dir, self.configs['weights']['layout']))
+        layout_config_file = str(os.path.join(model_config_dir, "layoutlmv3", "layoutlmv3_base_inference.yaml"))
+        self.component_specs["layout"] = ((layout_weight, layout_config_file, self.device),
+                                          lambda: Layoutlmv3_Predictor(layout_weight, layout_config_file, device=self.device))
+
         # 初始化公式识别
         if self.apply_formula:
             # 初始化公式检测模型
-            self.mfd_model = mfd_model_init(str(os.path.join(models_dir, self.configs["weights"]["mfd"])))
+            mfd_weight = str(os.path.join(models_dir, self.configs["weights"]["mfd"]))
+            self.component_specs["mfd"] = ((mfd_weight,), lambda: mfd_model_init(mfd_weight))
 
             # 初始化公式解析模型
             mfr_weight_dir = str(os.path.join(models_dir, self.configs["weights"]["mfr"]))
             mfr_cfg_path = str(os.path.join(model_config_dir, "UniMERNet", "demo.yaml"))
-            self.mfr_model, mfr_vis_processors = mfr_model_init(mfr_weight_dir, mfr_cfg_path, _device_=self.device)
-            self.mfr_transform = transforms.Compose([mfr_vis_processors, ])
 
-        # 初始化layout模型
-        self.layout_model = Layoutlmv3_Predictor(
-            str(os.path.join(models_dir, self.configs['weights']['layout'])),
-            str(os.path.join(model_config_dir, "layoutlmv3", "layoutlmv3_base_inference.yaml")),
-            device=self.device
-        )
+            def load_mfr():
+                mfr_model, mfr_vis_processors = mfr_model_init(mfr_weight_dir, mfr_cfg_path, _device_=self.device)
+                return mfr_model, transforms.Compose([mfr_vis_processors, ])
+
+            self.component_specs["mfr"] = ((mfr_weight_dir, mfr_cfg_path, self.device), load_mfr)
+            mfr_namespace = "mfr_" + compute_md5(self.configs["weights"]["mfr"].encode("utf-8"))
+            self.mfr_scheduler = MFRScheduler(lambda: self.load_component("mfr"), self.device,
+                                              batch_size=kwargs.get("mfr_batch_size", 64),
+                                              result_cache=self.recognition_cache, cache_namespace=mfr_namespace)
+
         # 初始化ocr
         if self.apply_ocr:
-            self.ocr_model = ModifiedPaddleOCR(show_log=show_log)
+            rec_batch_num = self.ocr_config.get("rec_batch_num", 30)
+            if self.ocr_mode == "page":
+                # 整页检测时放宽检测输入的尺寸限制，避免整页图片被缩小导致小字漏检
+                ocr_kwargs = {"rec_batch_num": rec_batch_num, "det_limit_type": 'max',
+                              "det_limit_side_len": self.ocr_config.get("det_limit_side_len", 2400)}
+            else:
+                ocr_kwargs = {"rec_batch_num": rec_batch_num}
+            self.component_specs["ocr"] = (tuple(sorted(ocr_kwargs.items())),
+                                           lambda: ModifiedPaddleOCR(show_log=show_log, **ocr_kwargs))
+            # 跨区域、跨页累积文本行，按宽度排序后批量识别
+            self.ocr_rec_queue = OcrRecQueue(lambda: self.ocr_model, batch_size=rec_batch_num,
+                                             max_pending=self.ocr_config.get("rec_max_pending", 1024))
 
         # init structeqtable
         if self.apply_table:
-            self.table_model = table_model_init(str(os.path.join(models_dir, self.configs["weights"]["table"])),
-                                                max_time = self.table_max_time, _device_=self.device)
+            table_weight = str(os.path.join(models_dir, self.configs["weights"]["table"]))
+            self.component_specs["table"] = ((table_weight, self.table_max_time, self.device),
+                                             lambda: table_model_init(table_weight, max_time=self.table_max_time,
+                                                                      _device_=self.device))
+            # max_time会截断识别输出，也影响结果
+            table_namespace = "table_" + compute_md5(
+                f"{self.configs['weights']['table']}_{self.table_max_time}".encode("utf-8"))
+            self.table_scheduler = TableScheduler(lambda: self.table_model, workers=self.table_workers,
+                                                  deadline=self.table_max_time, result_cache=self.recognition_cache,
+                                                  cache_namespace=table_namespace)
         logger.info('DocAnalysis init done!')
 
-    def __call__(self, image):
+    def load_component(self, name):
+        key, loader = self.component_specs[name]
+        return self.registry.get(name, key, loader)
+
+    @property
+    def layout_model(self):
+        return self.load_component("layout")
+
+    @property
+    def mfd_model(self):
+        return self.load_component("mfd")
+
+    @property
+    def mfr_model(self):
+        return self.load_component("mfr")[0]
+
+    @property
+    def ocr_model(self):
+        return self.load_component("ocr")
+
+    @property
+    def table_model(self):
+        return self.load_component("table")
 
-        latex_filling_list = []
-        mf_image_list = []
+    def __call__(self, image, flush=True, skip_formula=False):
 
+        page = self.new_page(image, skip_formula=skip_formula)
         # layout检测
+        self.detect_layout(page)
+        self.detect_formula(page)
+        self.recognize_text(page)
+        self.recognize_table(page)
+        if flush:
+            self.flush_pending()
+        return page["layout_res"]
+
+    def __enqueue_ocr_lines(self, ori_im, dt_boxes, layout_res, offset_x, offset_y):
+        """
+        把文本行截图放入识别队列，识别完成后将结果(转换回整页坐标)追加到该页的layout_res中
+        """
+        def fill_layout_res(box, text, score):
+            # Convert the coordinates back to the original coordinate system
+            p1, p2, p3, p4 = [[point[0] + offset_x, point[1] + offset_y] for point in box.tolist()]
+            layout_res.append({
+                'category_id': 15,
+                'poly': p1 + p2 + p3 + p4,
+                'score': round(score, 2),
+                'text': text,
+            })
+
+        for box, img_crop in zip(dt_boxes, self.ocr_model.crop_boxes(ori_im, dt_boxes)):
+            self.ocr_rec_queue.add(img_crop, box, fill_layout_res)
+
+    def batch_call(self, images, flush=True, skip_formula_list=None):
+        """
+        多页一起做layout检测(一次前向)，其余步骤逐页进行，返回与images一一对应的结果
+        flush=False时公式识别和文本行识别留在队列中继续累积，调用方需在最后调用flush_pending
+        skip_formula_list: 与images一一对应，为True的页不做公式检测和识别
+        """
         layout_start = time.time()
-        layout_res = self.layout_model(image, ignore_catids=[])
+        layout_res_list = self.layout_model.predict_batch(images, ignore_catids=[])
         layout_cost = round(time.time() - layout_start, 2)
-        logger.info(f"layout detection cost: {layout_cost}")
+        logger.info(f"layout detection cost: {layout_cost}, batch size: {len(images)}")
+
+        if skip_formula_list is None:
+            skip_formula_list = [False] * len(images)
+        results = [self.analyze_page(image, layout_res, skip_formula)
+                   for image, layout_res, skip_formula in zip(images, layout_res_list, skip_formula_list)]
+        if flush:
+            self.flush_pending()
+        return results
 
+    def flush_pending(self):
+        """
+        识别队列中所有尚未识别的公式和文本行，等待后台的表格识别，并把结果回填到之前返回的layout_dets中
+        """
         if self.apply_formula:
-            # 公式检测
-            mfd_res = self.mfd_model.predict(image, imgsz=1888, conf=0.25, iou=0.45, verbose=True)[0]
-            for xyxy, conf, cla in zip(mfd_res.boxes.xyxy.cpu(), mfd_res.boxes.conf.cpu(), mfd_res.boxes.cls.cpu()):
-                xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
-                new_item = {
-                    'category_id': 13 + int(cla.item()),
-                    'poly': [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
-                    'score': round(float(conf.item()), 2),
-                    'latex': '',
-                }
-                layout_res.append(new_item)
-                latex_filling_list.append(new_item)
-                bbox_img = get_croped_image(Image.fromarray(image), [xmin, ymin, xmax, ymax])
-                mf_image_list.append(bbox_img)
+            self.mfr_scheduler.flush()
+        if self.apply_ocr:
+            rec_stats = self.ocr_rec_queue.flush()
+            if rec_stats["line_nums"] > 0:
+                logger.info(f"ocr rec line nums: {rec_stats['line_nums']}, rec batch nums: {rec_stats['batch_nums']}, "
+                            f"rec time: {rec_stats['rec_cost']}")
+        # 表格在后台线程中识别，最后等待，与上面的公式/文本行识别重叠
+        if self.apply_table:
+            self.table_scheduler.flush()
+        if self.recognition_cache is not None:
+            self.recognition_cache.log_stats()
+
+    def new_page(self, image, layout_res=None, skip_formula=False):
+        """
+        构造一页的处理上下文，各stage方法都读写这个dict：image为RGB数组，layout_res为该页的layout_dets
+        各stage直接在image上裁剪，不再为整页另外生成PIL图片
+        skip_formula为True时该页跳过公式检测和识别(文本层中没有公式迹象)
+        """
+        return {"image": image, "layout_res": layout_res, "skip_formula": skip_formula}
+
+    def analyze_page(self, image, layout_res, skip_formula=False):
+        """
+        在layout检测结果的基础上完成公式检测、ocr和表格识别；公式截图和文本行截图交给识别队列，识别结果在flush时回填
+        """
+        page = self.new_page(image, layout_res, skip_formula)
+        self.detect_formula(page)
+        self.recognize_text(page)
+        self.recognize_table(page)
+        return page["layout_res"]
+
+    def detect_layout(self, page):
+        layout_start = time.time()
+        page["layout_res"] = self.layout_model(page["image"], ignore_catids=[])
+        layout_cost = round(time.time() - layout_start, 2)
+        logger.info(f"layout detection cost: {layout_cost}")
 
+    def detect_formula(self, page):
+        """
+        公式检测，检测结果追加到layout_res中，公式截图交给mfr_scheduler，latex在识别完成后回填
+        """
+        if not self.apply_formula or page.get("skip_formula", False):
+            return
+        layout_res = page["layout_res"]
+        mfd_res = self.mfd_model.predict(page["image"], imgsz=1888, conf=0.25, iou=0.45, verbose=True)[0]
+        for xyxy, conf, cla in zip(mfd_res.boxes.xyxy.cpu(), mfd_res.boxes.conf.cpu(), mfd_res.boxes.cls.cpu()):
+            xmin, ymin, xmax, ymax = [int(p.item()) for p in xyxy]
+            new_item = {
+                'category_id': 13 + int(cla.item()),
+                'poly': [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax],
+                'score': round(float(conf.item()), 2),
+                'latex': '',
+            }
+            layout_res.append(new_item)
             # 公式识别
-            mfr_start = time.time()
-            dataset = MathDataset(mf_image_list, transform=self.mfr_transform)
-            dataloader = DataLoader(dataset, batch_size=64, num_workers=0)
-            mfr_res = []
-            for mf_img in dataloader:
-                mf_img = mf_img.to(self.device)
-                output = self.mfr_model.generate({'image': mf_img})
-                mfr_res.extend(output['pred_str'])
-            for res, latex in zip(latex_filling_list, mfr_res):
-                res['latex'] = latex_rm_whitespace(latex)
-            mfr_cost = round(time.time() - mfr_start, 2)
-            logger.info(f"formula nums: {len(mf_image_list)}, mfr time: {mfr_cost}")
-
-        # Select regions for OCR / formula regions / table regions
-        ocr_res_list = []
-        table_res_list = []
-        single_page_mfdetrec_res = []
-        for res in layout_res:
-            if int(res['category_id']) in [13, 14]:
-                single_page_mfdetrec_res.append({
-                    "bbox": [int(res['poly'][0]), int(res['poly'][1]),
-                             int(res['poly'][4]), int(res['poly'][5])],
-                })
-            elif int(res['category_id']) in [0, 1, 2, 4, 6, 7]:
-                ocr_res_list.append(res)
-            elif int(res['category_id']) in [5]:
-                table_res_list.append(res)
-
-        #  Unified crop img logic
-        def crop_img(input_res, input_pil_img, crop_paste_x=0, crop_paste_y=0):
-            crop_xmin, crop_ymin = int(input_res['poly'][0]), int(input_res['poly'][1])
-            crop_xmax, crop_ymax = int(input_res['poly'][4]), int(input_res['poly'][5])
-            # Create a white background with an additional width and height of 50
-            crop_new_width = crop_xmax - crop_xmin + crop_paste_x * 2
-            crop_new_height = crop_ymax - crop_ymin + crop_paste_y * 2
-            return_image = Image.new('RGB', (crop_new_width, crop_new_height), 'white')
-
-            # Crop image
-            crop_box = (crop_xmin, crop_ymin, crop_xmax, crop_ymax)
-            cropped_img = input_pil_img.crop(crop_box)
-            return_image.paste(cropped_img, (crop_paste_x, crop_paste_y))
-            return_list = [crop_paste_x, crop_paste_y, crop_xmin, crop_ymin, crop_xmax, crop_ymax, crop_new_width, crop_new_height]
-            return return_image, return_list
-
-        pil_img = Image.fromarray(image)
-
-        # ocr识别
-        if self.apply_ocr:
-            ocr_start = time.time()
+            bbox_img = Image.fromarray(crop_array(page["image"], [xmin, ymin, xmax, ymax]))
+            self.mfr_scheduler.add(bbox_img, new_item)
+
+    def recognize_text(self, page):
+        """
+        ocr：文本行检测在当前线程完成，文本行截图交给ocr_rec_queue，识别结果在识别完成后追加到layout_res中
+        需要在detect_formula之后调用，检测时会屏蔽公式区域
+        """
+        if not self.apply_ocr:
+            return
+        layout_res = page["layout_res"]
+        ocr_res_list, _, single_page_mfdetrec_res = select_regions(layout_res)
+        ocr_start = time.time()
+        if self.ocr_mode == "page":
+            # Detect text lines once on the whole page, then assign them to the layout regions
+            regions = [[int(res['poly'][0]), int(res['poly'][1]), int(res['poly'][4]), int(res['poly'][5])]
+                       for res in ocr_res_list]
+            bgr_image = cv2.cvtColor(page["image"], cv2.COLOR_RGB2BGR)
+            ori_im, dt_boxes = self.ocr_model.det_page(bgr_image, regions, mfd_res=single_page_mfdetrec_res)
+            self.__enqueue_ocr_lines(ori_im, dt_boxes, layout_res, 0, 0)
+        else:
             # Process each area that requires OCR processing
             for res in ocr_res_list:
-                new_image, useful_list = crop_img(res, pil_img, crop_paste_x=50, crop_paste_y=50)
+                new_image, useful_list = crop_img(res, page["image"], crop_paste_x=50, crop_paste_y=50, bgr=True)
                 paste_x, paste_y, xmin, ymin, xmax, ymax, new_width, new_height = useful_list
                 # Adjust the coordinates of the formula area
                 adjusted_mfdetrec_res = []
@@ -245,52 +634,20 @@ class CustomPEKModel:
                             "bbox": [x0, y0, x1, y1],
                         })
 
-                # OCR recognition
-                new_image = cv2.cvtColor(np.asarray(new_image), cv2.COLOR_RGB2BGR)
-                ocr_res = self.ocr_model.ocr(new_image, mfd_res=adjusted_mfdetrec_res)[0]
-
-                # Integration results
-                if ocr_res:
-                    for box_ocr_res in ocr_res:
-                        p1, p2, p3, p4 = box_ocr_res[0]
-                        text, score = box_ocr_res[1]
-
-                        # Convert the coordinates back to the original coordinate system
-                        p1 = [p1[0] - paste_x + xmin, p1[1] - paste_y + ymin]
-                        p2 = [p2[0] - paste_x + xmin, p2[1] - paste_y + ymin]
-                        p3 = [p3[0] - paste_x + xmin, p3[1] - paste_y + ymin]
-                        p4 = [p4[0] - paste_x + xmin, p4[1] - paste_y + ymin]
-
-                        layout_res.append({
-                            'category_id': 15,
-                            'poly': p1 + p2 + p3 + p4,
-                            'score': round(score, 2),
-                            'text': text,
-                        })
+                # OCR detection, recognition is batched by the rec queue
+                ori_im, dt_boxes = self.ocr_model.det(new_image, mfd_res=adjusted_mfdetrec_res)
+                self.__enqueue_ocr_lines(ori_im, dt_boxes, layout_res, xmin - paste_x, ymin - paste_y)
 
-            ocr_cost = round(time.time() - ocr_start, 2)
-            logger.info(f"ocr cost: {ocr_cost}")
+        ocr_cost = round(time.time() - ocr_start, 2)
+        logger.info(f"ocr det cost: {ocr_cost}, pending lines: {self.ocr_rec_queue.pending()}")
 
-        # 表格识别 table recognition
-        if self.apply_table:
-            table_start = time.time()
-            for res in table_res_list:
-                new_image, _ = crop_img(res, pil_img)
-                single_table_start_time = time.time()
-                logger.info("------------------table recognition processing begins-----------------")
-                with torch.no_grad():
-                    latex_code = self.table_model.image2latex(new_image)[0]
-                run_time = time.time() - single_table_start_time
-                logger.info(f"------------table recognition processing ends within {run_time}s-----")
-                if run_time > self.table_max_time:
-                    logger.warning(f"------------table recognition processing exceeds max time {self.table_max_time}s----------")
-                # 判断是否返回正常
-                expected_ending = latex_code.strip().endswith('end{tabular}') or latex_code.strip().endswith('end{table}')
-                if latex_code and expected_ending:
-                    res["latex"] = latex_code
-                else:
-                    logger.warning(f"------------table recognition processing fails----------")
-            table_cost = round(time.time() - table_start, 2)
-            logger.info(f"table cost: {table_cost}")
-
-        return layout_res
+    def recognize_table(self, page):
+        """
+        表格识别 table recognition，表格截图交给table_scheduler在后台识别，latex在flush时回填到对应表格条目
+        """
+        if not self.apply_table:
+            return
+        _, table_res_list, _ = select_regions(page["layout_res"])
+        for res in table_res_list:
+            new_image, _ = crop_img(res, page["image"])
+            self.table_scheduler.add(Image.fromarray(new_image), res)
@@ -2,6 +2,8 @@ from .visualizer import Visualizer
 from .rcnn_vl import *
 from .backbone import *
 
+import torch
+
 from detectron2.config import get_cfg
 from detectron2.config import CfgNode as CN
 from detectron2.data import MetadataCatalog, DatasetCatalog
@@ -130,11 +132,42 @@ class Layoutlmv3_Predictor(object):
         # page_layout_result = {
         #     "layout_dets": []
         # }
-        layout_dets = []
         outputs = self.predictor(image)
-        boxes = outputs["instances"].to("cpu")._fields["pred_boxes"].tensor.tolist()
-        labels = outputs["instances"].to("cpu")._fields["pred_classes"].tolist()
-        scores = outputs["instances"].to("cpu")._fields["scores"].tolist()
+        return self.__outputs_to_layout_dets(outputs, ignore_catids)
+
+    def predict_batch(self, images, ignore_catids=[]):
+        """
+        多页图片合并成一个batch过一次backbone，返回与images一一对应的layout_dets列表
+        预处理与DefaultPredictor保持一致；缩放后尺寸不同的页面分到不同的batch，避免padding影响检测结果
+        """
+        predictor = self.predictor
+        inputs = []
+        for image in images:
+            if predictor.input_format == "RGB":
+                image = image[:, :, ::-1]
+            height, width = image.shape[:2]
+            transformed = predictor.aug.get_transform(image).apply_image(image)
+            tensor = torch.as_tensor(transformed.astype("float32").transpose(2, 0, 1))
+            inputs.append({"image": tensor, "height": height, "width": width})
+
+        shape_groups = {}
+        for idx, model_input in enumerate(inputs):
+            shape_groups.setdefault(tuple(model_input["image"].shape), []).append(idx)
+
+        results = [None] * len(images)
+        with torch.no_grad():
+            for idxes in shape_groups.values():
+                outputs = predictor.model([inputs[idx] for idx in idxes])
+                for idx, output in zip(idxes, outputs):
+                    results[idx] = self.__outputs_to_layout_dets(output, ignore_catids)
+        return results
+
+    def __outputs_to_layout_dets(self, outputs, ignore_catids):
+        layout_dets = []
+        instances = outputs["instances"].to("cpu")
+        boxes = instances._fields["pred_boxes"].tensor.tolist()
+        labels = instances._fields["pred_classes"].tolist()
+        scores = instances._fields["scores"].tolist()
         for bbox_idx in range(len(boxes)):
             if labels[bbox_idx] in ignore_catids:
                 continue
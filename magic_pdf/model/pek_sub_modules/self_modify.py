@@ -1,5 +1,6 @@
 import time
 import copy
+import threading
 import base64
 import cv2
 import numpy as np
@@ -162,6 +163,51 @@ def update_det_boxes(dt_boxes, mfd_res):
     return new_dt_boxes
 
 
+def assign_boxes_to_regions(dt_boxes, regions, overlap_ratio=0.5):
+    """
+    把整页检测出的文本框分配给layout区域：取文本框面积落在其中占比最大的区域(占比需超过overlap_ratio)，
+    并把文本框裁剪到该区域内，与按区域截图后检测的效果保持一致
+    返回与regions一一对应的文本框列表
+    """
+    region_boxes = [[] for _ in regions]
+    if len(dt_boxes) == 0 or len(regions) == 0:
+        return region_boxes
+    boxes = np.array(dt_boxes, dtype='float32')
+    box_x0, box_y0 = boxes[:, :, 0].min(axis=1), boxes[:, :, 1].min(axis=1)
+    box_x1, box_y1 = boxes[:, :, 0].max(axis=1), boxes[:, :, 1].max(axis=1)
+    box_area = (box_x1 - box_x0) * (box_y1 - box_y0)
+
+    region_arr = np.array(regions, dtype='float32')
+    inter_w = np.minimum(box_x1[:, None], region_arr[None, :, 2]) - np.maximum(box_x0[:, None], region_arr[None, :, 0])
+    inter_h = np.minimum(box_y1[:, None], region_arr[None, :, 3]) - np.maximum(box_y0[:, None], region_arr[None, :, 1])
+    inter_area = np.clip(inter_w, 0, None) * np.clip(inter_h, 0, None)
+    ratio = inter_area / np.maximum(box_area, 1e-6)[:, None]
+
+    best_region = ratio.argmax(axis=1)
+    for box_idx, region_idx in enumerate(best_region):
+        if box_area[box_idx] <= 0 or ratio[box_idx, region_idx] < overlap_ratio:
+            continue
+        x0, y0, x1, y1 = region_arr[region_idx]
+        box = boxes[box_idx].copy()
+        box[:, 0] = np.clip(box[:, 0], x0, x1)
+        box[:, 1] = np.clip(box[:, 1], y0, y1)
+        region_boxes[region_idx].append(box)
+    return region_boxes
+
+
+def filter_mfd_res_by_region(mfd_res, region, padding=0):
+    """ 只保留与(外扩padding后的)区域相交的公式框 """
+    x0, y0, x1, y1 = region
+    x0, y0, x1, y1 = x0 - padding, y0 - padding, x1 + padding, y1 + padding
+    region_mfd_res = []
+    for mf_res in mfd_res:
+        mf_x0, mf_y0, mf_x1, mf_y1 = mf_res['bbox']
+        if mf_x1 < x0 or mf_y1 < y0 or mf_x0 > x1 or mf_y0 > y1:
+            continue
+        region_mfd_res.append(mf_res)
+    return region_mfd_res
+
+
 class ModifiedPaddleOCR(PaddleOCR):
     def ocr(self, img, det=True, rec=True, cls=True, bin=False, inv=False, mfd_res=None, alpha_color=(255, 255, 255)):
         """
@@ -301,4 +347,138 @@ class ModifiedPaddleOCR(PaddleOCR):
                 filter_rec_res.append(rec_result)
         end = time.time()
         time_dict['all'] = end - start
-        return filter_boxes, filter_rec_res, time_dict
\ No newline at end of file
+        return filter_boxes, filter_rec_res, time_dict
+
+    def det(self, img, mfd_res=None, alpha_color=(255, 255, 255)):
+        """
+        只做文本检测：检测框排序后再用公式框(mfd_res)把文本框中的公式部分挖掉
+        return: (ori_im, dt_boxes)，ori_im用于后续按dt_boxes截取文本行
+        """
+        img = alpha_to_color(img, alpha_color)
+        ori_im = img.copy()
+        dt_boxes, elapse = self.text_detector(img)
+        if dt_boxes is None or len(dt_boxes) == 0:
+            logger.debug("no dt_boxes found, elapsed : {}".format(elapse))
+            return ori_im, []
+        logger.debug("dt_boxes num : {}, elapsed : {}".format(len(dt_boxes), elapse))
+
+        dt_boxes = sorted_boxes(dt_boxes)
+        if mfd_res:
+            dt_boxes = update_det_boxes(dt_boxes, mfd_res)
+        return ori_im, dt_boxes
+
+    def det_page(self, img, regions, mfd_res=None, alpha_color=(255, 255, 255)):
+        """
+        整页只做一次文本检测，按位置把文本框分配给各layout区域，与区域相交的公式框会从文本框中挖掉
+        args:
+            img: 整页图片(BGR ndarray)
+            regions: 需要ocr的区域[[x0, y0, x1, y1], ...]，整页坐标
+            mfd_res: 公式检测结果[{"bbox": [x0, y0, x1, y1]}, ...]，整页坐标
+        return:
+            (ori_im, dt_boxes)，与det一致，dt_boxes按区域依次排列
+        """
+        img = alpha_to_color(img, alpha_color)
+        ori_im = img.copy()
+        page_boxes, elapse = self.text_detector(img)
+        if page_boxes is None or len(page_boxes) == 0:
+            logger.debug("no dt_boxes found, elapsed : {}".format(elapse))
+            return ori_im, []
+        logger.debug("page dt_boxes num : {}, elapsed : {}".format(len(page_boxes), elapse))
+
+        dt_boxes = []
+        for region_idx, boxes in enumerate(assign_boxes_to_regions(page_boxes, regions)):
+            if len(boxes) == 0:
+                continue
+            boxes = sorted_boxes(np.array(boxes))
+            if mfd_res:
+                # 与按区域截图(四周外扩50像素)时筛选公式框的范围一致
+                region_mfd_res = filter_mfd_res_by_region(mfd_res, regions[region_idx], padding=50)
+                if region_mfd_res:
+                    boxes = update_det_boxes(boxes, region_mfd_res)
+            dt_boxes.extend(boxes)
+        return ori_im, dt_boxes
+
+    def crop_boxes(self, ori_im, dt_boxes):
+        img_crop_list = []
+        for bno in range(len(dt_boxes)):
+            tmp_box = copy.deepcopy(dt_boxes[bno])
+            if self.args.det_box_type == "quad":
+                img_crop = get_rotate_crop_image(ori_im, tmp_box)
+            else:
+                img_crop = get_minarea_rect_crop(ori_im, tmp_box)
+            img_crop_list.append(img_crop)
+        return img_crop_list
+
+
+class OcrRecQueue:
+    """
+    文本行识别队列：收集一页(或多页)所有区域的文本行截图，按宽高比排序(缩小同一batch内的padding)后
+    以batch_size为单位批量做方向分类和识别，再通过加入队列时登记的回调把结果交还给文本框所属的区域
+    队列中积压的文本行达到max_pending时自动识别一次，保证内存占用有上限
+    add/run/flush可以在多个线程中调用(流水线模式下ocr stage与最后的flush不在同一线程)
+    """
+
+    def __init__(self, get_ocr_model, batch_size=30, max_pending=1024, cls=True):
+        # get_ocr_model() -> ModifiedPaddleOCR，每次识别时重新获取，模型被注册表淘汰后可以重新加载
+        self.get_ocr_model = get_ocr_model
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.cls = cls
+        self.lock = threading.Lock()
+        self.items = []
+        self.line_nums = 0
+        self.batch_nums = 0
+        self.rec_cost = 0
+
+    def add(self, img_crop, box, owner):
+        """
+        img_crop: 文本行截图；box: 文本框四个顶点；owner: 回调owner(box, text, score)，只会收到score不低于drop_score的结果
+        """
+        with self.lock:
+            self.items.append((img_crop, box, owner))
+            if len(self.items) >= self.max_pending:
+                self.__run()
+
+    def pending(self):
+        return len(self.items)
+
+    def run(self):
+        with self.lock:
+            self.__run()
+
+    def __run(self):
+        if len(self.items) == 0:
+            return
+        items, self.items = self.items, []
+        rec_start = time.time()
+
+        ocr_model = self.get_ocr_model()
+        img_crop_list = [item[0] for item in items]
+        if ocr_model.use_angle_cls and self.cls:
+            img_crop_list, angle_list, elapse = ocr_model.text_classifier(img_crop_list)
+
+        order = sorted(range(len(img_crop_list)),
+                       key=lambda idx: img_crop_list[idx].shape[1] / max(img_crop_list[idx].shape[0], 1))
+        rec_res = [None] * len(img_crop_list)
+        for start in range(0, len(order), self.batch_size):
+            batch_idxes = order[start:start + self.batch_size]
+            batch_res, elapse = ocr_model.text_recognizer([img_crop_list[idx] for idx in batch_idxes])
+            for idx, res in zip(batch_idxes, batch_res):
+                rec_res[idx] = res
+            self.batch_nums += 1
+
+        for (_, box, owner), (text, score) in zip(items, rec_res):
+            if score >= ocr_model.drop_score:
+                owner(box, text, score)
+        self.line_nums += len(items)
+        self.rec_cost += time.time() - rec_start
+
+    def flush(self):
+        with self.lock:
+            self.__run()
+            if self.line_nums > 0:
+                logger.debug("rec line nums : {}, rec batch nums : {}, elapsed : {}".format(
+                    self.line_nums, self.batch_nums, self.rec_cost))
+            stats = {"line_nums": self.line_nums, "batch_nums": self.batch_nums, "rec_cost": round(self.rec_cost, 2)}
+            self.line_nums, self.batch_nums, self.rec_cost = 0, 0, 0
+            return stats
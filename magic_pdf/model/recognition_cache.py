@@ -0,0 +1,138 @@
+"""
+公式识别(UniMERNet)和表格识别(StructEqTable)结果缓存：同一个公式或表格截图经常在不同页面、不同文档中重复出现，
+以截图指纹为key缓存识别结果，命中时跳过模型推理
+指纹由感知哈希(灰度缩放后的差值哈希，加上宽高比分档)和灰度像素的md5组成：感知哈希用于查找，
+md5用于确认是同一张图；near_duplicate为True时只要感知哈希相同即视为命中
+内存一级缓存按条目数做LRU淘汰，可选的本地磁盘二级缓存按总大小淘汰，跨进程、跨任务复用
+"""
+import json
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from loguru import logger
+
+from magic_pdf.libs.config_reader import get_recognition_cache_config
+from magic_pdf.libs.hash_utils import compute_md5
+from magic_pdf.model.model_output_cache import LocalDiskCache
+
+HASH_SIZE = 16
+
+
+def image_fingerprint(image) -> tuple:
+    """
+    image: PIL.Image，返回(perceptual_hash, exact_hash)
+    """
+    width, height = image.size
+    gray = image.convert("L")
+    small = np.asarray(gray.resize((HASH_SIZE + 1, HASH_SIZE)), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    # 缩放会抹掉宽高比，不同长度的公式可能得到相同的差值哈希，按宽高比的对数分档区分
+    aspect_level = round(math.log2(max(width, 1) / max(height, 1)) * 2)
+    perceptual_hash = f"{aspect_level}_{np.packbits(bits).tobytes().hex()}"
+    exact_hash = compute_md5(f"{width}x{height}".encode("utf-8") + gray.tobytes())
+    return perceptual_hash, exact_hash
+
+
+class RecognitionCache:
+    """
+    namespace区分不同的模型(及影响结果的参数)，同一张截图在不同模型下的结果互不影响
+    """
+
+    def __init__(self, memory_entries=10000, local: LocalDiskCache = None, near_duplicate=False):
+        self.memory_entries = memory_entries
+        self.local = local
+        self.near_duplicate = near_duplicate
+        self.lock = threading.Lock()
+        # (namespace, perceptual_hash) -> {exact_hash: value}
+        self.entries = OrderedDict()
+        self.stats = {}
+
+    def match_key(self, fingerprint: tuple):
+        """
+        判断两张截图是否算同一张的key，可用于合并同时在排队的重复截图
+        """
+        return fingerprint[0] if self.near_duplicate else fingerprint
+
+    def __load(self, namespace, perceptual_hash):
+        key = (namespace, perceptual_hash)
+        bucket = self.entries.get(key)
+        if bucket is None and self.local is not None:
+            content = self.local.read(f"{namespace}/{perceptual_hash}.json")
+            if content is not None:
+                bucket = json.loads(content)
+                self.__store(key, bucket)
+        if bucket is not None:
+            self.entries.move_to_end(key)
+        return bucket
+
+    def __store(self, key, bucket):
+        self.entries[key] = bucket
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.memory_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, namespace: str, fingerprint: tuple):
+        perceptual_hash, exact_hash = fingerprint
+        with self.lock:
+            stats = self.stats.setdefault(namespace, {"hit_nums": 0, "miss_nums": 0})
+            bucket = self.__load(namespace, perceptual_hash)
+            value = None
+            if bucket is not None:
+                value = bucket.get(exact_hash)
+                if value is None and self.near_duplicate and len(bucket) > 0:
+                    value = next(iter(bucket.values()))
+            if value is None:
+                stats["miss_nums"] += 1
+            else:
+                stats["hit_nums"] += 1
+            return value
+
+    def put(self, namespace: str, fingerprint: tuple, value):
+        perceptual_hash, exact_hash = fingerprint
+        with self.lock:
+            key = (namespace, perceptual_hash)
+            bucket = self.__load(namespace, perceptual_hash) or {}
+            bucket[exact_hash] = value
+            self.__store(key, bucket)
+            content = json.dumps(bucket, ensure_ascii=False)
+        if self.local is not None:
+            self.local.write(f"{namespace}/{perceptual_hash}.json", content)
+
+    def log_stats(self):
+        with self.lock:
+            for namespace, stats in self.stats.items():
+                total = stats["hit_nums"] + stats["miss_nums"]
+                if total == 0:
+                    continue
+                logger.info(f"recognition cache {namespace}, hit nums: {stats['hit_nums']}, "
+                            f"miss nums: {stats['miss_nums']}, hit rate: {round(stats['hit_nums'] / total, 4)}")
+            self.stats = {}
+
+
+def init_recognition_cache(cache_config: dict):
+    """
+    根据magic-pdf.json中的recognition-cache配置构造缓存，未启用时返回None
+    """
+    if not cache_config.get("enable", False):
+        return None
+    local = None
+    if cache_config.get("local-dir"):
+        local = LocalDiskCache(cache_config["local-dir"], int(cache_config.get("max-size-mb", 512)) * 1024 * 1024)
+    return RecognitionCache(memory_entries=int(cache_config.get("memory-entries", 10000)), local=local,
+                            near_duplicate=cache_config.get("near-duplicate", False))
+
+
+_recognition_cache = None
+_recognition_cache_inited = False
+_recognition_cache_lock = threading.Lock()
+
+
+def get_recognition_cache():
+    global _recognition_cache, _recognition_cache_inited
+    with _recognition_cache_lock:
+        if not _recognition_cache_inited:
+            _recognition_cache = init_recognition_cache(get_recognition_cache_config())
+            _recognition_cache_inited = True
+    return _recognition_cache
@@ -0,0 +1,94 @@
+"""
+页面渲染dpi策略：fixed模式所有页按同一dpi渲染；adaptive模式按文本层字号中位数、页面尺寸和像素预算逐页选择dpi，
+小字号的论文页面用更高的dpi，幻灯片和大幅面页面用更低的dpi，减少推理耗时和内存占用
+"""
+import math
+
+import fitz
+
+DEFAULT_DPI = 200
+# 渲染后宽或高超过该像素数时不再放大，按72dpi渲染
+MAX_SIDE_PIXELS = 9000
+
+
+def render_size(page, dpi) -> tuple:
+    rect = (page.rect * fitz.Matrix(dpi / 72, dpi / 72)).irect
+    return rect.width, rect.height
+
+
+def limit_dpi_by_side(page, dpi) -> int:
+    width, height = render_size(page, dpi)
+    if width > MAX_SIDE_PIXELS or height > MAX_SIDE_PIXELS:
+        return 72
+    return dpi
+
+
+def median_font_size(page):
+    """
+    文本层中按字符数加权的字号中位数，没有文本层(如扫描件)时返回None
+    """
+    sizes = []
+    for span in page.get_texttrace():
+        if span["size"] > 0:
+            sizes.append((span["size"], len(span["chars"])))
+    total = sum(char_nums for _, char_nums in sizes)
+    if total == 0:
+        return None
+    sizes.sort()
+    acc = 0
+    for size, char_nums in sizes:
+        acc += char_nums
+        if acc * 2 >= total:
+            return size
+
+
+class DpiPolicy:
+    """
+    fixed: 所有页都按dpi渲染
+    adaptive: 使文本层字号中位数渲染后约为target_font_px像素高，结果限制在[min_dpi, max_dpi]之间，
+              再按max_pixels限制单页像素总数；没有文本层的页按dpi渲染
+    两种模式下渲染后宽或高超过9000像素的页都按72dpi渲染
+    """
+
+    def __init__(self, mode="fixed", dpi=DEFAULT_DPI, min_dpi=96, max_dpi=300, target_font_px=28,
+                 max_pixels=16000000):
+        if mode not in ["fixed", "adaptive"]:
+            raise ValueError(f"unknown render dpi mode: {mode}")
+        self.mode = mode
+        self.dpi = dpi
+        self.min_dpi = min_dpi
+        self.max_dpi = max_dpi
+        self.target_font_px = target_font_px
+        self.max_pixels = max_pixels
+
+    @classmethod
+    def from_config(cls, dpi_config: dict):
+        return cls(mode=dpi_config.get("mode", "fixed"),
+                   dpi=dpi_config.get("dpi", DEFAULT_DPI),
+                   min_dpi=dpi_config.get("min-dpi", 96),
+                   max_dpi=dpi_config.get("max-dpi", 300),
+                   target_font_px=dpi_config.get("target-font-px", 28),
+                   max_pixels=dpi_config.get("max-pixels", 16000000))
+
+    def page_dpi(self, page) -> int:
+        if self.mode == "fixed":
+            return limit_dpi_by_side(page, self.dpi)
+
+        dpi = self.dpi
+        font_size = median_font_size(page)
+        if font_size is not None:
+            dpi = self.target_font_px * 72 / font_size
+            dpi = min(max(dpi, self.min_dpi), self.max_dpi)
+        page_area = page.rect.width * page.rect.height
+        if page_area > 0 and page_area * (dpi / 72) ** 2 > self.max_pixels:
+            dpi = 72 * math.sqrt(self.max_pixels / page_area)
+        return limit_dpi_by_side(page, max(int(dpi), 1))
+
+    def fingerprint(self):
+        """
+        写入模型结果缓存的指纹，fixed模式下与只记录dpi时保持一致
+        """
+        if self.mode == "fixed":
+            return self.dpi
+        return {"mode": self.mode, "dpi": self.dpi, "min_dpi": self.min_dpi, "max_dpi": self.max_dpi,
+                "target_font_px": self.target_font_px, "max_pixels": self.max_pixels}
@@ -733,55 +733,75 @@ def __do_split_page(blocks, layout_bboxes, new_layout_bbox, page_num, lang):
     return connected_layout_blocks, page_list_info
 
 
-def para_split(pdf_info_dict, debug_mode, lang="en"):
-    global debug_able
-    debug_able = debug_mode
-    new_layout_of_pages = []  # 数组的数组，每个元素是一个页面的layoutS
-    all_page_list_info = []  # 保存每个页面开头和结尾是否是列表
-    for page_num, page in pdf_info_dict.items():
-        blocks = page['preproc_blocks']
-        layout_bboxes = page['layout_bboxes']
-        new_layout_bbox = __common_pre_proc(blocks, layout_bboxes)
-        new_layout_of_pages.append(new_layout_bbox)
-        splited_blocks, page_list_info = __do_split_page(blocks, layout_bboxes, new_layout_bbox, page_num, lang)
-        all_page_list_info.append(page_list_info)
-        page['para_blocks'] = splited_blocks
-
-    """连接页面与页面之间的可能合并的段落"""
-    pdf_infos = list(pdf_info_dict.values())
-    for page_num, page in enumerate(pdf_info_dict.values()):
-        if page_num == 0:
-            continue
-        pre_page_paras = pdf_infos[page_num - 1]['para_blocks']
-        next_page_paras = pdf_infos[page_num]['para_blocks']
-        pre_page_layout_bbox = new_layout_of_pages[page_num - 1]
-        next_page_layout_bbox = new_layout_of_pages[page_num]
+def __split_page_paras(page, page_num, lang):
+    blocks = page['preproc_blocks']
+    layout_bboxes = page['layout_bboxes']
+    new_layout_bbox = __common_pre_proc(blocks, layout_bboxes)
+    splited_blocks, page_list_info = __do_split_page(blocks, layout_bboxes, new_layout_bbox, page_num, lang)
+    page['para_blocks'] = splited_blocks
+    return new_layout_bbox, page_list_info
 
-        is_conn = __connect_para_inter_page(pre_page_paras, next_page_paras, pre_page_layout_bbox,
-                                            next_page_layout_bbox, page_num, lang)
-        if debug_able:
-            if is_conn:
-                logger.info(f"连接了第{page_num - 1}页和第{page_num}页的段落")
-
-        is_list_conn = __connect_list_inter_page(pre_page_paras, next_page_paras, pre_page_layout_bbox,
-                                                 next_page_layout_bbox, all_page_list_info[page_num - 1],
-                                                 all_page_list_info[page_num], page_num, lang)
-        if debug_able:
-            if is_list_conn:
-                logger.info(f"连接了第{page_num - 1}页和第{page_num}页的列表段落")
 
+def __finish_page_paras(page, new_layout_bbox, page_num, lang):
     """接下来可能会漏掉一些特别的一些可以合并的内容，对他们进行段落连接
     1. 正文中有时出现一个行顶格，接下来几行缩进的情况。
     2. 居中的一些连续单行，如果高度相同，那么可能是一个段落。
     """
-    for page_num, page in enumerate(pdf_info_dict.values()):
-        page_paras = page['para_blocks']
-        new_layout_bbox = new_layout_of_pages[page_num]
-        __connect_middle_align_text(page_paras, new_layout_bbox, page_num, lang)
-        __merge_signle_list_text(page_paras, new_layout_bbox, page_num, lang)
+    page_paras = page['para_blocks']
+    __connect_middle_align_text(page_paras, new_layout_bbox, page_num, lang)
+    __merge_signle_list_text(page_paras, new_layout_bbox, page_num, lang)
 
     # layout展平
-    for page_num, page in enumerate(pdf_info_dict.values()):
-        page_paras = page['para_blocks']
-        page_blocks = [block for layout in page_paras for block in layout]
-        page["para_blocks"] = page_blocks
+    page_blocks = [block for layout in page_paras for block in layout]
+    page["para_blocks"] = page_blocks
+
+
+def para_split_stream(pages, debug_mode, lang="en"):
+    """
+    逐页分段的生成器，pages为按页码顺序排列的page_info可迭代对象，页码可以不连续
+    跨页的段落连接只涉及相邻两页，每读入一页就和上一页做连接，上一页随即完成分段并被yield出来，
+    同一时刻只有两页在窗口中，结果与para_split一致
+    """
+    global debug_able
+    debug_able = debug_mode
+    pre_page = None  # (page_info, new_layout_bbox, page_list_info)
+    for page in pages:
+        page_num = page['page_idx']
+        new_layout_bbox, page_list_info = __split_page_paras(page, page_num, lang)
+
+        """连接页面与页面之间的可能合并的段落"""
+        if pre_page is not None:
+            pre_page_info, pre_page_layout_bbox, pre_page_list_info = pre_page
+            pre_page_num = pre_page_info['page_idx']
+            # 只解析部分页(page_list)时前后两项可能不是相邻页，不做跨页连接
+            if page_num == pre_page_num + 1:
+                pre_page_paras = pre_page_info['para_blocks']
+                next_page_paras = page['para_blocks']
+
+                is_conn = __connect_para_inter_page(pre_page_paras, next_page_paras, pre_page_layout_bbox,
+                                                    new_layout_bbox, page_num, lang)
+                if debug_able:
+                    if is_conn:
+                        logger.info(f"连接了第{pre_page_num}页和第{page_num}页的段落")
+
+                is_list_conn = __connect_list_inter_page(pre_page_paras, next_page_paras, pre_page_layout_bbox,
+                                                         new_layout_bbox, pre_page_list_info, page_list_info,
+                                                         page_num, lang)
+                if debug_able:
+                    if is_list_conn:
+                        logger.info(f"连接了第{pre_page_num}页和第{page_num}页的列表段落")
+
+            __finish_page_paras(pre_page_info, pre_page_layout_bbox, pre_page_num, lang)
+            yield pre_page_info
+
+        pre_page = (page, new_layout_bbox, page_list_info)
+
+    if pre_page is not None:
+        pre_page_info, pre_page_layout_bbox, _ = pre_page
+        __finish_page_paras(pre_page_info, pre_page_layout_bbox, pre_page_info['page_idx'], lang)
+        yield pre_page_info
+
+
+def para_split(pdf_info_dict, debug_mode, lang="en"):
+    for _ in para_split_stream(pdf_info_dict.values(), debug_mode, lang):
+        pass
@@ -7,6 +7,9 @@ def parse_pdf_by_ocr(pdf_bytes,
                      start_page_id=0,
                      end_page_id=None,
                      debug_mode=False,
+                     page_list=None,
+                     parse_workers=1,
+                     pdf_session=None,
                      ):
     return pdf_parse_union(pdf_bytes,
                            model_list,
@@ -15,4 +18,7 @@ def parse_pdf_by_ocr(pdf_bytes,
                            start_page_id=start_page_id,
                            end_page_id=end_page_id,
                            debug_mode=debug_mode,
+                           page_list=page_list,
+                           parse_workers=parse_workers,
+                           pdf_session=pdf_session,
                            )
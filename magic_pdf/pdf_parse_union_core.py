@@ -1,16 +1,19 @@
+import math
 import time
+from concurrent.futures import ProcessPoolExecutor
 
 from loguru import logger
 
 from magic_pdf.libs.commons import fitz, get_delta_time
 from magic_pdf.layout.layout_sort import get_bboxes_layout, LAYOUT_UNPROC, get_columns_cnt_of_layout
-from magic_pdf.libs.convert_utils import dict_to_list
 from magic_pdf.libs.drop_reason import DropReason
-from magic_pdf.libs.hash_utils import compute_md5
 from magic_pdf.libs.local_math import float_equal
 from magic_pdf.libs.ocr_content_type import ContentType
+from magic_pdf.libs.page_range import resolve_page_ids
+from magic_pdf.libs.pdf_session import PdfSession
+from magic_pdf.libs.pdf_text_layer import PdfTextLayer
 from magic_pdf.model.magic_model import MagicModel
-from magic_pdf.para.para_split_v2 import para_split
+from magic_pdf.para.para_split_v2 import para_split_stream
 from magic_pdf.pre_proc.citationmarker_remove import remove_citation_marker
 from magic_pdf.pre_proc.construct_page_dict import ocr_construct_page_component_v2
 from magic_pdf.pre_proc.cut_image import ocr_cut_image_and_table
@@ -41,11 +44,9 @@ def remove_horizontal_overlap_block_which_smaller(all_bboxes):
     return is_useful_block_horz_overlap, all_bboxes
 
 
-def txt_spans_extract(pdf_page, inline_equations, interline_equations):
-    text_raw_blocks = pdf_page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT)["blocks"]
-    char_level_text_blocks = pdf_page.get_text("rawdict", flags=fitz.TEXTFLAGS_TEXT)[
-        "blocks"
-    ]
+def txt_spans_extract(text_layer: PdfTextLayer, page_id, inline_equations, interline_equations):
+    text_raw_blocks = text_layer.get_dict(page_id)["blocks"]
+    char_level_text_blocks = text_layer.get_rawdict(page_id)["blocks"]
     text_blocks = combine_chars_to_pymudict(text_raw_blocks, char_level_text_blocks)
     text_blocks = replace_equations_in_textblock(
         text_blocks, inline_equations, interline_equations
@@ -75,7 +76,7 @@ def replace_text_span(pymu_spans, ocr_spans):
     return list(filter(lambda x: x["type"] != ContentType.Text, ocr_spans)) + pymu_spans
 
 
-def parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter, parse_mode):
+def parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter, parse_mode, text_layer=None):
     need_drop = False
     drop_reason = []
 
@@ -94,8 +95,10 @@ def parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter,
     '''根据parse_mode，构造spans'''
     if parse_mode == "txt":
         """ocr 中文本类的 span 用 pymu spans 替换！"""
+        if text_layer is None:
+            text_layer = PdfTextLayer(pdf_docs)
         pymu_spans = txt_spans_extract(
-            pdf_docs[page_id], inline_equations, interline_equations
+            text_layer, page_id, inline_equations, interline_equations
         )
         spans = replace_text_span(pymu_spans, spans)
     elif parse_mode == "ocr":
@@ -190,30 +193,76 @@ def parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter,
     return page_info
 
 
-def pdf_parse_union(pdf_bytes,
-                    model_list,
-                    imageWriter,
-                    parse_mode,
-                    start_page_id=0,
-                    end_page_id=None,
-                    debug_mode=False,
-                    ):
-    pdf_bytes_md5 = compute_md5(pdf_bytes)
-    pdf_docs = fitz.open("pdf", pdf_bytes)
+# 并行解析时每个子进程各自打开的pdf文档和图片writer
+_parse_worker_state = {}
+
 
-    '''初始化空的pdf_info_dict'''
-    pdf_info_dict = {}
+def init_parse_worker(pdf_bytes, imageWriter):
+    _parse_worker_state["pdf_docs"] = fitz.open("pdf", pdf_bytes)
+    _parse_worker_state["text_layer"] = PdfTextLayer(_parse_worker_state["pdf_docs"])
+    _parse_worker_state["imageWriter"] = imageWriter
 
-    '''用model_list和docs对象初始化magic_model'''
-    magic_model = MagicModel(model_list, pdf_docs)
 
-    '''根据输入的起始范围解析pdf'''
-    end_page_id = end_page_id if end_page_id else len(pdf_docs) - 1
+def parse_pages_in_worker(model_list, page_ids, pdf_bytes_md5, parse_mode):
+    """
+    在子进程中解析一组页面，model_list中只有page_ids对应的页有数据，其余为None
+    """
+    pdf_docs = _parse_worker_state["pdf_docs"]
+    magic_model = MagicModel(model_list, pdf_docs, lazy=True)
+    return [
+        parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, _parse_worker_state["imageWriter"], parse_mode,
+                        _parse_worker_state["text_layer"])
+        for page_id in page_ids
+    ]
+
+
+def parse_pages_parallel(pdf_bytes, model_list, imageWriter, parse_mode, page_ids, pdf_bytes_md5, parse_workers):
+    """
+    把页面按连续的小段分给多个进程解析，按页码顺序逐页yield page_info
+    """
+    chunk_size = max(math.ceil(len(page_ids) / (parse_workers * 4)), 1)
+    chunks = [page_ids[i:i + chunk_size] for i in range(0, len(page_ids), chunk_size)]
+    chunk_model_lists = []
+    for chunk in chunks:
+        chunk_model_list = [None] * len(model_list)
+        for page_id in chunk:
+            chunk_model_list[page_id] = model_list[page_id]
+        chunk_model_lists.append(chunk_model_list)
+
+    with ProcessPoolExecutor(max_workers=min(parse_workers, len(chunks)), initializer=init_parse_worker,
+                             initargs=(pdf_bytes, imageWriter)) as executor:
+        for chunk_page_infos in executor.map(parse_pages_in_worker, chunk_model_lists, chunks,
+                                             [pdf_bytes_md5] * len(chunks), [parse_mode] * len(chunks)):
+            yield from chunk_page_infos
+
+
+def iter_parse_pages(pdf_session: PdfSession, model_list, imageWriter, parse_mode, page_ids, debug_mode=False,
+                     parse_workers=1):
+    """
+    按页码顺序逐页yield (page_id, page_info)，尚未分段
+    串行解析时使用session中的文档和文本层，并行解析时每个子进程各自打开pdf
+    """
+    pdf_bytes_md5 = pdf_session.md5
+    if parse_workers > 1 and len(page_ids) > 1:
+        start_time = time.time()
+        for page_id, page_info in zip(page_ids, parse_pages_parallel(pdf_session.pdf_bytes, model_list, imageWriter,
+                                                                     parse_mode, page_ids, pdf_bytes_md5,
+                                                                     parse_workers)):
+            yield page_id, page_info
+        if debug_mode:
+            logger.info(f"parse {len(page_ids)} pages with {parse_workers} workers, cost_time: {get_delta_time(start_time)}")
+        return
+
+    pdf_docs = pdf_session.doc
+
+    '''用model_list和docs对象初始化magic_model，只对要解析的页做模型数据修正'''
+    magic_model = MagicModel(model_list, pdf_docs, lazy=True)
+    text_layer = pdf_session.text_layer
 
     '''初始化启动时间'''
     start_time = time.time()
 
-    for page_id in range(start_page_id, end_page_id + 1):
+    for page_id in page_ids:
 
         '''debug时输出每页解析的耗时'''
         if debug_mode:
@@ -224,14 +273,58 @@ def pdf_parse_union(pdf_bytes,
             start_time = time_now
 
         '''解析pdf中的每一页'''
-        page_info = parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter, parse_mode)
-        pdf_info_dict[f"page_{page_id}"] = page_info
+        yield page_id, parse_page_core(pdf_docs, magic_model, page_id, pdf_bytes_md5, imageWriter, parse_mode,
+                                       text_layer)
+
+
+def pdf_parse_union_stream(pdf_bytes,
+                           model_list,
+                           imageWriter,
+                           parse_mode,
+                           start_page_id=0,
+                           end_page_id=None,
+                           debug_mode=False,
+                           page_list=None,
+                           parse_workers=1,
+                           pdf_session: PdfSession = None,
+                           ):
+    """
+    pdf_parse_union的流式版本，按页码顺序yield已完成分段的page_info(即pdf_info中的一项)
+    跨页段落连接只需要相邻页，解析完下一页后上一页就会被yield，可以逐页生成markdown/content_list
+    """
+    if pdf_session is None:
+        pdf_session = PdfSession(pdf_bytes)
+
+    '''根据输入的起始范围解析pdf，page_list不为None时只解析其中列出的页'''
+    page_ids = resolve_page_ids(pdf_session.page_count, start_page_id, end_page_id, page_list)
+
+    pages = (page_info for _, page_info in iter_parse_pages(pdf_session, model_list, imageWriter, parse_mode, page_ids,
+                                                            debug_mode, parse_workers))
 
     """分段"""
-    para_split(pdf_info_dict, debug_mode=debug_mode)
+    yield from para_split_stream(pages, debug_mode=debug_mode)
 
-    """dict转list"""
-    pdf_info_list = dict_to_list(pdf_info_dict)
+
+def pdf_parse_union(pdf_bytes,
+                    model_list,
+                    imageWriter,
+                    parse_mode,
+                    start_page_id=0,
+                    end_page_id=None,
+                    debug_mode=False,
+                    page_list=None,
+                    parse_workers=1,
+                    pdf_session: PdfSession = None,
+                    ):
+    """
+    parse_workers大于1时用多进程并行解析各页，每个进程各自打开pdf、写入图片；
+    并行模式下model_list不会被原地修改
+    pdf_session: 与分类、推理共用的PdfSession，为None时新建
+    """
+    pdf_info_list = list(pdf_parse_union_stream(pdf_bytes, model_list, imageWriter, parse_mode,
+                                                start_page_id=start_page_id, end_page_id=end_page_id,
+                                                debug_mode=debug_mode, page_list=page_list,
+                                                parse_workers=parse_workers, pdf_session=pdf_session))
     new_pdf_info_dict = {
         "pdf_info": pdf_info_list,
     }
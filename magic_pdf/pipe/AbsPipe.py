@@ -4,6 +4,7 @@ from magic_pdf.dict2md.ocr_mkcontent import union_make
 from magic_pdf.filter.pdf_classify_by_type import classify
 from magic_pdf.filter.pdf_meta_scan import pdf_meta_scan
 from magic_pdf.libs.MakeContentConfig import MakeMode, DropMode
+from magic_pdf.libs.pdf_session import PdfSession
 from magic_pdf.rw.AbsReaderWriter import AbsReaderWriter
 from magic_pdf.libs.drop_reason import DropReason
 from magic_pdf.libs.json_compressor import JsonCompressor
@@ -16,12 +17,21 @@ class AbsPipe(ABC):
     PIP_OCR = "ocr"
     PIP_TXT = "txt"
 
-    def __init__(self, pdf_bytes: bytes, model_list: list, image_writer: AbsReaderWriter, is_debug: bool = False):
+    def __init__(self, pdf_bytes: bytes, model_list: list, image_writer: AbsReaderWriter, is_debug: bool = False,
+                 start_page_id=0, end_page_id=None, page_list=None, parse_workers=1):
         self.pdf_bytes = pdf_bytes
         self.model_list = model_list
         self.image_writer = image_writer
         self.pdf_mid_data = None  # 未压缩
         self.is_debug = is_debug
+        # 只推理和解析start_page_id到end_page_id(包含)之间的页，page_list不为None时只处理其中列出的页
+        self.start_page_id = start_page_id
+        self.end_page_id = end_page_id
+        self.page_list = page_list
+        # 解析阶段并行的进程数
+        self.parse_workers = parse_workers
+        # 分类、推理、解析共用，pdf只打开一次、md5只计算一次
+        self.pdf_session = PdfSession(pdf_bytes)
     
     def get_compress_pdf_mid_data(self):
         return JsonCompressor.compress_json(self.pdf_mid_data)
@@ -56,11 +66,12 @@ class AbsPipe(ABC):
         return md_content
 
     @staticmethod
-    def classify(pdf_bytes: bytes) -> str:
+    def classify(pdf_bytes: bytes, pdf_session: PdfSession = None, page_budget: int = None) -> str:
         """
         根据pdf的元数据，判断是文本pdf，还是ocr pdf
+        page_budget: 超大pdf只抽样扫描这么多页，None表示扫描全部页
         """
-        pdf_meta = pdf_meta_scan(pdf_bytes)
+        pdf_meta = pdf_meta_scan(pdf_bytes, pdf_session, page_budget)
         if pdf_meta.get("_need_drop", False):  # 如果返回了需要丢弃的标志，则抛出异常
             raise Exception(f"pdf meta_scan need_drop,reason is {pdf_meta['_drop_reason']}")
         else:
@@ -69,8 +80,9 @@ class AbsPipe(ABC):
             if is_encrypted or is_needs_password:  # 加密的，需要密码的，没有页面的，都不处理
                 raise Exception(f"pdf meta_scan need_drop,reason is {DropReason.ENCRYPTED}")
             else:
+                # 抽样扫描时各页特征只包含抽到的页，按抽到的页数分类
                 is_text_pdf, results = classify(
-                    pdf_meta["total_page"],
+                    len(pdf_meta["text_len_per_page"]),
                     pdf_meta["page_width_pts"],
                     pdf_meta["page_height_pts"],
                     pdf_meta["image_info_per_page"],
@@ -2,6 +2,7 @@ import json
 
 from loguru import logger
 
+from magic_pdf.libs.config_reader import get_meta_scan_page_budget
 from magic_pdf.libs.MakeContentConfig import DropMode, MakeMode
 from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
 from magic_pdf.rw.AbsReaderWriter import AbsReaderWriter
@@ -13,30 +14,48 @@ from magic_pdf.user_api import parse_union_pdf, parse_ocr_pdf
 
 class UNIPipe(AbsPipe):
 
-    def __init__(self, pdf_bytes: bytes, jso_useful_key: dict, image_writer: AbsReaderWriter, is_debug: bool = False):
+    def __init__(self, pdf_bytes: bytes, jso_useful_key: dict, image_writer: AbsReaderWriter, is_debug: bool = False,
+                 start_page_id=0, end_page_id=None, page_list=None, parse_workers=1,
+                 meta_scan_page_budget=None):
+        """
+        meta_scan_page_budget: 分类时超大pdf只抽样扫描这么多页，None时读取magic-pdf.json中的meta-scan配置
+        """
         self.pdf_type = jso_useful_key["_pdf_type"]
-        super().__init__(pdf_bytes, jso_useful_key["model_list"], image_writer, is_debug)
+        super().__init__(pdf_bytes, jso_useful_key["model_list"], image_writer, is_debug, start_page_id, end_page_id,
+                         page_list, parse_workers)
         if len(self.model_list) == 0:
             self.input_model_is_empty = True
         else:
             self.input_model_is_empty = False
+        if meta_scan_page_budget is None:
+            meta_scan_page_budget = get_meta_scan_page_budget()
+        self.meta_scan_page_budget = meta_scan_page_budget
 
     def pipe_classify(self):
-        self.pdf_type = AbsPipe.classify(self.pdf_bytes)
+        self.pdf_type = AbsPipe.classify(self.pdf_bytes, self.pdf_session, self.meta_scan_page_budget)
 
     def pipe_analyze(self):
         if self.pdf_type == self.PIP_TXT:
-            self.model_list = doc_analyze(self.pdf_bytes, ocr=False)
+            self.model_list = doc_analyze(self.pdf_bytes, ocr=False, start_page_id=self.start_page_id,
+                                          end_page_id=self.end_page_id, page_list=self.page_list,
+                                          pdf_session=self.pdf_session)
         elif self.pdf_type == self.PIP_OCR:
-            self.model_list = doc_analyze(self.pdf_bytes, ocr=True)
+            self.model_list = doc_analyze(self.pdf_bytes, ocr=True, start_page_id=self.start_page_id,
+                                          end_page_id=self.end_page_id, page_list=self.page_list,
+                                          pdf_session=self.pdf_session)
 
     def pipe_parse(self):
         if self.pdf_type == self.PIP_TXT:
             self.pdf_mid_data = parse_union_pdf(self.pdf_bytes, self.model_list, self.image_writer,
-                                                is_debug=self.is_debug, input_model_is_empty=self.input_model_is_empty)
+                                                is_debug=self.is_debug, input_model_is_empty=self.input_model_is_empty,
+                                                start_page=self.start_page_id, end_page=self.end_page_id,
+                                                page_list=self.page_list, parse_workers=self.parse_workers,
+                                                pdf_session=self.pdf_session)
         elif self.pdf_type == self.PIP_OCR:
             self.pdf_mid_data = parse_ocr_pdf(self.pdf_bytes, self.model_list, self.image_writer,
-                                              is_debug=self.is_debug)
+                                              is_debug=self.is_debug, start_page=self.start_page_id,
+                                              end_page=self.end_page_id, page_list=self.page_list,
+                                              parse_workers=self.parse_workers, pdf_session=self.pdf_session)
 
     def pipe_mk_uni_format(self, img_parent_path: str, drop_mode=DropMode.WHOLE_PDF):
         result = super().pipe_mk_uni_format(img_parent_path, drop_mode)
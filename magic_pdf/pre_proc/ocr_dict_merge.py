@@ -1,7 +1,8 @@
 from loguru import logger
 
 from magic_pdf.libs.boxbase import __is_overlaps_y_exceeds_threshold, get_minbox_if_overlap_by_ratio, \
-    calculate_overlap_area_in_bbox1_area_ratio, _is_in_or_part_overlap_with_area_ratio
+    calculate_overlap_area_in_bbox1_area_ratio, _is_in_or_part_overlap_with_area_ratio, build_bbox_grid_index, \
+    query_bbox_grid_index
 from magic_pdf.libs.drop_tag import DropTag
 from magic_pdf.libs.ocr_content_type import ContentType, BlockType
 from magic_pdf.pre_proc.ocr_span_list_modify import modify_y_axis, modify_inline_equation
@@ -146,6 +147,9 @@ def fill_spans_in_blocks(blocks, spans, radio):
     将allspans中的span按位置关系，放入blocks中
     '''
     block_with_spans = []
+    # 只检查与block所在网格相交的span，每个span只放入第一个满足条件的block
+    span_grid_index = build_bbox_grid_index([span['bbox'] for span in spans])
+    used = [False] * len(spans)
     for block in blocks:
         block_type = block[7]
         block_bbox = block[0:4]
@@ -154,10 +158,14 @@ def fill_spans_in_blocks(blocks, spans, radio):
             'bbox': block_bbox,
         }
         block_spans = []
-        for span in spans:
+        for idx in query_bbox_grid_index(span_grid_index, block_bbox):
+            if used[idx]:
+                continue
+            span = spans[idx]
             span_bbox = span['bbox']
             if calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > radio:
                 block_spans.append(span)
+                used[idx] = True
 
         '''行内公式调整, 高度调整至与同行文字高度一致(优先左侧, 其次右侧)'''
         # displayed_list = []
@@ -173,10 +181,8 @@ def fill_spans_in_blocks(blocks, spans, radio):
         block_dict['spans'] = block_spans
         block_with_spans.append(block_dict)
 
-        # 从spans删除已经放入block_spans中的span
-        if len(block_spans) > 0:
-            for span in block_spans:
-                spans.remove(span)
+    # 从spans删除已经放入block_spans中的span
+    spans[:] = [span for idx, span in enumerate(spans) if not used[idx]]
 
     return block_with_spans, spans
 
@@ -1,54 +1,92 @@
 from loguru import logger
 
 from magic_pdf.libs.boxbase import calculate_overlap_area_in_bbox1_area_ratio, get_minbox_if_overlap_by_ratio, \
-    __is_overlaps_y_exceeds_threshold, calculate_iou
+    __is_overlaps_y_exceeds_threshold, calculate_iou, get_overlapping_bbox_pairs
 from magic_pdf.libs.drop_tag import DropTag
 from magic_pdf.libs.ocr_content_type import ContentType, BlockType
 
 
+def span_value_key(value):
+    """
+    把span(或其中的字段)转成可哈希的key，值相等(==)的两个span得到相同的key
+    """
+    if isinstance(value, dict):
+        return dict, tuple(sorted((k, span_value_key(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(span_value_key(v) for v in value)
+    return value
+
+
+def group_overlapping_spans(spans):
+    """
+    值相等的span之间不做比较，按值分组：返回每组第一个出现的span的下标，以及每组与之bbox相交的其它组(按组的出现顺序排列)
+    """
+    first_idxes = []
+    seen_keys = set()
+    for idx, span in enumerate(spans):
+        key = span_value_key(span)
+        if key not in seen_keys:
+            seen_keys.add(key)
+            first_idxes.append(idx)
+    neighbors = [[] for _ in first_idxes]
+    for i, j in get_overlapping_bbox_pairs([spans[idx]['bbox'] for idx in first_idxes]):
+        neighbors[i].append(j)
+        neighbors[j].append(i)
+    for group_neighbors in neighbors:
+        group_neighbors.sort()
+    return first_idxes, neighbors
+
+
+def drop_overlap_spans(spans, dropped_spans):
+    if len(dropped_spans) > 0:
+        dropped_span_ids = set(id(span) for span in dropped_spans)
+        spans[:] = [span for span in spans if id(span) not in dropped_span_ids]
+        for span_need_remove in dropped_spans:
+            span_need_remove['tag'] = DropTag.SPAN_OVERLAP
+
+
 def remove_overlaps_low_confidence_spans(spans):
     dropped_spans = []
     #  删除重叠spans中置信度低的的那些
-    for span1 in spans:
-        for span2 in spans:
-            if span1 != span2:
-                # span1 或 span2 任何一个都不应该在 dropped_spans 中
-                if span1 in dropped_spans or span2 in dropped_spans:
-                    continue
+    #  值相等的span视为同一个，其中一个被删除后其余的也不再参与比较，只删除第一个出现的
+    first_idxes, neighbors = group_overlapping_spans(spans)
+    dropped_groups = set()
+    for i in range(len(first_idxes)):
+        for j in neighbors[i]:
+            # span1 或 span2 任何一个都不应该在 dropped_spans 中
+            if i in dropped_groups or j in dropped_groups:
+                continue
+            span1, span2 = spans[first_idxes[i]], spans[first_idxes[j]]
+            if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
+                if span1['score'] < span2['score']:
+                    dropped_groups.add(i)
+                    dropped_spans.append(span1)
                 else:
-                    if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
-                        if span1['score'] < span2['score']:
-                            span_need_remove = span1
-                        else:
-                            span_need_remove = span2
-                        if span_need_remove is not None and span_need_remove not in dropped_spans:
-                            dropped_spans.append(span_need_remove)
-
-    if len(dropped_spans) > 0:
-        for span_need_remove in dropped_spans:
-            spans.remove(span_need_remove)
-            span_need_remove['tag'] = DropTag.SPAN_OVERLAP
+                    dropped_groups.add(j)
+                    dropped_spans.append(span2)
 
+    drop_overlap_spans(spans, dropped_spans)
     return spans, dropped_spans
 
 
 def remove_overlaps_min_spans(spans):
     dropped_spans = []
-    #  删除重叠spans中较小的那些
-    for span1 in spans:
-        for span2 in spans:
-            if span1 != span2:
-                overlap_box = get_minbox_if_overlap_by_ratio(span1['bbox'], span2['bbox'], 0.65)
-                if overlap_box is not None:
-                    span_need_remove = next((span for span in spans if span['bbox'] == overlap_box), None)
-                    if span_need_remove is not None and span_need_remove not in dropped_spans:
-                        dropped_spans.append(span_need_remove)
-
-    if len(dropped_spans) > 0:
-        for span_need_remove in dropped_spans:
-            spans.remove(span_need_remove)
-            span_need_remove['tag'] = DropTag.SPAN_OVERLAP
-
+    #  删除重叠spans中较小的那些，删除的是bbox与较小的bbox相同的第一个span
+    first_idxes, neighbors = group_overlapping_spans(spans)
+    first_span_by_bbox = {}
+    for span in spans:
+        first_span_by_bbox.setdefault(span_value_key(span['bbox']), span)
+    dropped_span_ids = set()
+    for i in range(len(first_idxes)):
+        for j in neighbors[i]:
+            overlap_box = get_minbox_if_overlap_by_ratio(spans[first_idxes[i]]['bbox'], spans[first_idxes[j]]['bbox'], 0.65)
+            if overlap_box is not None:
+                span_need_remove = first_span_by_bbox[span_value_key(overlap_box)]
+                if id(span_need_remove) not in dropped_span_ids:
+                    dropped_span_ids.add(id(span_need_remove))
+                    dropped_spans.append(span_need_remove)
+
+    drop_overlap_spans(spans, dropped_spans)
     return spans, dropped_spans
 
 
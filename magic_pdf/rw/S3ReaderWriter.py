@@ -16,6 +16,17 @@ class S3ReaderWriter(AbsReaderWriter):
     ):
         self.client = self._get_client(ak, sk, endpoint_url, addressing_style)
         self.path = parent_path
+        # 传给子进程时不序列化client，在子进程中重新创建
+        self.client_args = (ak, sk, endpoint_url, addressing_style)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["client"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.client = self._get_client(*self.client_args)
 
     def _get_client(self, ak: str, sk: str, endpoint_url: str, addressing_style: str):
         s3_client = boto3.client(
@@ -7,6 +7,7 @@ from magic_pdf.rw.DiskReaderWriter import DiskReaderWriter
 from magic_pdf.rw.AbsReaderWriter import AbsReaderWriter
 import magic_pdf.model as model_config
 from magic_pdf.tools.common import parse_pdf_methods, do_parse
+from magic_pdf.libs.page_range import parse_page_list
 from magic_pdf.libs.version import __version__
 
 
@@ -40,7 +41,45 @@ auto: automatically choose the best method for parsing pdf from ocr and txt.
 without method specified, auto will be used by default.""",
     default="auto",
 )
-def cli(path, output_dir, method):
+@click.option(
+    "-s",
+    "--start",
+    "start_page_id",
+    type=int,
+    help="the starting page for parsing pdf, beginning from 0.",
+    default=0,
+)
+@click.option(
+    "-e",
+    "--end",
+    "end_page_id",
+    type=int,
+    help="the ending page for parsing pdf (inclusive), beginning from 0. the last page by default.",
+    default=None,
+)
+@click.option(
+    "--pages",
+    "pages",
+    type=str,
+    help="only parse the listed pages, beginning from 0, e.g. 0-9,15,20-25.",
+    default=None,
+)
+@click.option(
+    "--parse-workers",
+    "parse_workers",
+    type=click.IntRange(min=1),
+    help="the number of processes used to parse pages in parallel after model inference.",
+    default=1,
+)
+@click.option(
+    "--meta-scan-page-budget",
+    "meta_scan_page_budget",
+    type=click.IntRange(min=1),
+    help="in auto method, only sample this many pages of a large pdf for classification. "
+         "read from 'meta-scan' in magic-pdf.json by default.",
+    default=None,
+)
+def cli(path, output_dir, method, start_page_id, end_page_id, pages, parse_workers, meta_scan_page_budget):
     model_config.__use_inside_model__ = True
     model_config.__model_mode__ = "full"
     if output_dir == "":
@@ -48,6 +87,7 @@ def cli(path, output_dir, method):
             output_dir = os.path.join(path, "output")
         else:
             output_dir = os.path.join(os.path.dirname(path), "output")
+    page_list = parse_page_list(pages) if pages is not None else None
 
     def read_fn(path):
         disk_rw = DiskReaderWriter(os.path.dirname(path))
@@ -63,6 +103,11 @@ def cli(path, output_dir, method):
                 pdf_data,
                 [],
                 method,
+                start_page_id=start_page_id,
+                end_page_id=end_page_id,
+                page_list=page_list,
+                parse_workers=parse_workers,
+                meta_scan_page_budget=meta_scan_page_budget,
             )
 
         except Exception as e:
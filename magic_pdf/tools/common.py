@@ -38,6 +38,11 @@ def do_parse(
     f_dump_content_list=False,
     f_make_md_mode=MakeMode.MM_MD,
     f_draw_model_bbox=False,
+    start_page_id=0,
+    end_page_id=None,
+    page_list=None,
+    parse_workers=1,
+    meta_scan_page_budget=None,
 ):
     orig_model_list = copy.deepcopy(model_list)
     local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
@@ -49,11 +54,15 @@ def do_parse(
 
     if parse_method == "auto":
         jso_useful_key = {"_pdf_type": "", "model_list": model_list}
-        pipe = UNIPipe(pdf_bytes, jso_useful_key, image_writer, is_debug=True)
+        pipe = UNIPipe(pdf_bytes, jso_useful_key, image_writer, is_debug=True, start_page_id=start_page_id,
+                       end_page_id=end_page_id, page_list=page_list, parse_workers=parse_workers,
+                       meta_scan_page_budget=meta_scan_page_budget)
     elif parse_method == "txt":
-        pipe = TXTPipe(pdf_bytes, model_list, image_writer, is_debug=True)
+        pipe = TXTPipe(pdf_bytes, model_list, image_writer, is_debug=True, start_page_id=start_page_id,
+                       end_page_id=end_page_id, page_list=page_list, parse_workers=parse_workers)
     elif parse_method == "ocr":
-        pipe = OCRPipe(pdf_bytes, model_list, image_writer, is_debug=True)
+        pipe = OCRPipe(pdf_bytes, model_list, image_writer, is_debug=True, start_page_id=start_page_id,
+                       end_page_id=end_page_id, page_list=page_list, parse_workers=parse_workers)
     else:
         logger.error("unknown parse method")
         exit(1)
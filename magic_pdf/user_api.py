@@ -25,8 +25,8 @@ PARSE_TYPE_TXT = "txt"
 PARSE_TYPE_OCR = "ocr"
 
 
-def parse_txt_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWriter, is_debug=False, start_page=0, *args,
-                  **kwargs):
+def parse_txt_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWriter, is_debug=False, start_page=0,
+                  end_page=None, page_list=None, parse_workers=1, pdf_session=None, *args, **kwargs):
     """
     解析文本类pdf
     """
@@ -35,7 +35,11 @@ def parse_txt_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWrit
         pdf_models,
         imageWriter,
         start_page_id=start_page,
+        end_page_id=end_page,
         debug_mode=is_debug,
+        page_list=page_list,
+        parse_workers=parse_workers,
+        pdf_session=pdf_session,
     )
 
     pdf_info_dict["_parse_type"] = PARSE_TYPE_TXT
@@ -45,8 +49,8 @@ def parse_txt_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWrit
     return pdf_info_dict
 
 
-def parse_ocr_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWriter, is_debug=False, start_page=0, *args,
-                  **kwargs):
+def parse_ocr_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWriter, is_debug=False, start_page=0,
+                  end_page=None, page_list=None, parse_workers=1, pdf_session=None, *args, **kwargs):
     """
     解析ocr类pdf
     """
@@ -55,7 +59,11 @@ def parse_ocr_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWrit
         pdf_models,
         imageWriter,
         start_page_id=start_page,
+        end_page_id=end_page,
         debug_mode=is_debug,
+        page_list=page_list,
+        parse_workers=parse_workers,
+        pdf_session=pdf_session,
     )
 
     pdf_info_dict["_parse_type"] = PARSE_TYPE_OCR
@@ -66,8 +74,8 @@ def parse_ocr_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWrit
 
 
 def parse_union_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWriter, is_debug=False, start_page=0,
-                    input_model_is_empty: bool = False,
-                    *args, **kwargs):
+                    input_model_is_empty: bool = False, end_page=None, page_list=None, parse_workers=1,
+                    pdf_session=None, *args, **kwargs):
     """
     ocr和文本混合的pdf，全部解析出来
     """
@@ -79,7 +87,11 @@ def parse_union_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWr
                 pdf_models,
                 imageWriter,
                 start_page_id=start_page,
+                end_page_id=end_page,
                 debug_mode=is_debug,
+                page_list=page_list,
+                parse_workers=parse_workers,
+                pdf_session=pdf_session,
             )
         except Exception as e:
             logger.exception(e)
@@ -89,7 +101,8 @@ def parse_union_pdf(pdf_bytes: bytes, pdf_models: list, imageWriter: AbsReaderWr
     if pdf_info_dict is None or pdf_info_dict.get("_need_drop", False):
         logger.warning(f"parse_pdf_by_txt drop or error, switch to parse_pdf_by_ocr")
         if input_model_is_empty:
-            pdf_models = doc_analyze(pdf_bytes, ocr=True)
+            pdf_models = doc_analyze(pdf_bytes, ocr=True, start_page_id=start_page, end_page_id=end_page,
+                                     page_list=page_list, pdf_session=pdf_session)
         pdf_info_dict = parse_pdf(parse_pdf_by_ocr)
         if pdf_info_dict is None:
             raise Exception("Both parse_pdf_by_txt and parse_pdf_by_ocr failed.")